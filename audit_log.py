@@ -0,0 +1,272 @@
+"""
+Audit Log
+Buffered, rotating writer for login_attempts.log with indexed queries.
+
+Lines keep the original format:
+
+    <iso timestamp> | IP: <ip> | <STATUS> | <message>
+
+Appends go to an in-memory buffer that is flushed every `flush_interval`
+seconds or once `flush_size` lines are waiting. When the active file grows
+past `max_bytes` or its first entry is older than `max_age` seconds it is
+rotated to <name>.<stamp>.log.gz next to a small <name>.<stamp>.idx.json
+index (time range, per-IP and per-status counts). Queries use those indexes
+to skip every segment that cannot contain a match.
+
+Flushes, rotations and queries hold an flock on <name>.log.lock, so several
+server processes can share one log; a process notices another one's appends
+or rotation from the active file's stat signature and re-reads its index.
+"""
+
+import glob
+import gzip
+import json
+import os
+import shutil
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows; single-process use only
+    fcntl = None
+
+
+def parse_line(line: str):
+    """Parse one log line into a dict (None if malformed)"""
+    parts = line.rstrip('\n').split(' | ', 3)
+    if len(parts) < 3 or not parts[1].startswith('IP: '):
+        return None
+    return {
+        'timestamp': parts[0],
+        'ip': parts[1][4:].strip(),
+        'status': parts[2].strip(),
+        'message': parts[3] if len(parts) > 3 else ''
+    }
+
+
+def _new_index():
+    return {'first': None, 'last': None, 'count': 0, 'ips': {}, 'statuses': {}}
+
+
+def _index_add(index, entry):
+    if index['first'] is None:
+        index['first'] = entry['timestamp']
+    index['last'] = entry['timestamp']
+    index['count'] += 1
+    index['ips'][entry['ip']] = index['ips'].get(entry['ip'], 0) + 1
+    index['statuses'][entry['status']] = index['statuses'].get(entry['status'], 0) + 1
+
+
+def _index_may_match(index, ip, status, start, end):
+    if not index['count']:
+        return False
+    if ip and ip not in index['ips']:
+        return False
+    if status and status not in index['statuses']:
+        return False
+    if start and datetime.fromisoformat(index['last']) < start:
+        return False
+    if end and datetime.fromisoformat(index['first']) > end:
+        return False
+    return True
+
+
+class AuditLog:
+    """Buffered append-only log with size/age rotation and indexed segments"""
+
+    def __init__(self, path, flush_interval=2.0, flush_size=100,
+                 max_bytes=5 * 1024 * 1024, max_age=86400, max_segments=90):
+        self.path = path
+        self.base = path[:-len('.log')] if path.endswith('.log') else path
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.max_segments = max_segments
+
+        self._buffer = []
+        self._lock = threading.Lock()  # guards the buffer
+        self._io_lock = threading.Lock()  # guards the files and the active index
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._active = None
+        self._active_signature = None
+        with self._io_lock, self._file_lock():
+            self._refresh_active()
+
+    def _signature(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_size)
+
+    def _refresh_active(self):
+        """(Re)build the active file's index if someone else changed the file"""
+        signature = self._signature()
+        if self._active is not None and signature == self._active_signature:
+            return
+        index = _new_index()
+        if signature is not None:
+            with open(self.path, 'r') as f:
+                for line in f:
+                    entry = parse_line(line)
+                    if entry:
+                        _index_add(index, entry)
+        self._active = index
+        self._active_signature = signature
+
+    @contextmanager
+    def _file_lock(self):
+        """Exclusive lock shared with other processes using the same log"""
+        if fcntl is None:
+            yield
+            return
+        with open(self.path + '.lock', 'a') as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            yield
+
+    # ------------------------------------------------------------------
+    # Writing
+    # ------------------------------------------------------------------
+
+    def write(self, ip, status, message='', timestamp=None):
+        """Queue one entry; flushed in the background"""
+        timestamp = timestamp or datetime.now().isoformat()
+        with self._lock:
+            self._buffer.append(f"{timestamp} | IP: {ip:15} | {status:7} | {message}\n")
+            if len(self._buffer) >= self.flush_size:
+                self._wakeup.set()
+
+    def flush(self):
+        """Write buffered entries to the active file, rotating if needed"""
+        with self._lock:
+            lines, self._buffer = self._buffer, []
+
+        with self._io_lock, self._file_lock():
+            self._refresh_active()
+            if lines:
+                with open(self.path, 'a') as f:
+                    f.writelines(lines)
+                for line in lines:
+                    entry = parse_line(line)
+                    if entry:
+                        _index_add(self._active, entry)
+                self._active_signature = self._signature()
+            if self._should_rotate():
+                self._rotate()
+
+    def _should_rotate(self):
+        if not self._active['count']:
+            return False
+        if os.path.getsize(self.path) >= self.max_bytes:
+            return True
+        age = datetime.now() - datetime.fromisoformat(self._active['first'])
+        return age.total_seconds() >= self.max_age
+
+    def _rotate(self):
+        stamp = datetime.now().strftime('%Y%m%dT%H%M%S%f')
+        segment = f'{self.base}.{stamp}'
+
+        with open(self.path, 'rb') as src, gzip.open(segment + '.log.gz', 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+        with open(segment + '.idx.json', 'w') as f:
+            json.dump(self._active, f)
+        os.remove(self.path)
+        self._active = _new_index()
+        self._active_signature = None
+
+        # Retention: drop the oldest segments beyond max_segments
+        for old in self._segments()[:-self.max_segments or None]:
+            os.remove(old + '.log.gz')
+            if os.path.exists(old + '.idx.json'):
+                os.remove(old + '.idx.json')
+
+    def start(self, on_error=None):
+        """Start the background flush thread (failures go to on_error(e))"""
+        if self._thread is not None:
+            return
+
+        def run():
+            while True:
+                self._wakeup.wait(self.flush_interval)
+                self._wakeup.clear()
+                try:
+                    self.flush()
+                except Exception as e:
+                    if on_error is not None:
+                        on_error(e)
+
+        self._thread = threading.Thread(target=run, name='audit-log', daemon=True)
+        self._thread.start()
+
+    # ------------------------------------------------------------------
+    # Querying
+    # ------------------------------------------------------------------
+
+    def _segments(self):
+        """Rotated segment prefixes, oldest first"""
+        return sorted(path[:-len('.log.gz')] for path in glob.glob(f'{glob.escape(self.base)}.*.log.gz'))
+
+    def _segment_index(self, segment):
+        try:
+            with open(segment + '.idx.json', 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            # Missing index: rebuild it from the segment
+            index = _new_index()
+            with gzip.open(segment + '.log.gz', 'rt') as f:
+                for line in f:
+                    entry = parse_line(line)
+                    if entry:
+                        _index_add(index, entry)
+            return index
+
+    def query(self, ip=None, status=None, start=None, end=None, limit=100):
+        """Newest-first entries matching all given filters
+
+        start/end are datetimes; returns (entries, segments scanned, segments skipped).
+        """
+        if limit < 1:
+            raise ValueError(f'limit must be at least 1, not {limit}')
+        self.flush()
+
+        # Hold the locks so a rotation can't move files mid-scan
+        with self._io_lock, self._file_lock():
+            self._refresh_active()
+            sources = [(self.path, self._active, False)]
+            sources += [(segment, None, True) for segment in reversed(self._segments())]
+
+            results = []
+            scanned = skipped = 0
+            for path, index, compressed in sources:
+                if len(results) >= limit:
+                    break
+                if index is None:
+                    index = self._segment_index(path)
+                if not _index_may_match(index, ip, status, start, end):
+                    skipped += 1
+                    continue
+
+                scanned += 1
+                opener = gzip.open(path + '.log.gz', 'rt') if compressed else open(path, 'r')
+                matches = []
+                with opener as f:
+                    for line in f:
+                        entry = parse_line(line)
+                        if not entry:
+                            continue
+                        if ip and entry['ip'] != ip:
+                            continue
+                        if status and entry['status'] != status:
+                            continue
+                        if start or end:
+                            when = datetime.fromisoformat(entry['timestamp'])
+                            if (start and when < start) or (end and when > end):
+                                continue
+                        matches.append(entry)
+                results.extend(reversed(matches))
+
+            return results[:limit], scanned, skipped
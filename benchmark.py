@@ -0,0 +1,499 @@
+#!/usr/bin/env python3
+"""
+Benchmark Harness
+Starts the server against a throwaway DATA_DIR plus a fake upstream stats API,
+drives traffic at it and reports latency, throughput and server CPU time.
+
+Each endpoint is first measured on its own (so the server's CPU time can be
+attributed to it), then a weighted mix of all of them runs concurrently.
+Results are printed as JSON (or written with --output) and can be compared
+with an earlier run:
+
+    python3 benchmark.py --output before.json
+    python3 benchmark.py --compare before.json --max-regression 0.15
+
+The fake upstream answers GET /api/v1/stats with configurable latency, failure
+rate and payload size. It listens on several ports (--upstream-origins) and the
+synthetic sites are spread over them, so per-origin connection pools, circuit
+breakers and adaptive timeouts see several sites, as in production. It can
+also run on its own:
+
+    python3 benchmark.py --fake-upstream-only --upstream-port 18080
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+PASSWORD = 'bench-password'
+OTP = '0000'
+ENDPOINTS = ('login', 'data_get', 'data_post', 'proxy_stats')
+DEFAULT_MIX = 'data_get=50,proxy_stats=35,data_post=10,login=5'
+
+
+# ----------------------------------------------------------------------
+# Fake upstream
+# ----------------------------------------------------------------------
+
+class FakeUpstream:
+    """Local stand-in for a site's /api/v1/stats endpoint"""
+
+    def __init__(self, port=0, latency=0.05, jitter=0.02, failure_rate=0.0, payload_bytes=512, origins=1):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.payload_bytes = payload_bytes
+        self.requests = 0
+        self._lock = threading.Lock()
+
+        upstream = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # keep-alive, like a real site
+
+            def do_GET(self):
+                with upstream._lock:
+                    upstream.requests += 1
+                delay = max(upstream.latency + random.uniform(-upstream.jitter, upstream.jitter), 0)
+                time.sleep(delay)
+
+                if not self.path.startswith('/api/v1/stats'):
+                    return self._send(404, {'error': 'Not found'})
+                if not self.headers.get('Authorization', '').startswith('Bearer '):
+                    return self._send(401, {'error': 'Unauthorized'})
+                if random.random() < upstream.failure_rate:
+                    return self._send(503, {'error': 'Unavailable'})
+
+                self._send(200, {
+                    'publishedArticles': random.randint(0, 500),
+                    'unpublishedArticles': random.randint(0, 50),
+                    'unusedIdeas': random.randint(0, 100),
+                    'hoursSinceLastPublished': round(random.uniform(0, 72), 1),
+                    'unreadMessages': random.randint(0, 20),
+                    'padding': 'x' * upstream.payload_bytes
+                })
+
+            def _send(self, status, payload):
+                body = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        # One server per origin (consecutive ports from `port`, or any free ones), sharing the counters
+        self.servers = []
+        for i in range(max(origins, 1)):
+            server = ThreadingHTTPServer(('127.0.0.1', port + i if port else 0), Handler)
+            server.daemon_threads = True
+            self.servers.append(server)
+        self.urls = [f'http://127.0.0.1:{server.server_address[1]}' for server in self.servers]
+        self.url = self.urls[0]
+
+    def start(self):
+        for i, server in enumerate(self.servers):
+            threading.Thread(target=server.serve_forever, name=f'fake-upstream-{i}', daemon=True).start()
+        return self
+
+    def stop(self):
+        for server in self.servers:
+            server.shutdown()
+
+
+# ----------------------------------------------------------------------
+# Server under test
+# ----------------------------------------------------------------------
+
+def process_tree_cpu(pid):
+    """User + system CPU seconds of a process and its descendants (Linux /proc; None elsewhere)"""
+    if not os.path.isdir('/proc'):
+        return None
+    ticks = os.sysconf('SC_CLK_TCK')
+    stats = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+        except OSError:
+            continue
+        # After the command name: state, ppid, ..., utime (12th), stime (13th)
+        stats[int(entry)] = (int(fields[1]), int(fields[11]) + int(fields[12]))
+
+    total = 0
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        if current in stats:
+            total += stats[current][1]
+        pending.extend(child for child, (parent, _) in stats.items() if parent == current)
+    return total / ticks
+
+
+class ServerProcess:
+    """The dashboard server running in a subprocess with its own DATA_DIR"""
+
+    def __init__(self, port, data_dir, gunicorn=False, workers=2, extra_env=None):
+        self.port = port
+        self.url = f'http://127.0.0.1:{port}'
+        self.data_dir = data_dir
+        self.gunicorn = gunicorn
+        self.workers = workers
+        self.extra_env = extra_env or {}
+        self.log_file = os.path.join(data_dir, 'server.log')
+        self.process = None
+        self.startup_seconds = None  # until /ready (warm-up included)
+
+    def start(self, timeout=30):
+        env = dict(os.environ)
+        env.update({
+            'PORT': str(self.port),
+            'RAILWAY_VOLUME_MOUNT_PATH': self.data_dir,
+            'DASHBOARD_PASSWORD': PASSWORD,
+            'DASHBOARD_OTP': OTP,
+            'LOG_LEVEL': 'warning',
+            'WEB_CONCURRENCY': str(self.workers)
+        })
+        env.update(self.extra_env)
+
+        if self.gunicorn:
+            command = ['gunicorn', '-c', 'gunicorn.conf.py', 'server:app']
+        else:
+            command = [sys.executable, 'server.py']
+
+        self._log = open(self.log_file, 'w')
+        started = time.monotonic()
+        self.process = subprocess.Popen(command, cwd=ROOT, env=env, stdout=self._log, stderr=subprocess.STDOUT)
+
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f'Server exited early; see {self.log_file}')
+            try:
+                response = requests.get(f'{self.url}/ready', timeout=1)
+                if response.status_code == 404:  # Older revisions: healthy is as good as it gets
+                    response = requests.get(f'{self.url}/health', timeout=1)
+                if response.ok:
+                    self.startup_seconds = round(time.monotonic() - started, 3)
+                    return self
+            except requests.RequestException:
+                pass
+            time.sleep(0.05)
+        raise RuntimeError(f'Server did not become ready within {timeout}s; see {self.log_file}')
+
+    def cpu_seconds(self):
+        return process_tree_cpu(self.process.pid)
+
+    def stop(self):
+        if self.process and self.process.poll() is None:
+            self.process.send_signal(signal.SIGTERM)
+            try:
+                self.process.wait(15)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        self._log.close()
+
+
+# ----------------------------------------------------------------------
+# Traffic
+# ----------------------------------------------------------------------
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    index = min(int(round(fraction * len(sorted_values) + 0.5)) - 1, len(sorted_values) - 1)
+    return sorted_values[max(index, 0)]
+
+
+def summarize(samples, duration):
+    """Latency/throughput summary for a list of (seconds, ok) samples"""
+    latencies = sorted(seconds * 1000 for seconds, _ in samples)
+    errors = sum(1 for _, ok in samples if not ok)
+    return {
+        'requests': len(samples),
+        'errors': errors,
+        'throughput_rps': round(len(samples) / duration, 2) if duration else None,
+        'latency_ms': {
+            'p50': round(percentile(latencies, 0.50), 3) if latencies else None,
+            'p95': round(percentile(latencies, 0.95), 3) if latencies else None,
+            'p99': round(percentile(latencies, 0.99), 3) if latencies else None,
+            'mean': round(sum(latencies) / len(latencies), 3) if latencies else None,
+            'max': round(latencies[-1], 3) if latencies else None
+        }
+    }
+
+
+class Client:
+    """One simulated dashboard user with a keep-alive HTTP session"""
+
+    def __init__(self, base_url, upstream_urls, sites):
+        self.base_url = base_url
+        self.session = requests.Session()
+        self.websites = [
+            {
+                'id': i,
+                'name': f'Site {i}',
+                'domain': upstream_urls[i % len(upstream_urls)],
+                'apiKey': f'bench-key-{i}',
+                'version': '1.0'
+            }
+            for i in range(sites)
+        ]
+        self.token = None
+        self.saves = 0
+
+    def login(self):
+        response = self.session.post(f'{self.base_url}/api/login', json={'password': PASSWORD, 'otp': OTP})
+        if response.ok:
+            self.token = response.json()['token']
+        return response.ok
+
+    def _headers(self):
+        return {'Authorization': f'Bearer {self.token}'}
+
+    def data_get(self):
+        return self.session.get(f'{self.base_url}/api/data', headers=self._headers()).ok
+
+    def data_post(self):
+        # Rename one website per save, like an edit in the dashboard
+        self.saves += 1
+        website = self.websites[self.saves % len(self.websites)]
+        website['name'] = f"Site {website['id']} rev {self.saves}"
+        response = self.session.post(f'{self.base_url}/api/data', json={'data': self.websites}, headers=self._headers())
+        return response.ok
+
+    def proxy_stats(self):
+        website = random.choice(self.websites)
+        response = self.session.post(
+            f'{self.base_url}/api/proxy-stats',
+            json={'domain': website['domain'], 'apiKey': website['apiKey']},
+            headers=self._headers()
+        )
+        return response.ok and response.json().get('isOnline', False)
+
+
+def run_phase(server, clients, operations, total_requests, concurrency):
+    """Run total_requests operations drawn from `operations` across the clients"""
+    per_endpoint = {name: [] for name in ENDPOINTS}
+    lock = threading.Lock()
+
+    def one(i):
+        client = clients[i % len(clients)]
+        name = operations(i)
+        started = time.perf_counter()
+        try:
+            ok = getattr(client, name)()
+        except requests.RequestException:
+            ok = False
+        elapsed = time.perf_counter() - started
+        with lock:
+            per_endpoint[name].append((elapsed, ok))
+
+    cpu_before = server.cpu_seconds()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(total_requests)))
+    duration = time.perf_counter() - started
+    cpu_after = server.cpu_seconds()
+
+    samples = [sample for values in per_endpoint.values() for sample in values]
+    result = summarize(samples, duration)
+    result['duration_s'] = round(duration, 3)
+    if cpu_before is not None and cpu_after is not None:
+        result['server_cpu_s'] = round(cpu_after - cpu_before, 3)
+        result['cpu_ms_per_request'] = round((cpu_after - cpu_before) * 1000 / len(samples), 3)
+    result['endpoints'] = {
+        name: summarize(values, duration) for name, values in per_endpoint.items() if values
+    }
+    return result
+
+
+def parse_mix(value):
+    weights = {}
+    for item in value.split(','):
+        name, _, weight = item.partition('=')
+        if name.strip() not in ENDPOINTS:
+            raise argparse.ArgumentTypeError(f'Unknown endpoint {name!r} (expected {", ".join(ENDPOINTS)})')
+        weights[name.strip()] = float(weight or 1)
+    return weights
+
+
+def run_benchmark(args):
+    upstream = FakeUpstream(
+        port=args.upstream_port,
+        latency=args.upstream_latency,
+        jitter=args.upstream_jitter,
+        failure_rate=args.upstream_failure_rate,
+        payload_bytes=args.upstream_payload_bytes,
+        origins=args.upstream_origins
+    ).start()
+
+    data_dir = tempfile.mkdtemp(prefix='dashboard-bench-')
+    extra_env = dict(item.split('=', 1) for item in args.server_env)
+    server = ServerProcess(args.port, data_dir, gunicorn=args.gunicorn, workers=args.workers, extra_env=extra_env)
+
+    try:
+        server.start()
+        clients = [Client(server.url, upstream.urls, args.sites) for _ in range(args.users)]
+        for client in clients:
+            client.login()
+            client.data_post()  # Every user starts with a saved website list
+
+        phases = {}
+        for name in ENDPOINTS:
+            print(f"[bench] {name}: {args.requests} requests", file=sys.stderr)
+            phases[name] = run_phase(server, clients, lambda i, name=name: name, args.requests, args.concurrency)
+
+        names = list(args.mix)
+        weights = [args.mix[name] for name in names]
+        choices = random.Random(args.seed).choices(names, weights, k=args.mix_requests)
+        print(f"[bench] mix: {args.mix_requests} requests", file=sys.stderr)
+        phases['mix'] = run_phase(server, clients, lambda i: choices[i], args.mix_requests, args.concurrency)
+
+        return {
+            'meta': {
+                'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'git_revision': git_revision(),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'cpus': os.cpu_count(),
+                'server': f'gunicorn ({args.workers} workers)' if args.gunicorn else 'server.py',
+                'settings': {
+                    'users': args.users,
+                    'sites': args.sites,
+                    'requests': args.requests,
+                    'mix_requests': args.mix_requests,
+                    'concurrency': args.concurrency,
+                    'mix': args.mix,
+                    'upstream_latency': args.upstream_latency,
+                    'upstream_origins': args.upstream_origins,
+                    'upstream_failure_rate': args.upstream_failure_rate,
+                    'upstream_payload_bytes': args.upstream_payload_bytes,
+                    'server_env': extra_env
+                }
+            },
+            'startup_seconds': server.startup_seconds,
+            'upstream_requests': upstream.requests,
+            'phases': phases
+        }
+    finally:
+        server.stop()
+        upstream.stop()
+        if not args.keep_data:
+            shutil.rmtree(data_dir, ignore_errors=True)
+        else:
+            print(f"[bench] Data and server log kept in {data_dir}", file=sys.stderr)
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline, current, max_regression):
+    """Print per-phase changes; returns False if any p95 or throughput regressed too far"""
+    ok = True
+    print(f"{'phase':<12} {'p95 ms':>18} {'throughput rps':>22}", file=sys.stderr)
+    for name, result in current['phases'].items():
+        before = baseline.get('phases', {}).get(name)
+        if not before:
+            continue
+        p95_before, p95_after = before['latency_ms']['p95'], result['latency_ms']['p95']
+        rps_before, rps_after = before['throughput_rps'], result['throughput_rps']
+        # Either run may have no samples for a phase (p95/throughput None): nothing to compare
+        p95_change = (p95_after - p95_before) / p95_before if p95_before and p95_after is not None else 0
+        rps_change = (rps_after - rps_before) / rps_before if rps_before and rps_after is not None else 0
+        regressed = p95_change > max_regression or -rps_change > max_regression
+        ok = ok and not regressed
+        print(f"{name:<12} {p95_before!s:>8} -> {p95_after!s:<8} {rps_before!s:>10} -> {rps_after!s:<10}"
+              f"{'  REGRESSED' if regressed else ''}", file=sys.stderr)
+    if baseline.get('startup_seconds') and current.get('startup_seconds'):
+        print(f"{'startup s':<12} {baseline['startup_seconds']:>8} -> {current['startup_seconds']}", file=sys.stderr)
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the dashboard server against a fake upstream')
+    parser.add_argument('--port', type=int, default=18500, help='port for the server under test')
+    parser.add_argument('--gunicorn', action='store_true', help='run via gunicorn.conf.py instead of server.py')
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn workers (with --gunicorn)')
+    parser.add_argument('--server-env', action='append', default=[], metavar='KEY=VALUE',
+                        help='extra environment for the server (repeatable), e.g. STATS_CACHE_TTL=0')
+    parser.add_argument('--users', type=int, default=4, help='simulated users (sessions)')
+    parser.add_argument('--sites', type=int, default=20, help='websites per user')
+    parser.add_argument('--requests', type=int, default=200, help='requests per single-endpoint phase')
+    parser.add_argument('--mix-requests', type=int, default=500, help='requests in the mixed phase')
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix(DEFAULT_MIX), help=f'weights (default {DEFAULT_MIX})')
+    parser.add_argument('--concurrency', type=int, default=8, help='concurrent client threads')
+    parser.add_argument('--seed', type=int, default=1, help='seed for the mixed phase order')
+    parser.add_argument('--upstream-port', type=int, default=0,
+                        help='first fake upstream port (0 = any free ports)')
+    parser.add_argument('--upstream-origins', type=int, default=4,
+                        help='fake upstream origins (ports) the sites are spread over')
+    parser.add_argument('--upstream-latency', type=float, default=0.05, help='fake upstream latency (s)')
+    parser.add_argument('--upstream-jitter', type=float, default=0.02, help='+/- latency jitter (s)')
+    parser.add_argument('--upstream-failure-rate', type=float, default=0.0, help='fraction of 503 responses')
+    parser.add_argument('--upstream-payload-bytes', type=int, default=512, help='padding added to each payload')
+    parser.add_argument('--fake-upstream-only', action='store_true', help='only run the fake upstream')
+    parser.add_argument('--output', help='write results JSON here instead of stdout')
+    parser.add_argument('--compare', help='baseline results JSON to compare against')
+    parser.add_argument('--max-regression', type=float, default=0.2,
+                        help='allowed p95/throughput regression fraction with --compare (exit 1 beyond)')
+    parser.add_argument('--keep-data', action='store_true', help='keep the temporary DATA_DIR and server log')
+    args = parser.parse_args()
+
+    if args.fake_upstream_only:
+        upstream = FakeUpstream(args.upstream_port or 18080, args.upstream_latency, args.upstream_jitter,
+                                args.upstream_failure_rate, args.upstream_payload_bytes,
+                                origins=args.upstream_origins).start()
+        for url in upstream.urls:
+            print(f"Fake upstream on {url}/api/v1/stats")
+        print("Ctrl+C to stop")
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            upstream.stop()
+        return
+
+    results = run_benchmark(args)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"[bench] Results written to {args.output}", file=sys.stderr)
+    else:
+        print(json.dumps(results, indent=2))
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if not compare(baseline, results, args.max_regression):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+"""
+Response Compression
+Negotiated gzip/brotli compression for dynamic JSON responses.
+
+Static assets are precompressed once at build time (see static_assets); API
+responses differ per request, so they are compressed on the way out with a
+cheaper setting: brotli when the optional `brotli` package is installed and
+the client accepts it, else gzip. Bodies below a size threshold are sent
+as-is, since the headers would cost more than the compression saves.
+
+Streamed responses (NDJSON batches, incrementally encoded lists) are always
+compressed, chunk by chunk: each chunk is flushed through the compressor as
+it is produced, so the client can still decode lines as they arrive.
+"""
+
+import threading
+import zlib
+
+try:
+    import brotli
+except ImportError:  # Optional: fall back to gzip only
+    brotli = None
+
+CONTENT_TYPES = ('application/json', 'application/x-ndjson')
+
+
+class ResponseCompressor:
+    """Compresses eligible Flask responses for the client's Accept-Encoding"""
+
+    def __init__(self, min_bytes=1024, gzip_level=6, brotli_quality=4, content_types=CONTENT_TYPES):
+        self.min_bytes = min_bytes
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.content_types = content_types
+        self.encodings = ['br', 'gzip'] if brotli is not None else ['gzip']  # Server preference order
+        self._lock = threading.Lock()
+        self._stats = {'compressed': 0, 'streamed': 0, 'skipped_small': 0, 'bytes_in': 0, 'bytes_out': 0}
+        self._by_encoding = {encoding: 0 for encoding in self.encodings}
+
+    def negotiate(self, accept_encodings):
+        """Best encoding the client accepts, or None"""
+        return accept_encodings.best_match(self.encodings)
+
+    def eligible(self, response) -> bool:
+        """Whether a response may be compressed at all (size aside)"""
+        return (
+            200 <= response.status_code < 300
+            and response.status_code not in (204, 206)
+            and response.mimetype in self.content_types
+            and not response.direct_passthrough
+            and 'Content-Encoding' not in response.headers
+            and 'no-transform' not in response.headers.get('Cache-Control', '')
+        )
+
+    def _count(self, encoding, bytes_in, bytes_out, **counters):
+        with self._lock:
+            self._stats['bytes_in'] += bytes_in
+            self._stats['bytes_out'] += bytes_out
+            for name, value in counters.items():
+                self._stats[name] += value
+            if encoding is not None:
+                self._by_encoding[encoding] += counters.get('compressed', 0)
+
+    def compress_body(self, body: bytes, encoding: str) -> bytes:
+        if encoding == 'br':
+            return brotli.compress(body, quality=self.brotli_quality)
+        compressor = zlib.compressobj(self.gzip_level, zlib.DEFLATED, 31)  # wbits=31: gzip container
+        return compressor.compress(body) + compressor.flush()
+
+    def _compress_stream(self, chunks, encoding):
+        if encoding == 'br':
+            compressor = brotli.Compressor(quality=self.brotli_quality)
+            process, flush = compressor.process, compressor.flush
+            finish = compressor.finish
+        else:
+            compressor = zlib.compressobj(self.gzip_level, zlib.DEFLATED, 31)
+            process = compressor.compress
+            flush = lambda: compressor.flush(zlib.Z_SYNC_FLUSH)  # noqa: E731
+            finish = compressor.flush
+        bytes_in = bytes_out = 0
+        try:
+            for chunk in chunks:
+                if not chunk:
+                    continue
+                bytes_in += len(chunk)
+                out = process(chunk) + flush()
+                bytes_out += len(out)
+                yield out
+            out = finish()
+            bytes_out += len(out)
+            yield out
+        finally:
+            self._count(encoding, bytes_in, bytes_out)
+
+    def apply(self, response, accept_encodings):
+        """Compress the response in place when eligible and accepted; returns it"""
+        if not self.eligible(response):
+            return response
+        response.vary.add('Accept-Encoding')
+        encoding = self.negotiate(accept_encodings)
+        if encoding is None:
+            return response
+
+        if response.is_streamed:
+            # iter_encoded() also covers generators that yield str
+            response.response = self._compress_stream(response.iter_encoded(), encoding)
+            response.headers.pop('Content-Length', None)
+            self._count(encoding, 0, 0, compressed=1, streamed=1)
+        else:
+            body = response.get_data()
+            if len(body) < self.min_bytes:
+                self._count(None, 0, 0, skipped_small=1)
+                return response
+            compressed = self.compress_body(body, encoding)
+            response.set_data(compressed)
+            self._count(encoding, len(body), len(compressed), compressed=1)
+
+        response.headers['Content-Encoding'] = encoding
+        # The bytes now differ per encoding, so a strong validator no longer holds
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        return response
+
+    def stats(self) -> dict:
+        """Responses compressed (by encoding), skipped as too small, and bytes saved"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['by_encoding'] = dict(self._by_encoding)
+        stats['ratio'] = round(stats['bytes_out'] / stats['bytes_in'], 4) if stats['bytes_in'] else None
+        stats['encodings'] = list(self.encodings)
+        stats['min_bytes'] = self.min_bytes
+        return stats
@@ -0,0 +1,140 @@
+"""
+Encrypted Container Format
+Versioned, compressed encryption for stored website data.
+
+Record token (one encrypted value; used for every <file>.rec / database row):
+
+    b'DSC' | version (1 byte) | codec (1 byte) | nonce (12 bytes) | AES-256-GCM ciphertext + tag
+
+The payload is compressed before encryption (zlib, or stored as-is when that
+is not smaller) and the token is raw bytes, so it avoids Fernet's base64
+overhead. The 5 header bytes are authenticated as associated data. The
+AES key is derived from the same PBKDF2/scrypt key that Fernet used, so
+legacy Fernet tokens (which always start with b'gAAAAA') still decrypt with it.
+
+File container (a standalone <hash>.enc, as written by migrate_credentials):
+
+    b'DSF' | version (1 byte) | header length (2 bytes, big-endian) | JSON header | record token
+
+The JSON header records the KDF ({'algorithm', parameters...}) and salt, so
+the KDF cost can change without breaking existing files. Legacy .enc files
+(16-byte salt + Fernet token, PBKDF2-SHA256 at 100k iterations) are still read.
+
+`cryptography` is imported on first use (it is a large share of the server's
+import time); preload() imports it ahead of time, e.g. during warm-up.
+"""
+
+import base64
+import hashlib
+import json
+import os
+import struct
+import zlib
+
+VERSION = 2
+TOKEN_MAGIC = b'DSC'
+FILE_MAGIC = b'DSF'
+NONCE_SIZE = 12
+
+CODECS = {'none': 0, 'zlib': 1}
+CODEC_NAMES = {number: name for name, number in CODECS.items()}
+
+# Everything written before the container format existed
+LEGACY_KDF = {'algorithm': 'pbkdf2-sha256', 'iterations': 100000}
+
+
+def preload():
+    """Import the crypto backend now rather than on the first encrypt/decrypt"""
+    from cryptography.fernet import Fernet  # noqa: F401
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM  # noqa: F401
+    from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC  # noqa: F401
+    from cryptography.hazmat.primitives.kdf.scrypt import Scrypt  # noqa: F401
+
+
+def kdf_from_settings(algorithm='pbkdf2-sha256', iterations=100000, scrypt_n=2 ** 15) -> dict:
+    """KDF parameters for new data (deploy-time setting)"""
+    if algorithm == 'pbkdf2-sha256':
+        return {'algorithm': algorithm, 'iterations': int(iterations)}
+    if algorithm == 'scrypt':
+        return {'algorithm': algorithm, 'n': int(scrypt_n), 'r': 8, 'p': 1}
+    raise ValueError(f"KDF algorithm must be 'pbkdf2-sha256' or 'scrypt', not {algorithm!r}")
+
+
+def derive_key(secret: str, salt: bytes, kdf: dict = None) -> bytes:
+    """Derive a (Fernet-format) key from a secret with the given KDF parameters"""
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+    from cryptography.hazmat.primitives.kdf.scrypt import Scrypt
+
+    kdf = kdf or LEGACY_KDF
+    if kdf['algorithm'] == 'pbkdf2-sha256':
+        function = PBKDF2HMAC(algorithm=hashes.SHA256(), length=32, salt=salt, iterations=kdf['iterations'])
+    elif kdf['algorithm'] == 'scrypt':
+        function = Scrypt(salt=salt, length=32, n=kdf['n'], r=kdf['r'], p=kdf['p'])
+    else:
+        raise ValueError(f"Unknown KDF algorithm {kdf['algorithm']!r}")
+    return base64.urlsafe_b64encode(function.derive(secret.encode()))
+
+
+def _aead(key: bytes):
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+    # Separate subkey so the Fernet key material is never used directly for GCM
+    return AESGCM(hashlib.sha256(b'container-aes:' + key).digest())
+
+
+def is_legacy_token(token: bytes) -> bool:
+    return not token.startswith(TOKEN_MAGIC)
+
+
+def encrypt(key: bytes, plaintext: bytes, codec='zlib') -> bytes:
+    """Compress (when it helps) and encrypt into a record token"""
+    payload = plaintext
+    if codec == 'zlib':
+        compressed = zlib.compress(plaintext, 6)
+        if len(compressed) < len(plaintext):
+            payload = compressed
+        else:
+            codec = 'none'
+
+    header = TOKEN_MAGIC + bytes((VERSION, CODECS[codec]))
+    nonce = os.urandom(NONCE_SIZE)
+    return header + nonce + _aead(key).encrypt(nonce, payload, header)
+
+
+def decrypt(key: bytes, token: bytes) -> bytes:
+    """Decrypt a record token (or a legacy Fernet token) to plaintext"""
+    if is_legacy_token(token):
+        from cryptography.fernet import Fernet
+        return Fernet(key).decrypt(token)
+
+    version, codec = token[3], token[4]
+    if version != VERSION or codec not in CODEC_NAMES:
+        raise ValueError(f'Unsupported container version {version} / codec {codec}')
+    header = token[:5]
+    nonce = token[5:5 + NONCE_SIZE]
+    payload = _aead(key).decrypt(nonce, token[5 + NONCE_SIZE:], header)
+    return zlib.decompress(payload) if CODEC_NAMES[codec] == 'zlib' else payload
+
+
+def pack_file(key: bytes, salt: bytes, kdf: dict, plaintext: bytes, codec='zlib') -> bytes:
+    """A standalone file container: KDF header plus one record token"""
+    header = json.dumps({'kdf': kdf, 'salt': salt.hex()}, separators=(',', ':')).encode()
+    return FILE_MAGIC + bytes((VERSION,)) + struct.pack('>H', len(header)) + header + encrypt(key, plaintext, codec)
+
+
+def read_file_header(blob: bytes):
+    """Return (salt, kdf, token) from a file container or a legacy salt+Fernet file"""
+    if not blob.startswith(FILE_MAGIC):
+        return blob[:16], LEGACY_KDF, blob[16:]
+    if blob[3] != VERSION:
+        raise ValueError(f'Unsupported file container version {blob[3]}')
+    (length,) = struct.unpack('>H', blob[4:6])
+    header = json.loads(blob[6:6 + length])
+    return bytes.fromhex(header['salt']), header['kdf'], blob[6 + length:]
+
+
+def unpack_file(blob: bytes, get_key) -> bytes:
+    """Decrypt a file container; get_key(salt, kdf) -> key"""
+    salt, kdf, token = read_file_header(blob)
+    return decrypt(get_key(salt, kdf), token)
@@ -0,0 +1,36 @@
+"""
+Gunicorn configuration: the production entry point.
+
+    gunicorn -c gunicorn.conf.py server:app
+
+Runs several worker processes (WEB_CONCURRENCY, default 2 x CPUs + 1, at
+most 4), each with a pool of threads so slow upstream calls and SSE streams
+don't tie up a whole process. Workers share DATA_DIR through the SQLite
+storage backend, which is therefore the default here; the file backend keeps
+state in process memory and is limited to one worker. With SQLite the
+workers also share cached upstream stats, the choice of which worker polls
+each site, circuit breakers and /metrics totals, so upstream traffic does not
+grow with the number of workers.
+"""
+
+import multiprocessing
+import os
+import secrets
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5001')}"
+workers = int(os.getenv('WEB_CONCURRENCY', min(multiprocessing.cpu_count() * 2 + 1, 4)))
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', 8))
+timeout = 60  # Heartbeat timeout; streamed responses keep the worker alive
+graceful_timeout = 30  # Time to flush pending saves and logs on shutdown
+keepalive = 5
+
+# Each worker imports the app itself so its background threads start after the fork
+preload_app = False
+
+os.environ.setdefault('STORAGE_BACKEND', 'sqlite')
+# Inherited by this master's workers: /metrics adds up the workers of the current generation
+os.environ['SERVER_GENERATION'] = secrets.token_hex(8)
+if os.environ['STORAGE_BACKEND'] != 'sqlite' and workers > 1:
+    print("⚠️  WARNING: STORAGE_BACKEND=file is single-process; starting 1 worker")
+    workers = 1
@@ -0,0 +1,93 @@
+"""
+JSON Backend
+Fast JSON encoding/decoding for API payloads, with streaming for big lists.
+
+Uses orjson when it is installed (several times faster than the standard
+library in both directions) and the standard library otherwise, or after
+use('json'). orjson is stricter than `json` (e.g. integers beyond 64
+bits), so anything it rejects is encoded with the standard library instead;
+the output is the same JSON either way.
+
+JSONProvider plugs the backend into Flask, so jsonify() and request.json use
+it too. iter_object() encodes a dict whose list value is large as a stream of
+byte chunks, so the whole body never has to exist in memory at once.
+"""
+
+import json
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson as _orjson
+except ImportError:  # Optional: fall back to the standard library
+    _orjson = None
+
+orjson = _orjson  # The fast backend in use (None = standard library)
+
+
+def use(name='auto') -> str:
+    """Select 'auto' (orjson when installed), 'orjson' or 'json'; returns the backend in use"""
+    global orjson
+    if name not in ('auto', 'orjson', 'json'):
+        raise ValueError(f"JSON backend must be 'auto', 'orjson' or 'json', not {name!r}")
+    if name == 'orjson' and _orjson is None:
+        raise ImportError('JSON backend orjson requested but not installed')
+    orjson = None if name == 'json' else _orjson
+    return backend()
+
+
+def backend() -> str:
+    return 'orjson' if orjson is not None else 'json'
+
+
+def loads(data):
+    """Parse JSON from bytes or str"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps(obj, sort_keys=False, default=None) -> bytes:
+    """Compact JSON as UTF-8 bytes"""
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_SORT_KEYS if sort_keys else 0)
+        try:
+            return orjson.dumps(obj, default=default, option=option)
+        except TypeError:
+            pass  # Something orjson won't encode; the standard library may
+    return json.dumps(obj, sort_keys=sort_keys, default=default, separators=(',', ':'),
+                      ensure_ascii=False).encode()
+
+
+def iter_object(obj: dict, key: str, batch=100):
+    """Encode obj as JSON bytes chunks, streaming the list at obj[key] `batch` items at a time"""
+    items = obj[key]
+    head = dumps({k: v for k, v in obj.items() if k != key})
+    # '{"a":1}' -> '{"a":1,"key":[' ... ']}'
+    prefix = head[:-1] + (b',' if len(head) > 2 else b'') + dumps(key) + b':['
+    yield prefix
+    for start in range(0, len(items), batch):
+        chunk = b','.join(dumps(item) for item in items[start:start + batch])
+        yield (b',' if start else b'') + chunk
+    yield b']}'
+
+
+class JSONProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by this module (same output as Flask's default)"""
+
+    def dumps(self, obj, **kwargs):
+        if orjson is None or kwargs:
+            return super().dumps(obj, **kwargs)
+        return dumps(obj, sort_keys=self.sort_keys, default=self.default).decode()
+
+    def loads(self, s, **kwargs):
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        return loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        if orjson is None or self._app.debug:
+            return super().response(*args, **kwargs)
+        body = dumps(obj, sort_keys=self.sort_keys, default=self.default) + b'\n'
+        return self._app.response_class(body, mimetype=self.mimetype)
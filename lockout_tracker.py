@@ -0,0 +1,188 @@
+"""
+Lockout Tracker
+In-memory login rate limiting with sliding-window failure counters.
+
+Each IP keeps the timestamps of its most recent failures (at most
+`max_attempts` of them), so checking or recording an attempt is O(1) no
+matter how many IPs have been seen. Reaching `max_attempts` failures inside
+`window` seconds locks the IP for `lockout_duration` seconds. A background
+thread snapshots the table to disk when it changed (so lockouts survive a
+restart) and drops IPs that are neither locked nor have recent failures.
+"""
+
+import json
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+
+class LockoutTracker:
+    """Sliding-window failed-login counters and lockouts per IP"""
+
+    def __init__(self, snapshot_file, max_attempts=5, lockout_duration=900, window=900,
+                 snapshot_interval=30):
+        self.snapshot_file = snapshot_file
+        self.max_attempts = max_attempts
+        self.lockout_duration = lockout_duration
+        self.window = window
+        self.snapshot_interval = snapshot_interval
+
+        self._failures = {}  # ip -> deque of failure timestamps
+        self._locked_until = {}  # ip -> unix timestamp
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._thread = None
+
+    def __len__(self):
+        return len(self._failures.keys() | self._locked_until.keys())
+
+    # ------------------------------------------------------------------
+    # Checks
+    # ------------------------------------------------------------------
+
+    def _recent(self, ip, now):
+        failures = self._failures.get(ip)
+        if failures is None:
+            return None
+        while failures and failures[0] <= now - self.window:
+            failures.popleft()
+        return failures
+
+    def is_locked(self, ip):
+        """Return (locked, seconds remaining)"""
+        now = time.time()
+        with self._lock:
+            until = self._locked_until.get(ip)
+            if until is None:
+                return False, None
+            if now < until:
+                return True, int(until - now)
+            # Lockout expired; start the IP over with a clean slate
+            del self._locked_until[ip]
+            self._failures.pop(ip, None)
+            self._dirty = True
+            return False, None
+
+    def record_failure(self, ip):
+        """Record a failed attempt; returns (locked, lockout seconds or attempts remaining)"""
+        now = time.time()
+        with self._lock:
+            failures = self._recent(ip, now)
+            if failures is None:
+                failures = self._failures[ip] = deque(maxlen=self.max_attempts)
+            failures.append(now)
+            self._dirty = True
+
+            if len(failures) >= self.max_attempts:
+                self._locked_until[ip] = now + self.lockout_duration
+                return True, self.lockout_duration
+            return False, self.max_attempts - len(failures)
+
+    def reset(self, ip):
+        """Forget an IP's failures (after a successful login)"""
+        with self._lock:
+            if self._failures.pop(ip, None) is not None or self._locked_until.pop(ip, None) is not None:
+                self._dirty = True
+
+    def sweep(self):
+        """Drop IPs with no active lockout and no failures inside the window"""
+        now = time.time()
+        removed = 0
+        with self._lock:
+            for ip in [ip for ip, until in self._locked_until.items() if until <= now]:
+                del self._locked_until[ip]
+                self._failures.pop(ip, None)
+                removed += 1
+            for ip in list(self._failures):
+                if ip not in self._locked_until and not self._recent(ip, now):
+                    del self._failures[ip]
+                    removed += 1
+            if removed:
+                self._dirty = True
+        return removed
+
+    # ------------------------------------------------------------------
+    # Persistence
+    # ------------------------------------------------------------------
+
+    def load(self):
+        """Load the last snapshot (also accepts the old count-only format)"""
+        if not os.path.exists(self.snapshot_file):
+            return
+        try:
+            with open(self.snapshot_file, 'r') as f:
+                data = json.load(f)
+        except (ValueError, OSError):
+            return
+
+        now = time.time()
+        with self._lock:
+            for ip, entry in data.items():
+                failures = entry.get('failures')
+                if failures is None:
+                    # Old format only has a count; treat those failures as recent
+                    failures = [now] * min(entry.get('count', 0), self.max_attempts)
+                if failures:
+                    self._failures[ip] = deque(failures, maxlen=self.max_attempts)
+                if entry.get('locked_until'):
+                    self._locked_until[ip] = datetime.fromisoformat(entry['locked_until']).timestamp()
+        self.sweep()
+
+    def snapshot(self, force=False):
+        """Write the table to disk if it changed since the last snapshot"""
+        with self._lock:
+            if not (self._dirty or force):
+                return False
+            data = {}
+            for ip in self._failures.keys() | self._locked_until.keys():
+                failures = list(self._failures.get(ip, ()))
+                until = self._locked_until.get(ip)
+                data[ip] = {
+                    'count': len(failures),
+                    'failures': failures,
+                    'locked_until': datetime.fromtimestamp(until).isoformat() if until else None
+                }
+            self._dirty = False
+
+        tmp_file = self.snapshot_file + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_file, self.snapshot_file)
+        return True
+
+    def start(self, on_error=None):
+        """Start the background snapshot/expiry thread (failures go to on_error(e))"""
+        if self._thread is not None:
+            return
+
+        def run():
+            while True:
+                time.sleep(self.snapshot_interval)
+                try:
+                    self.sweep()
+                    self.snapshot()
+                except Exception as e:
+                    if on_error is not None:
+                        on_error(e)
+
+        self._thread = threading.Thread(target=run, name='lockout-snapshot', daemon=True)
+        self._thread.start()
+
+    def entries(self):
+        """(ip, failure timestamps, locked-until timestamp or None) per tracked IP"""
+        with self._lock:
+            return [(ip, list(self._failures.get(ip, ())), self._locked_until.get(ip))
+                    for ip in self._failures.keys() | self._locked_until.keys()]
+
+    def stats(self) -> dict:
+        """Tracker size and settings"""
+        now = time.time()
+        with self._lock:
+            return {
+                'tracked_ips': len(self._failures.keys() | self._locked_until.keys()),
+                'locked_ips': sum(1 for until in self._locked_until.values() if until > now),
+                'max_attempts': self.max_attempts,
+                'window': self.window
+            }
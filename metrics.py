@@ -0,0 +1,197 @@
+"""
+Metrics
+Minimal in-process Prometheus metrics (counters, gauges, histograms).
+
+Metrics register themselves in a module-level registry and render() produces
+the Prometheus text exposition format for /metrics. Each metric holds one
+small lock; recording a value is a dict lookup plus a bisect, so it is cheap
+enough for per-request and per-record use.
+
+PHASE_SECONDS is shared by the storage modules: wrap a unit of work in
+`with timed('decrypt'):` to add it to the per-phase breakdown.
+
+Values live in the process that recorded them. With several server
+processes, snapshot() exports them and render(others) adds other processes'
+snapshots in (counters, gauges and histogram buckets are summed), so any one
+process can answer a scrape for all of them (see sqlite_storage.py).
+"""
+
+import bisect
+import copy
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+_registry = []
+_registry_lock = threading.Lock()
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=None) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(labels)
+        self._values = {}  # label values tuple -> value
+        self._lock = threading.Lock()
+        with _registry_lock:
+            _registry.append(self)
+
+    def _key(self, labels):
+        return tuple(labels.get(name, '') for name in self.label_names)
+
+    def snapshot(self) -> list:
+        """[[label values, value], ...] (JSON-serialisable)"""
+        with self._lock:
+            return [[list(key), copy.deepcopy(value)] for key, value in self._values.items()]
+
+    @staticmethod
+    def _add(total, value):
+        return value if total is None else total + value
+
+    def _combined(self, others) -> list:
+        """This process's values plus other processes' snapshots, sorted by labels"""
+        values = {tuple(key): value for key, value in self.snapshot()}
+        for items in others:
+            for key, value in items:
+                key = tuple(key)
+                values[key] = self._add(values.get(key), value)
+        return sorted(values.items())
+
+    def render(self, others=()) -> list:
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} {self.kind}']
+        for key, value in self._combined(others):
+            lines.append(f'{self.name}{_labels(self.label_names, key)} {_number(value)}')
+        return lines
+
+
+class Counter(_Metric):
+    """Monotonic count per label set"""
+
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """Value that can go up and down"""
+
+    kind = 'gauge'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    """Cumulative bucket counts, sum and count per label set"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                # Per-bucket (non-cumulative) counts + [sum, count]
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    @staticmethod
+    def _add(total, value):
+        if total is None:
+            return value
+        if len(total[0]) != len(value[0]):
+            return total  # Different bucket layout (another version of the code); skip
+        return [[a + b for a, b in zip(total[0], value[0])], total[1] + value[1], total[2] + value[2]]
+
+    def render(self, others=()) -> list:
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        for key, (counts, total, count) in self._combined(others):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = f'le="{_number(bound)}"'
+                lines.append(f'{self.name}_bucket{_labels(self.label_names, key, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{_labels(self.label_names, key)} {_number(total)}')
+            lines.append(f'{self.name}_count{_labels(self.label_names, key)} {count}')
+        return lines
+
+
+def snapshot() -> dict:
+    """Every registered metric's values in this process: {name: {'kind', 'values'}}"""
+    with _registry_lock:
+        metrics = list(_registry)
+    return {metric.name: {'kind': metric.kind, 'values': metric.snapshot()} for metric in metrics}
+
+
+def render(others=()) -> str:
+    """Every registered metric in Prometheus text format
+
+    `others` are snapshot() results from other processes, added to this
+    process's values.
+    """
+    with _registry_lock:
+        metrics = list(_registry)
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render([other[metric.name]['values'] for other in others if metric.name in other]))
+    return '\n'.join(lines) + '\n'
+
+
+PHASE_SECONDS = Histogram(
+    'dashboard_phase_seconds',
+    'Time spent in one phase of request work (key derivation, crypto, JSON, file I/O, session lookup)',
+    labels=('phase',)
+)
+
+
+def timed(phase):
+    """Context manager adding the block's duration to PHASE_SECONDS{phase=...}"""
+    return PHASE_SECONDS.time(phase=phase)
@@ -2,31 +2,51 @@
 """
 Credential Migration Script
 Migrates encrypted data from old credentials to new credentials
+
+Interactive (one user):
+    python3 migrate_credentials.py
+
+Batch (every user in a mappings file, in parallel, resumable):
+    python3 migrate_credentials.py --batch mappings.jsonl [--data-dir DIR] [--workers N]
+    ... | python3 migrate_credentials.py --batch -
+
+Each mappings line is a JSON object:
+    {"old_password": "...", "old_otp": "...", "new_password": "...", "new_otp": "..."}
+The new_* fields default to the old ones, which re-encrypts with the current
+KDF_* settings (a KDF rotation). The old user's data (a .enc file or a .d
+record store) is written as the new user's .enc file container, which the
+server imports on that user's first login. With the sqlite backend, users
+whose data is already in DATA_DIR/dashboard.db are read from there and
+written back to it as the new user, in one transaction. Old data is left in
+place.
 """
 
+import argparse
 import os
 import sys
 import json
 import hashlib
 import secrets
-import base64
-from cryptography.fernet import Fernet
-from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from getpass import getpass
 
+import container
+
 DATA_DIR = 'secure_data'
+DB_NAME = 'dashboard.db'  # The server's STORAGE_DB_FILE
 
+# Same settings as the server (see env.example); old files are read with the KDF in their header
+KDF = container.kdf_from_settings(
+    os.getenv('KDF_ALGORITHM', 'pbkdf2-sha256'),
+    int(os.getenv('KDF_ITERATIONS', 100000)),
+    int(os.getenv('KDF_SCRYPT_N', 2 ** 15))
+)
 
-def derive_key(password: str, salt: bytes) -> bytes:
-    """Derive encryption key from password using PBKDF2"""
-    kdf = PBKDF2HMAC(
-        algorithm=hashes.SHA256(),
-        length=32,
-        salt=salt,
-        iterations=100000,
-    )
-    return base64.urlsafe_b64encode(kdf.derive(password.encode()))
+
+def derive_key(password: str, salt: bytes, kdf: dict = None) -> bytes:
+    """Derive encryption key from password (PBKDF2 at 100k iterations unless kdf says otherwise)"""
+    return container.derive_key(password, salt, kdf)
 
 
 def get_user_file(username: str) -> str:
@@ -56,15 +76,10 @@ def decrypt_data(username: str, filepath: str):
         with open(filepath, 'rb') as f:
             encrypted_data = f.read()
         
-        # Extract salt and content
-        salt = encrypted_data[:16]
-        encrypted_content = encrypted_data[16:]
-        
-        # Derive key and decrypt
-        key = derive_key(username, salt)
-        fernet = Fernet(key)
-        
-        decrypted = fernet.decrypt(encrypted_content)
+        # Salt and KDF come from the file header (legacy files: salt + Fernet token)
+        decrypted = container.unpack_file(
+            encrypted_data, lambda salt, kdf: derive_key(username, salt, kdf)
+        )
         data = json.loads(decrypted.decode())
         
         return data
@@ -78,20 +93,333 @@ def encrypt_data(username: str, data):
     
     # Generate salt and derive key
     salt = secrets.token_bytes(16)
-    key = derive_key(username, salt)
-    fernet = Fernet(key)
+    key = derive_key(username, salt, KDF)
     
-    # Encrypt data
+    # Encrypt data into a file container (header records salt and KDF)
     json_data = json.dumps(data).encode()
-    encrypted = fernet.encrypt(json_data)
+    encrypted = container.pack_file(key, salt, KDF, json_data)
     
-    # Save salt + encrypted data
     with open(user_file, 'wb') as f:
-        f.write(salt + encrypted)
+        f.write(encrypted)
     
     return user_file
 
 
+# ----------------------------------------------------------------------
+# Batch mode
+# ----------------------------------------------------------------------
+
+def user_owner(username: str) -> str:
+    """A user's file name stem, and their owner key in the database"""
+    return hashlib.sha256(username.encode()).hexdigest()[:16]
+
+
+def user_paths(data_dir: str, username: str):
+    """(.enc file, .d record store directory) for a user"""
+    base = os.path.join(data_dir, user_owner(username))
+    return base + '.enc', base + '.d'
+
+
+def db_owners(db_path) -> set:
+    """Owners with data in the server's database (empty without one)"""
+    if not os.path.exists(db_path):
+        return set()
+    from sqlite_storage import SQLiteDatabase
+    return {row[0] for row in SQLiteDatabase(db_path).execute('SELECT owner FROM record_indexes')}
+
+
+def read_mappings(stream):
+    """Parse mappings (JSON object per line; blank lines and # comments skipped)"""
+    mappings = []
+    for number, line in enumerate(stream, 1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        try:
+            entry = json.loads(line)
+            old = f"{entry['old_password']}:{entry['old_otp']}"
+            new = f"{entry.get('new_password', entry['old_password'])}:{entry.get('new_otp', entry['old_otp'])}"
+        except (ValueError, KeyError, TypeError) as e:
+            raise ValueError(f'Mappings line {number}: expected old_password/old_otp[/new_password/new_otp] ({e})')
+        mappings.append((old, new))
+    return mappings
+
+
+def plan_jobs(data_dir: str, mappings, overwrite=False, completed=()):
+    """Turn mappings into (jobs, problems); problems are (source, reason) pairs
+
+    Jobs in `completed` (from the journal) are kept so run_batch can count
+    them as skipped; their output already exists by design.
+    """
+    jobs, problems = [], []
+    kdf = json.dumps(KDF, sort_keys=True)
+    db_path = os.path.join(data_dir, DB_NAME)
+    owners = db_owners(db_path)
+    for old, new in mappings:
+        old_file, old_dir = user_paths(data_dir, old)
+        new_file, new_dir = user_paths(data_dir, new)
+
+        if user_owner(old) in owners:
+            # sqlite backend: database in, database out
+            name = f'{DB_NAME}:{user_owner(old)}'
+            dest = f'{DB_NAME}:{user_owner(new)}'
+            job = {'id': f'{name}->{dest}@{kdf}', 'old': old, 'new': new, 'source': name, 'dest': dest,
+                   'db': db_path, 'overwrite': overwrite}
+            if job['id'] in completed:
+                jobs.append(job)
+            elif old == new:
+                problems.append((name, 'database records: KDF changes apply on the next save, nothing to do'))
+            elif user_owner(new) in owners and not overwrite:
+                problems.append((name, f'new credentials already have data in {DB_NAME} (use --overwrite)'))
+            else:
+                jobs.append(job)
+            continue
+
+        source = old_dir if os.path.isdir(old_dir) else old_file
+        name = os.path.basename(source)
+        job_id = f'{name}->{os.path.basename(new_file)}@{kdf}'
+        if job_id in completed:
+            jobs.append({'id': job_id, 'old': old, 'new': new, 'source': source, 'dest': new_file})
+            continue
+
+        if not os.path.exists(source):
+            problems.append((name, 'no data for the old credentials'))
+            continue
+        if old != new and user_owner(new) in owners:
+            # The server would keep using the database rows and never import the new file
+            problems.append((name, f'new credentials already have data in {DB_NAME}'))
+            continue
+        if source == old_dir and old == new:
+            # The server re-keys a record store itself on its next write
+            problems.append((name, 'record store: KDF changes apply on the next save, nothing to do'))
+            continue
+        if old != new and os.path.isdir(new_dir):
+            problems.append((name, f'new credentials already have a record store ({os.path.basename(new_dir)})'))
+            continue
+        if old != new and os.path.exists(new_file) and not overwrite:
+            problems.append((name, f'{os.path.basename(new_file)} exists (use --overwrite)'))
+            continue
+
+        jobs.append({'id': job_id, 'old': old, 'new': new, 'source': source, 'dest': new_file})
+    return jobs, problems
+
+
+def _load_source(job) -> bytes:
+    """Plaintext JSON of the old user's website list"""
+    if job.get('db'):
+        from sqlite_storage import SQLiteDatabase, SQLiteRecordStore
+        get_key = lambda salt, kdf: derive_key(job['old'], salt, kdf)
+        store = SQLiteRecordStore(SQLiteDatabase(job['db']), user_owner(job['old']), get_key)
+        return json.dumps(store.load()).encode()
+    if os.path.isdir(job['source']):
+        from record_store import RecordStore
+        get_key = lambda salt, kdf: derive_key(job['old'], salt, kdf)
+        return json.dumps(RecordStore(job['source'], get_key).load()).encode()
+    with open(job['source'], 'rb') as f:
+        return container.unpack_file(f.read(), lambda salt, kdf: derive_key(job['old'], salt, kdf))
+
+
+def append_journal(path, result):
+    """Append one result line (a single small O_APPEND write, so workers can share the file)"""
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+    try:
+        os.write(fd, (json.dumps(result) + '\n').encode())
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _write_db(job, plaintext: bytes):
+    """Store the website list as the new user's database records, verified, in one transaction"""
+    from sqlite_storage import SQLiteDatabase, SQLiteRecordStore
+
+    keys = {}  # Derived once for the write and reused for the verification read
+
+    def get_key(salt, kdf):
+        if salt not in keys:
+            keys[salt] = derive_key(job['new'], salt, kdf)
+        return keys[salt]
+
+    websites = json.loads(plaintext)
+    db = SQLiteDatabase(job['db'])
+    with db.transaction():
+        store = SQLiteRecordStore(db, user_owner(job['new']), get_key, kdf=KDF)
+        if store.exists():
+            if not job.get('overwrite'):
+                raise ValueError(f"new credentials already have data in {DB_NAME}")
+            db.execute('DELETE FROM records WHERE owner = ?', (store.owner,))
+            db.execute('DELETE FROM record_indexes WHERE owner = ?', (store.owner,))
+        store.replace_all(websites)
+        # An exception here rolls the whole write back
+        if store.load() != websites:
+            raise ValueError('verification failed: re-encrypted data does not match')
+
+
+def _write_file(job, plaintext: bytes, tmp_path):
+    """Write the new user's .enc file container, verified before it replaces anything"""
+    salt = secrets.token_bytes(16)
+    key = derive_key(job['new'], salt, KDF)
+    blob = container.pack_file(key, salt, KDF, plaintext)
+    with open(tmp_path, 'wb') as f:
+        f.write(blob)
+        f.flush()
+        os.fsync(f.fileno())
+
+    # Verify what is on disk decrypts to the same data before it replaces anything
+    with open(tmp_path, 'rb') as f:
+        written_salt, written_kdf, token = container.read_file_header(f.read())
+    if (written_salt, written_kdf) != (salt, KDF) or container.decrypt(key, token) != plaintext:
+        raise ValueError('verification failed: re-encrypted data does not match')
+    os.replace(tmp_path, job['dest'])
+
+
+def migrate_one(job, journal_path=None) -> dict:
+    """Re-encrypt one user's data (runs in a worker process); never raises
+
+    The result is journaled right after the new file is renamed into place
+    (or the database transaction commits), so an interrupted run knows
+    exactly which outputs are complete.
+    """
+    started = time.perf_counter()
+    tmp_path = f"{job['dest']}.tmp"
+    try:
+        plaintext = _load_source(job)
+        websites = len(json.loads(plaintext))
+
+        if job.get('db'):
+            _write_db(job, plaintext)
+        else:
+            _write_file(job, plaintext, tmp_path)
+
+        result = {
+            'id': job['id'], 'status': 'done', 'websites': websites,
+            'bytes': len(plaintext), 'seconds': round(time.perf_counter() - started, 3)
+        }
+        if journal_path:
+            append_journal(journal_path, result)
+        return result
+    except Exception as e:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        error = 'wrong old credentials or corrupt data' if type(e).__name__ in ('InvalidToken', 'InvalidTag') else str(e)
+        return {'id': job['id'], 'status': 'failed', 'error': error,
+                'seconds': round(time.perf_counter() - started, 3)}
+
+
+def end_journal_line(path):
+    """Terminate a torn last line from an interrupted run, so the next entry starts on its own line"""
+    if not os.path.exists(path):
+        return
+    with open(path, 'rb+') as f:
+        if f.seek(0, os.SEEK_END) == 0:
+            return
+        f.seek(-1, os.SEEK_END)
+        if f.read(1) != b'\n':
+            f.write(b'\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+
+def read_journal(path) -> set:
+    """Ids of jobs already completed by an earlier run"""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, 'r') as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue  # Torn last line from an interrupted run
+            if entry.get('status') == 'done':
+                done.add(entry['id'])
+    return done
+
+
+def run_batch(jobs, journal_path, workers, progress=None):
+    """Run jobs across a process pool; returns the summary
+
+    Jobs the journal records as done are skipped, so an interrupted run can
+    simply be started again.
+    """
+    end_journal_line(journal_path)
+    already_done = read_journal(journal_path)
+    pending = [job for job in jobs if job['id'] not in already_done]
+    summary = {
+        'workers': workers, 'jobs': len(jobs), 'skipped': len(jobs) - len(pending),
+        'done': 0, 'failed': 0, 'websites': 0, 'bytes': 0, 'errors': {}
+    }
+    started = time.perf_counter()
+
+    if pending:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(migrate_one, job, journal_path): job for job in pending}
+            try:
+                for future in as_completed(futures):
+                    job, result = futures[future], future.result()
+                    if result['status'] == 'done':
+                        summary['done'] += 1
+                        summary['websites'] += result['websites']
+                        summary['bytes'] += result['bytes']
+                    else:
+                        append_journal(journal_path, result)
+                        summary['failed'] += 1
+                        summary['errors'][os.path.basename(job['source'])] = result['error']
+                    if progress is not None:
+                        progress(job, result)
+            except KeyboardInterrupt:
+                # Let running jobs finish (and journal themselves); drop the queued ones
+                pool.shutdown(wait=True, cancel_futures=True)
+                raise
+
+    elapsed = time.perf_counter() - started
+    summary['seconds'] = round(elapsed, 3)
+    summary['files_per_second'] = round(summary['done'] / elapsed, 2) if elapsed else 0.0
+    summary['mb_per_second'] = round(summary['bytes'] / elapsed / 1e6, 3) if elapsed else 0.0
+    return summary
+
+
+def batch_main(argv):
+    parser = argparse.ArgumentParser(description='Re-encrypt every mapped user in DATA_DIR in parallel')
+    parser.add_argument('--batch', required=True, metavar='MAPPINGS', help="mappings file (JSON lines), or - for stdin")
+    parser.add_argument('--data-dir', default=os.getenv('RAILWAY_VOLUME_MOUNT_PATH', DATA_DIR))
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='worker processes (default: CPU count)')
+    parser.add_argument('--journal', help='progress journal (default: DATA_DIR/migrate_credentials.journal)')
+    parser.add_argument('--overwrite', action='store_true', help="replace the new credentials' existing .enc file or database records")
+    parser.add_argument('--dry-run', action='store_true', help='show what would be migrated and exit')
+    args = parser.parse_args(argv)
+
+    if args.batch == '-':
+        mappings = read_mappings(sys.stdin)
+    else:
+        with open(args.batch, 'r') as f:
+            mappings = read_mappings(f)
+
+    journal_path = args.journal or os.path.join(args.data_dir, 'migrate_credentials.journal')
+    completed = read_journal(journal_path)
+    jobs, problems = plan_jobs(args.data_dir, mappings, overwrite=args.overwrite, completed=completed)
+    for name, reason in problems:
+        print(f"⚠️  {name}: {reason}", file=sys.stderr)
+    resumed = sum(1 for job in jobs if job['id'] in completed)
+    print(f"{len(jobs) - resumed} file(s) to re-encrypt with {KDF['algorithm']}, {args.workers} worker(s) "
+          f"({resumed} already done per {os.path.basename(journal_path)}, {len(problems)} skipped)",
+          file=sys.stderr)
+    if args.dry_run:
+        for job in jobs:
+            print(f"  {os.path.basename(job['source'])} -> {os.path.basename(job['dest'])}", file=sys.stderr)
+        return 0
+
+    def progress(job, result):
+        mark = '✅' if result['status'] == 'done' else '❌'
+        detail = f"{result['websites']} website(s)" if result['status'] == 'done' else result['error']
+        print(f"{mark} {os.path.basename(job['source'])} -> {os.path.basename(job['dest'])}: "
+              f"{detail} ({result['seconds']}s)", file=sys.stderr)
+
+    summary = run_batch(jobs, journal_path, args.workers, progress)
+    print(json.dumps(summary, indent=2))
+    return 1 if summary['failed'] else 0
+
+
 def main():
     print("=" * 70)
     print("🔐 CREDENTIAL MIGRATION TOOL")
@@ -202,6 +530,8 @@ def main():
 
 
 if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        sys.exit(batch_main(sys.argv[1:]))
     try:
         main()
     except KeyboardInterrupt:
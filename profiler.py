@@ -0,0 +1,196 @@
+"""
+Request Profiler
+Opt-in per-request profiling, aggregated per route.
+
+Two modes:
+
+    sample    A background thread snapshots the stacks of the threads that
+              are handling profiled requests every `interval` seconds. Cheap
+              enough for production; exported as collapsed stacks
+              ("frame;frame;frame count"), the input format of flamegraph.pl
+              and speedscope.
+    cprofile  Deterministic cProfile of each profiled request, merged into
+              one pstats.Stats per route and exported as a .pstats file
+              (snakeviz, `python3 -m pstats`). Much slower; use briefly.
+
+Which requests are profiled is decided by the caller: should_profile() picks
+a random `sample_rate` fraction of the configured routes, and a request can
+be forced (e.g. by an authenticated header).
+"""
+
+import cProfile
+import marshal
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+from collections import Counter
+
+MAX_STACK_DEPTH = 64
+MAX_STACKS_PER_ROUTE = 10000  # distinct stacks kept; the rest count as [truncated]
+
+
+class RequestProfiler:
+    """Per-route stack samples or cProfile stats for selected requests"""
+
+    def __init__(self, enabled=False, sample_rate=0.01, routes=None, mode='sample', interval=0.005):
+        if mode not in ('sample', 'cprofile'):
+            raise ValueError(f"Profiling mode must be 'sample' or 'cprofile', not {mode!r}")
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.routes = set(routes or ())  # empty = every route
+        self.mode = mode
+        self.interval = interval
+
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self._active = {}  # thread id -> route being sampled
+        self._stacks = {}  # route -> Counter of collapsed stacks
+        self._stats = {}  # route -> pstats.Stats
+        self._requests = Counter()  # route -> profiled requests
+        self._samples = Counter()  # route -> stack samples taken
+        self._thread = None
+
+    # ------------------------------------------------------------------
+    # Per-request hooks
+    # ------------------------------------------------------------------
+
+    def should_profile(self, rule, forced=False) -> bool:
+        """Whether to profile a request for this URL rule"""
+        if forced:
+            return True
+        if not self.enabled or (self.routes and rule not in self.routes):
+            return False
+        return random.random() < self.sample_rate
+
+    def start(self, route):
+        """Begin profiling the current thread's request; returns a handle for stop()"""
+        if self.mode == 'cprofile':
+            profile = cProfile.Profile()
+            profile.enable()
+            return (route, profile)
+
+        self._ensure_sampler()
+        with self._cond:
+            self._active[threading.get_ident()] = route
+            self._cond.notify()
+        return (route, None)
+
+    def stop(self, handle):
+        """Finish profiling a request started with start()"""
+        route, profile = handle
+        if profile is not None:
+            profile.disable()
+            with self._lock:
+                if route in self._stats:
+                    self._stats[route].add(profile)
+                else:
+                    self._stats[route] = pstats.Stats(profile)
+                self._requests[route] += 1
+            return
+
+        with self._lock:
+            self._active.pop(threading.get_ident(), None)
+            self._requests[route] += 1
+
+    # ------------------------------------------------------------------
+    # Sampling
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def _collapse(frame) -> str:
+        names = []
+        while frame is not None and len(names) < MAX_STACK_DEPTH:
+            code = frame.f_code
+            names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+            frame = frame.f_back
+        return ';'.join(reversed(names))
+
+    def _ensure_sampler(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='request-profiler', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._active)
+                active = dict(self._active)
+
+            frames = sys._current_frames()
+            collapsed = {}
+            for thread_id, route in active.items():
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    collapsed[thread_id] = (route, self._collapse(frame))
+            del frames
+
+            with self._lock:
+                for thread_id, (route, stack) in collapsed.items():
+                    if self._active.get(thread_id) != route:
+                        continue  # Request finished while we were sampling
+                    stacks = self._stacks.setdefault(route, Counter())
+                    if stack not in stacks and len(stacks) >= MAX_STACKS_PER_ROUTE:
+                        stack = '[truncated]'
+                    stacks[stack] += 1
+                    self._samples[route] += 1
+
+            time.sleep(self.interval)
+
+    # ------------------------------------------------------------------
+    # Export
+    # ------------------------------------------------------------------
+
+    def collapsed(self, route=None) -> str:
+        """Collapsed stacks for one route, or all routes with the route as root frame"""
+        with self._lock:
+            if route is not None:
+                items = list(self._stacks.get(route, {}).items())
+            else:
+                items = [(f"{name};{stack}", count)
+                         for name, stacks in self._stacks.items() for stack, count in stacks.items()]
+        return ''.join(f"{stack} {count}\n" for stack, count in sorted(items))
+
+    def pstats_dump(self, route=None) -> bytes:
+        """Merged cProfile stats in the pstats file format (None if nothing recorded)"""
+        with self._lock:
+            selected = [self._stats[route]] if route in self._stats else (
+                list(self._stats.values()) if route is None else []
+            )
+            if not selected:
+                return None
+            merged = pstats.Stats()
+            merged.add(*selected)
+            return marshal.dumps(merged.stats)
+
+    def reset(self):
+        """Discard everything collected so far"""
+        with self._lock:
+            self._stacks.clear()
+            self._stats.clear()
+            self._requests.clear()
+            self._samples.clear()
+
+    def summary(self) -> dict:
+        """Settings plus profiled requests and samples per route"""
+        with self._lock:
+            routes = sorted(set(self._requests) | set(self._samples))
+            return {
+                'enabled': self.enabled,
+                'mode': self.mode,
+                'sample_rate': self.sample_rate,
+                'routes_filter': sorted(self.routes),
+                'interval': self.interval,
+                'routes': {
+                    route: {
+                        'requests': self._requests[route],
+                        'samples': self._samples[route],
+                        'distinct_stacks': len(self._stacks.get(route, ()))
+                    }
+                    for route in routes
+                }
+            }
@@ -0,0 +1,373 @@
+"""
+Record Store
+Per-website encrypted records, so editing one website costs one record write.
+
+Each user gets a directory next to the legacy <hash>.enc file:
+
+    <hash>.d/index.json     salt, KDF parameters + ordered list of {id, file, mac, format}
+    <hash>.d/<file>.rec     one encrypted record token per website (see container.py)
+
+All records share the store's salt and KDF parameters, so the key is derived
+once (and cached by the caller). The index holds a keyed MAC of every
+record's plaintext, so a full-list save can skip records that did not change
+without decrypting them. A legacy single-file .enc store is split into
+records on first load and kept as <hash>.enc.backup.
+
+Old data is upgraded lazily: a record still in Fernet format is rewritten as
+a compressed container token the next time it is written, and when the
+configured KDF differs from the index's, the next write re-keys the whole
+store under a new salt.
+
+Storage access goes through a handful of primitives (_transaction,
+_read_transaction, _read_index/_write_index, _read_token/_write_token,
+_remove_token) so other backends (see sqlite_storage.py) can reuse the
+record and MAC logic.
+"""
+
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import threading
+from collections import defaultdict
+
+import container
+from metrics import timed
+
+INDEX_VERSION = 2
+
+# One lock per store directory; records and index change together
+_locks = defaultdict(threading.Lock)
+_locks_guard = threading.Lock()
+
+
+def lock_for(directory):
+    """The in-process lock every RecordStore for `directory` holds while it works"""
+    with _locks_guard:
+        return _locks[directory]
+
+
+def _write_atomic(path, content: bytes):
+    """Write to a temp file, fsync it and rename over the target
+
+    Readers see either the old or the new file, never a torn one.
+    """
+    tmp_path = f'{path}.tmp'
+    with timed('file_write'):
+        with open(tmp_path, 'wb') as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+
+def _record_file() -> str:
+    # Random rather than derived from the id: ids like 1 and "1" must not share a file
+    return secrets.token_hex(8)
+
+
+def find_duplicate_id(websites):
+    """The first website id that occurs twice in a list, or None"""
+    seen = set()
+    for website in websites:
+        website_id = website.get('id') if isinstance(website, dict) else None
+        if website_id is None:
+            continue
+        key = (type(website_id).__name__, website_id)
+        if key in seen:
+            return website_id
+        seen.add(key)
+    return None
+
+
+class RecordStore:
+    """Encrypted record-per-website storage for one user"""
+
+    def __init__(self, directory, get_key, legacy_file=None, kdf=None):
+        self.directory = directory
+        self.index_file = os.path.join(directory, 'index.json')
+        self.get_key = get_key  # get_key(salt, kdf) -> key
+        self.legacy_file = legacy_file
+        self.kdf = kdf or container.LEGACY_KDF  # parameters for newly keyed stores
+        self._lock = lock_for(directory)
+
+    # ------------------------------------------------------------------
+    # Storage primitives (overridden by other backends)
+    # ------------------------------------------------------------------
+
+    def _transaction(self):
+        """Context manager that makes one operation atomic and isolated"""
+        return self._lock
+
+    def _read_transaction(self):
+        """Context manager for a consistent read that changes nothing"""
+        return self._lock
+
+    def _read_index(self):
+        if not os.path.exists(self.index_file):
+            return None
+        with timed('file_read'):
+            with open(self.index_file, 'r') as f:
+                return json.load(f)
+
+    def _write_index(self, index):
+        os.makedirs(self.directory, exist_ok=True)
+        _write_atomic(self.index_file, json.dumps(index).encode())
+
+    def _index_etag(self):
+        with timed('file_read'):
+            with open(self.index_file, 'rb') as f:
+                return hashlib.sha256(f.read()).hexdigest()[:32]
+
+    def _record_path(self, entry):
+        return os.path.join(self.directory, f"{entry['file']}.rec")
+
+    def _read_token(self, entry) -> bytes:
+        with timed('file_read'):
+            with open(self._record_path(entry), 'rb') as f:
+                return f.read()
+
+    def _write_token(self, entry, token: bytes):
+        os.makedirs(self.directory, exist_ok=True)
+        _write_atomic(self._record_path(entry), token)
+
+    def _has_token(self, entry) -> bool:
+        return os.path.exists(self._record_path(entry))
+
+    def _remove_token(self, entry):
+        if os.path.exists(self._record_path(entry)):
+            os.remove(self._record_path(entry))
+
+    # ------------------------------------------------------------------
+    # Internals
+    # ------------------------------------------------------------------
+
+    def _new_index(self):
+        return {'version': INDEX_VERSION, 'salt': secrets.token_hex(16), 'kdf': self.kdf, 'records': []}
+
+    def _crypto(self, index):
+        key = self.get_key(bytes.fromhex(index['salt']), index.get('kdf', container.LEGACY_KDF))
+        mac_key = hashlib.sha256(b'record-mac:' + key).digest()
+        return key, mac_key
+
+    def _needs_rekey(self, index) -> bool:
+        return index.get('kdf', container.LEGACY_KDF) != self.kdf
+
+    @staticmethod
+    def _mac(mac_key, plaintext: bytes) -> str:
+        return hmac.new(mac_key, plaintext, hashlib.sha256).hexdigest()
+
+    def _read_record(self, key, entry):
+        return self._decode_record(key, self._read_token(entry))
+
+    @staticmethod
+    def _decode_record(key, token):
+        with timed('decrypt'):
+            plaintext = container.decrypt(key, token)
+        with timed('json_decode'):
+            return json.loads(plaintext.decode())
+
+    def _write_record(self, key, mac_key, entry, website):
+        with timed('json_encode'):
+            plaintext = json.dumps(website).encode()
+        mac = self._mac(mac_key, plaintext)
+        if entry.get('mac') == mac and entry.get('format') == container.VERSION and self._has_token(entry):
+            return False  # Unchanged and already in the current format
+        with timed('encrypt'):
+            token = container.encrypt(key, plaintext)
+        self._write_token(entry, token)
+        entry['mac'] = mac
+        entry['format'] = container.VERSION
+        return True
+
+    def _import_legacy(self):
+        """Split a single-file .enc store (legacy or file container) into records"""
+        with open(self.legacy_file, 'rb') as f:
+            encrypted_data = f.read()
+        websites = json.loads(container.unpack_file(encrypted_data, self.get_key).decode())
+
+        index = self._new_index()
+        self._replace(index, websites)
+        os.replace(self.legacy_file, self.legacy_file + '.backup')
+        return index
+
+    def _load_index(self):
+        index = self._read_index()
+        if index is None and self.legacy_file and os.path.exists(self.legacy_file):
+            index = self._import_legacy()
+        return index
+
+    def _replace(self, index, websites):
+        retired = []  # Record files to remove once the new index is written
+        if self._needs_rekey(index):
+            # KDF settings changed: re-encrypt everything under a new salt and key.
+            # The re-keyed records get new files, so until the new index replaces
+            # the old one, the old index still points at records it can decrypt.
+            previous = index['records']
+            retired = [dict(entry) for entry in previous]
+            index.clear()
+            index.update(self._new_index())
+            for entry in previous:
+                entry.pop('mac', None)
+                entry['file'] = secrets.token_hex(8)
+            index['records'] = previous
+
+        key, mac_key = self._crypto(index)
+        existing = {entry['id']: entry for entry in index['records'] if entry['id'] is not None}
+        records = []
+        written = 0
+
+        for website in websites:
+            website_id = website.get('id') if isinstance(website, dict) else None
+            entry = existing.pop(website_id, None) if website_id is not None else None
+            if entry is None:
+                entry = {'id': website_id, 'file': _record_file()}
+            if self._write_record(key, mac_key, entry, website):
+                written += 1
+            records.append(entry)
+
+        # Records without an id can't be matched, so they are always rewritten
+        stale = list(existing.values()) + [e for e in index['records'] if e['id'] is None]
+
+        index['records'] = records
+        index['version'] = INDEX_VERSION
+        self._write_index(index)
+
+        # Only now is nothing referring to the old files any more
+        kept = {entry['file'] for entry in records}
+        for entry in stale + retired:
+            if entry['file'] not in kept:
+                self._remove_token(entry)
+        return {'written': written, 'unchanged': len(records) - written, 'deleted': len(stale)}
+
+    # ------------------------------------------------------------------
+    # Public API
+    # ------------------------------------------------------------------
+
+    def exists(self) -> bool:
+        """Whether this user has any stored data (new or legacy format)"""
+        return os.path.exists(self.index_file) or bool(
+            self.legacy_file and os.path.exists(self.legacy_file)
+        )
+
+    def load(self) -> list:
+        """Decrypt and return every website, in order"""
+        return self.snapshot()[2]
+
+    def version(self):
+        """Cheap change marker: stat signature of the index, or None
+
+        Every change rewrites the index through a rename, so a new
+        signature means new content.
+        """
+        try:
+            st = os.stat(self.index_file)
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def etag(self):
+        """The etag snapshot() would return, or None, without deriving a key or decrypting
+
+        Also None while the user's data is still a legacy .enc file that the
+        next load imports.
+        """
+        try:
+            return self._index_etag()
+        except FileNotFoundError:
+            return None
+
+    def _read_snapshot(self):
+        """(version, etag, index, record tokens) from one read transaction, or None"""
+        with self._read_transaction():
+            index = self._read_index()
+            if index is None:
+                return None
+            tokens = [self._read_token(entry) for entry in index['records']]
+            return self.version(), self._index_etag(), index, tokens
+
+    def snapshot(self):
+        """Return (version, etag, websites) read consistently
+
+        The etag is a hash of the index, which holds every record's MAC and
+        the record order, so it changes exactly when the content does. Only
+        the stored bytes are read inside the read transaction; deriving the
+        key and decrypting happen after it ends, so they never hold up writers.
+        """
+        state = self._read_snapshot()
+        if state is None:
+            with self._transaction():
+                if self._load_index() is None:  # Imports legacy data, if any
+                    return None, None, []
+            state = self._read_snapshot()
+            if state is None:
+                return None, None, []
+        version, etag, index, tokens = state
+        key, _ = self._crypto(index)
+        websites = [self._decode_record(key, token) for token in tokens]
+        return version, etag, websites
+
+    def replace_all(self, websites: list) -> dict:
+        """Store a full website list, rewriting only records that changed
+
+        Raises ValueError if two websites share an id.
+        """
+        duplicate = find_duplicate_id(websites)
+        if duplicate is not None:
+            raise ValueError(f'Duplicate website id {duplicate!r}')
+        with self._transaction():
+            index = self._load_index() or self._new_index()
+            return self._replace(index, websites)
+
+    def _put(self, website_id, fields, new):
+        """Merge fields into the website with website_id, which must (not) exist yet"""
+        with self._transaction():
+            index = self._load_index() or self._new_index()
+            entry = next((e for e in index['records'] if e['id'] == website_id), None)
+            if (entry is None) != new:
+                return None
+            key, mac_key = self._crypto(index)
+
+            website = self._read_record(key, entry) if entry is not None else {}
+            website.update(fields)
+            website['id'] = website_id
+
+            if self._needs_rekey(index):
+                websites = [website if e is entry else self._read_record(key, e) for e in index['records']]
+                if entry is None:
+                    websites.append(website)
+                self._replace(index, websites)
+                return website
+
+            if entry is None:
+                entry = {'id': website_id, 'file': _record_file()}
+                index['records'].append(entry)
+            # The index holds each record's MAC, so it changes whenever a record does
+            if self._write_record(key, mac_key, entry, website):
+                self._write_index(index)
+            return website
+
+    def update(self, website_id, fields: dict):
+        """Merge fields into one website; returns the website, or None if there is none with that id"""
+        return self._put(website_id, fields, new=False)
+
+    def add(self, website_id, fields: dict):
+        """Append a new website; returns it, or None if one with that id already exists"""
+        return self._put(website_id, fields, new=True)
+
+    def delete(self, website_id) -> bool:
+        """Remove one website; returns False if it did not exist"""
+        with self._transaction():
+            index = self._load_index()
+            if index is None:
+                return False
+
+            entry = next((e for e in index['records'] if e['id'] == website_id), None)
+            if entry is None:
+                return False
+
+            index['records'].remove(entry)
+            self._write_index(index)
+            self._remove_token(entry)
+            return True
@@ -4,19 +4,53 @@ Secure Dashboard Server with Server-Side Encryption
 This server provides proper encryption for sensitive data.
 """
 
-from flask import Flask, request, jsonify, send_from_directory, send_file, abort, make_response
+import time
+
+_started = time.perf_counter()  # Startup timings (see /ready) count from here
+
+from flask import Flask, Response, request, jsonify, send_from_directory, send_file, abort, make_response, g
 from flask_cors import CORS
 import os
 import json
 import hashlib
 import secrets
+import signal
+import sys
+import threading
+import atexit
+from collections import OrderedDict
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
-from cryptography.fernet import Fernet
-from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
-import base64
-import requests
 from dotenv import load_dotenv
+from session_store import SessionStore
+from upstream_pool import UpstreamSessionPool
+from stats_cache import StatsCache, fingerprint
+from single_flight import SingleFlight
+from stats_poller import StatsPoller
+from timeseries import TimeSeriesStore, METRICS, RESOLUTIONS
+from record_store import RecordStore, find_duplicate_id, lock_for
+import container
+from write_coalescer import WriteCoalescer
+from static_assets import AssetBundle
+from compression import ResponseCompressor
+import json_backend
+from lockout_tracker import LockoutTracker
+from audit_log import AuditLog
+from site_health import SiteHealth
+from sqlite_storage import (
+    SQLiteDatabase, SQLiteSessionStore, SQLiteLockoutTracker, SQLiteRecordStore,
+    SQLiteStatsCache, SQLiteSiteHealth, SQLiteMetricsShare
+)
+from structured_log import StructuredLogger, parse_sample_rates
+import metrics
+from metrics import Counter, Gauge, Histogram, timed
+from profiler import RequestProfiler
+from startup import Startup
+from snapshots import SnapshotStore, hold_server_lock
+
+startup = Startup(started=_started)
+startup.record('imports', time.perf_counter() - _started)
 
 # Load environment variables from .env file
 load_dotenv()
@@ -27,26 +61,140 @@ CORS(app)
 # Configuration
 DATA_DIR = os.getenv('RAILWAY_VOLUME_MOUNT_PATH', 'secure_data')
 SESSIONS_FILE = os.path.join(DATA_DIR, 'sessions.json')
+SESSIONS_JOURNAL_FILE = os.path.join(DATA_DIR, 'sessions.journal')
 USERS_FILE = os.path.join(DATA_DIR, 'users.json')
 LOCKOUTS_FILE = os.path.join(DATA_DIR, 'lockouts.json')
 LOGIN_LOG_FILE = os.path.join(DATA_DIR, 'login_attempts.log')
+HISTORY_DIR = os.path.join(DATA_DIR, 'timeseries')
+STORAGE_DB_FILE = os.path.join(DATA_DIR, 'dashboard.db')
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'file')  # 'sqlite' is required for several workers
 SESSION_DURATION = 72 * 60 * 60  # 72 hours in seconds
+SESSION_SWEEP_INTERVAL = int(os.getenv('SESSION_SWEEP_INTERVAL', 300))  # seconds
+SESSION_JOURNAL_COMPACT_THRESHOLD = int(os.getenv('SESSION_JOURNAL_COMPACT_THRESHOLD', 1000))
 
 # Rate Limiting Configuration
 MAX_LOGIN_ATTEMPTS = 5
 LOCKOUT_DURATION = 15 * 60  # 15 minutes in seconds
+LOCKOUT_WINDOW = int(os.getenv('LOCKOUT_WINDOW', 15 * 60))  # failures older than this stop counting
+LOCKOUT_SNAPSHOT_INTERVAL = int(os.getenv('LOCKOUT_SNAPSHOT_INTERVAL', 30))  # seconds
+
+# Login Audit Log Configuration
+AUDIT_FLUSH_INTERVAL = float(os.getenv('AUDIT_FLUSH_INTERVAL', 2))  # seconds
+AUDIT_ROTATE_BYTES = int(os.getenv('AUDIT_ROTATE_BYTES', 5 * 1024 * 1024))
+AUDIT_ROTATE_HOURS = int(os.getenv('AUDIT_ROTATE_HOURS', 24))
+AUDIT_MAX_SEGMENTS = int(os.getenv('AUDIT_MAX_SEGMENTS', 90))  # rotated files kept
+AUDIT_QUERY_MAX_LIMIT = 1000
+
+# Stats Proxy Configuration
+PROXY_STATS_TIMEOUT = int(os.getenv('PROXY_STATS_TIMEOUT', 10))  # upper bound per upstream request (seconds)
+UPSTREAM_MIN_TIMEOUT = float(os.getenv('UPSTREAM_MIN_TIMEOUT', 1))  # lower bound of adaptive timeouts
+UPSTREAM_TIMEOUT_MULTIPLIER = float(os.getenv('UPSTREAM_TIMEOUT_MULTIPLIER', 3))  # x the site's p95 latency
+UPSTREAM_CONNECT_TIMEOUT = 3  # seconds; a reachable host accepts quickly
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv('CIRCUIT_FAILURE_THRESHOLD', 3))  # consecutive failures to open
+CIRCUIT_COOLDOWN = float(os.getenv('CIRCUIT_COOLDOWN', 30))  # seconds before the first half-open probe
+CIRCUIT_MAX_COOLDOWN = float(os.getenv('CIRCUIT_MAX_COOLDOWN', 300))
+PROXY_STATS_CONCURRENCY = int(os.getenv('PROXY_STATS_CONCURRENCY', 16))
+PROXY_STATS_MAX_BATCH = int(os.getenv('PROXY_STATS_MAX_BATCH', 500))
+UPSTREAM_POOL_MAX_ORIGINS = int(os.getenv('UPSTREAM_POOL_MAX_ORIGINS', 256))
+UPSTREAM_MAX_CONNECTIONS_PER_HOST = int(os.getenv('UPSTREAM_MAX_CONNECTIONS_PER_HOST', 4))
+UPSTREAM_IDLE_TIMEOUT = int(os.getenv('UPSTREAM_IDLE_TIMEOUT', 300))  # seconds
+STATS_CACHE_TTL = int(os.getenv('STATS_CACHE_TTL', 60))  # seconds a result is fresh
+STATS_CACHE_STALE_TTL = int(os.getenv('STATS_CACHE_STALE_TTL', 600))  # extra seconds served stale
+STATS_CACHE_NEGATIVE_TTL = int(os.getenv('STATS_CACHE_NEGATIVE_TTL', 30))  # failures
+STATS_CACHE_MAX_ENTRIES = int(os.getenv('STATS_CACHE_MAX_ENTRIES', 2048))
+
+# Background Polling / Server-Sent Events Configuration
+STATS_POLL_INTERVAL = int(os.getenv('STATS_POLL_INTERVAL', 300))  # seconds per site
+STATS_POLL_JITTER = float(os.getenv('STATS_POLL_JITTER', 0.1))  # +/- fraction of interval
+SSE_HEARTBEAT_INTERVAL = 15  # seconds between keep-alive comments
+SSE_MAX_STREAM_SECONDS = int(os.getenv('SSE_MAX_STREAM_SECONDS', 300))  # client reconnects after
+SSE_TICKET_TTL = int(os.getenv('SSE_TICKET_TTL', 30))  # seconds to open the stream with a ticket
+
+# Stats History Configuration
+HISTORY_RAW_POINTS = int(os.getenv('HISTORY_RAW_POINTS', 2016))  # one week at 5-minute polls
+HISTORY_RETENTION = {
+    'minute': int(os.getenv('HISTORY_MINUTE_RETENTION_DAYS', 7)) * 86400,
+    'hour': int(os.getenv('HISTORY_HOUR_RETENTION_DAYS', 90)) * 86400,
+    'day': int(os.getenv('HISTORY_DAY_RETENTION_DAYS', 1825)) * 86400
+}
+HISTORY_MAX_POINTS = 2000  # per series per query
+
+# Static Asset Configuration
+STATIC_PIPELINE = os.getenv('STATIC_PIPELINE', '1') == '1'  # 0 serves index.html as-is
+STATIC_ASSET_MAX_AGE = 365 * 24 * 60 * 60  # hashed names never change content
+
+# Response Compression / JSON Configuration
+RESPONSE_COMPRESSION = os.getenv('RESPONSE_COMPRESSION', '1') == '1'  # gzip/brotli for JSON responses
+COMPRESS_MIN_BYTES = int(os.getenv('COMPRESS_MIN_BYTES', 1024))  # smaller bodies are sent as-is
+JSON_BACKEND = os.getenv('JSON_BACKEND', 'auto')  # 'auto' (orjson when installed), 'orjson' or 'json'
+JSON_STREAM_MIN_ITEMS = int(os.getenv('JSON_STREAM_MIN_ITEMS', 500))  # longer website lists are streamed
+
+# Save Coalescing Configuration
+SAVE_COALESCE_DELAY = float(os.getenv('SAVE_COALESCE_DELAY', 0.2))  # seconds a save may wait for others
+
+# Decrypted Data Cache Configuration
+DATA_CACHE_MAX_ENTRIES = int(os.getenv('DATA_CACHE_MAX_ENTRIES', 64))  # users
+
+# Key Derivation Configuration (applies to newly written data; older data is re-keyed on its next write)
+KDF_ALGORITHM = os.getenv('KDF_ALGORITHM', 'pbkdf2-sha256')  # or 'scrypt'
+KDF_ITERATIONS = int(os.getenv('KDF_ITERATIONS', 100000))  # PBKDF2 iterations
+KDF_SCRYPT_N = int(os.getenv('KDF_SCRYPT_N', 2 ** 15))  # scrypt CPU/memory cost
+STORAGE_KDF = container.kdf_from_settings(KDF_ALGORITHM, KDF_ITERATIONS, KDF_SCRYPT_N)
+
+# Key Derivation Cache Configuration
+KEY_CACHE_MAX_ENTRIES = int(os.getenv('KEY_CACHE_MAX_ENTRIES', 256))
+KEY_CACHE_TTL = SESSION_DURATION  # Cached keys never outlive a session
+
+# Logging Configuration
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'info')  # debug, info, warning or error
+LOG_SAMPLE_RATES = parse_sample_rates(os.getenv('LOG_SAMPLE_RATES', ''))  # per-route info/debug sampling
+
+# Metrics Configuration
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')  # bearer token for /metrics scrapers (else a session token)
+METRICS_SHARE_INTERVAL = float(os.getenv('METRICS_SHARE_INTERVAL', 5))  # seconds between publishing to other workers
+# Workers of one gunicorn master share a generation (set in gunicorn.conf.py); /metrics adds them up
+SERVER_GENERATION = os.getenv('SERVER_GENERATION') or f'pid-{os.getpid()}'
+
+# Profiling Configuration
+PROFILE_ENABLED = os.getenv('PROFILE_ENABLED', '0') == '1'  # sample PROFILE_SAMPLE_RATE of PROFILE_ROUTES
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', 0.01))
+PROFILE_ROUTES = [r.strip() for r in os.getenv('PROFILE_ROUTES', '/api/data,/api/proxy-stats').split(',') if r.strip()]
+PROFILE_MODE = os.getenv('PROFILE_MODE', 'sample')  # 'sample' (collapsed stacks) or 'cprofile' (pstats)
+PROFILE_INTERVAL = float(os.getenv('PROFILE_INTERVAL', 0.005))  # seconds between stack samples
+PROFILE_TOKEN = os.getenv('PROFILE_TOKEN', '')  # 'X-Profile: <token>' forces profiling; also guards downloads
+
+# Startup Configuration
+STARTUP_WARMUP = os.getenv('STARTUP_WARMUP', '1') == '1'  # warm caches in the background; /ready waits for it
+WARMUP_ORIGINS = [o.strip() for o in os.getenv('WARMUP_ORIGINS', '').split(',') if o.strip()]  # pre-connect
+
+# Backup Configuration
+BACKUP_DIR = os.getenv('BACKUP_DIR') or os.path.join(DATA_DIR, 'backups')  # snapshot chunks and manifests
+BACKUP_INTERVAL = int(os.getenv('BACKUP_INTERVAL', 0))  # seconds between automatic snapshots (0 = off)
+BACKUP_KEEP_LAST = int(os.getenv('BACKUP_KEEP_LAST', 24))  # newest snapshots always kept
+BACKUP_KEEP_DAILY = int(os.getenv('BACKUP_KEEP_DAILY', 14))  # plus the newest of each of this many days
+BACKUP_TOKEN = os.getenv('BACKUP_TOKEN', '')  # bearer token for /api/admin/backups (else a session token)
+
+# JSON encoding/decoding for requests, responses and upstream bodies
+json_backend.use(JSON_BACKEND)
+app.json = json_backend.JSONProvider(app)
+
+# Structured JSON logs, written by a background thread
+log = StructuredLogger(level=LOG_LEVEL, sample_rates=LOG_SAMPLE_RATES).start()
+atexit.register(log.close)
 
 # Debug volume path configuration
-print(f"=== Volume Configuration Debug ===")
-print(f"DATA_DIR: {DATA_DIR}")
-print(f"DATA_DIR exists: {os.path.exists(DATA_DIR)}")
-print(f"Current working directory: {os.getcwd()}")
-print(f"RAILWAY_VOLUME_MOUNT_PATH: {os.getenv('RAILWAY_VOLUME_MOUNT_PATH')}")
-print(f"=================================")
+log.debug(
+    'startup.volume',
+    data_dir=DATA_DIR,
+    data_dir_exists=os.path.exists(DATA_DIR),
+    cwd=os.getcwd(),
+    railway_volume_mount_path=os.getenv('RAILWAY_VOLUME_MOUNT_PATH')
+)
 
 # Ensure data directory exists
 os.makedirs(DATA_DIR, exist_ok=True)
-print(f"Created/verified DATA_DIR: {DATA_DIR}")
+log.info('startup.data_dir', data_dir=DATA_DIR)
+server_lock = hold_server_lock(DATA_DIR)  # snapshots.py restore refuses while any process holds it
 
 # Load credentials from environment variables (or use defaults for first-time setup)
 DEFAULT_PASSWORD = os.getenv('DASHBOARD_PASSWORD', 'admin123')
@@ -54,155 +202,375 @@ DEFAULT_OTP = os.getenv('DASHBOARD_OTP', '1234')
 
 # Warn if using default credentials
 if DEFAULT_PASSWORD == 'admin123' or DEFAULT_OTP == '1234':
-    print("⚠️  WARNING: Using default credentials! Create .env file with custom credentials.")
+    log.warning('startup.default_credentials', message='Create .env file with custom credentials')
 
 
-def derive_key(password: str, salt: bytes) -> bytes:
-    """Derive encryption key from password using PBKDF2"""
-    kdf = PBKDF2HMAC(
-        algorithm=hashes.SHA256(),
-        length=32,
-        salt=salt,
-        iterations=100000,
-    )
-    return base64.urlsafe_b64encode(kdf.derive(password.encode()))
+def derive_key(password: str, salt: bytes, kdf: dict = None) -> bytes:
+    """Derive encryption key from password (PBKDF2 at 100k iterations unless kdf says otherwise)"""
+    return container.derive_key(password, salt, kdf)
+
+
+# Derived keys keyed by (username, salt, kdf), least recently used first
+_key_cache = OrderedDict()
+_key_cache_lock = threading.Lock()
+_key_cache_stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'expired': 0}
+
+def get_cached_key(username: str, salt: bytes, kdf: dict = None) -> bytes:
+    """Get derived key from cache, running the KDF only on a miss"""
+    cache_key = (username, salt, json.dumps(kdf, sort_keys=True))
+    now = time.monotonic()
+
+    with _key_cache_lock:
+        entry = _key_cache.get(cache_key)
+        if entry is not None:
+            key, expires_at = entry
+            if now < expires_at:
+                _key_cache.move_to_end(cache_key)
+                _key_cache_stats['hits'] += 1
+                return key
+            del _key_cache[cache_key]
+            _key_cache_stats['expired'] += 1
+        _key_cache_stats['misses'] += 1
+
+    # Derive outside the lock so other users are not blocked by the KDF
+    with timed('key_derivation'):
+        key = derive_key(username, salt, kdf)
+
+    with _key_cache_lock:
+        _key_cache[cache_key] = (key, now + KEY_CACHE_TTL)
+        _key_cache.move_to_end(cache_key)
+        while len(_key_cache) > KEY_CACHE_MAX_ENTRIES:
+            _key_cache.popitem(last=False)
+            _key_cache_stats['evictions'] += 1
+
+    return key
+
+
+def purge_cached_keys(username: str):
+    """Drop every cached key belonging to a user"""
+    with _key_cache_lock:
+        for cache_key in [k for k in _key_cache if k[0] == username]:
+            del _key_cache[cache_key]
+
+
+def key_cache_stats() -> dict:
+    """Snapshot of key cache counters"""
+    with _key_cache_lock:
+        stats = dict(_key_cache_stats)
+        stats['size'] = len(_key_cache)
+        stats['max_entries'] = KEY_CACHE_MAX_ENTRIES
+    lookups = stats['hits'] + stats['misses']
+    stats['hit_ratio'] = round(stats['hits'] / lookups, 4) if lookups else 0.0
+    return stats
 
 
 def get_user_file(username: str) -> str:
-    """Get user-specific data file path"""
+    """Get user-specific data file path (legacy single-file format)"""
     safe_username = hashlib.sha256(username.encode()).hexdigest()[:16]
     return os.path.join(DATA_DIR, f'{safe_username}.enc')
 
 
-def load_sessions():
-    """Load active sessions"""
-    if os.path.exists(SESSIONS_FILE):
-        try:
-            with open(SESSIONS_FILE, 'r') as f:
-                return json.load(f)
-        except:
-            return {}
-    return {}
+def get_user_store(username: str) -> RecordStore:
+    """Get the user's per-website encrypted record store"""
+    user_file = get_user_file(username)
+    get_key = lambda salt, kdf: get_cached_key(username, salt, kdf)
+    store = RecordStore(user_file[:-len('.enc')] + '.d', get_key, legacy_file=user_file, kdf=STORAGE_KDF)
+    if storage_db is None:
+        return store
+    # File-format data is imported into the database the first time it is used
+    owner = os.path.basename(user_file)[:-len('.enc')]
+    return SQLiteRecordStore(storage_db, owner, get_key, fallback=store, kdf=STORAGE_KDF)
 
 
-def save_sessions(sessions):
-    """Save active sessions"""
-    with open(SESSIONS_FILE, 'w') as f:
-        json.dump(sessions, f)
+def write_user_data(username: str, data: list) -> dict:
+    """Write a user's full website list (called once per coalesced burst)"""
+    result = get_user_store(username).replace_all(data)
+    stats_poller.set_sites(username, data)
+    return result
 
 
-def load_lockouts():
-    """Load lockout data from disk"""
-    if os.path.exists(LOCKOUTS_FILE):
-        try:
-            with open(LOCKOUTS_FILE, 'r') as f:
-                data = json.load(f)
-                # Convert ISO strings back to datetime
-                for ip in data:
-                    if data[ip].get('locked_until'):
-                        data[ip]['locked_until'] = datetime.fromisoformat(data[ip]['locked_until'])
-                return data
-        except:
-            return {}
-    return {}
-
-
-def save_lockouts(lockouts):
-    """Save lockout data to disk (persistent)"""
-    # Convert datetime to ISO string for JSON serialization
-    serializable = {}
-    for ip, data in lockouts.items():
-        serializable[ip] = {
-            'count': data['count'],
-            'locked_until': data['locked_until'].isoformat() if data.get('locked_until') else None
-        }
+# Decrypted website lists keyed by username: (store version, etag, data)
+_data_cache = OrderedDict()
+_data_cache_lock = threading.Lock()
+_data_cache_stats = {'hits': 0, 'misses': 0, 'not_modified': 0}
+
+
+def load_user_data(username: str):
+    """Return (etag, data), decrypting only if the store changed since last time"""
+    store = get_user_store(username)
+    version = store.version()
+    
+    with _data_cache_lock:
+        cached = _data_cache.get(username)
+        if cached and version is not None and cached[0] == version:
+            _data_cache.move_to_end(username)
+            _data_cache_stats['hits'] += 1
+            return cached[1], cached[2]
+        _data_cache_stats['misses'] += 1
+    
+    version, etag, data = store.snapshot()
+    stats_poller.set_sites(username, data)
     
-    with open(LOCKOUTS_FILE, 'w') as f:
-        json.dump(serializable, f, indent=2)
+    with _data_cache_lock:
+        _data_cache[username] = (version, etag, data)
+        _data_cache.move_to_end(username)
+        while len(_data_cache) > DATA_CACHE_MAX_ENTRIES:
+            _data_cache.popitem(last=False)
+    return etag, data
+
+
+def forget_user_data(username: str):
+    """Drop a user's decrypted data from memory"""
+    with _data_cache_lock:
+        _data_cache.pop(username, None)
+
+
+def data_cache_stats() -> dict:
+    """Snapshot of decrypted data cache counters"""
+    with _data_cache_lock:
+        stats = dict(_data_cache_stats)
+        stats['size'] = len(_data_cache)
+    return stats
+
+
+# Bursts of full saves from one user become a single write
+save_coalescer = WriteCoalescer(write_user_data, delay=SAVE_COALESCE_DELAY)
+atexit.register(save_coalescer.flush_all)
+
+
+# Shared database for the sqlite backend (None = per-process JSON files)
+if STORAGE_BACKEND == 'sqlite':
+    with startup.phase('storage'):
+        storage_db = SQLiteDatabase(STORAGE_DB_FILE)
+elif STORAGE_BACKEND == 'file':
+    storage_db = None
+else:
+    raise ValueError(f"STORAGE_BACKEND must be 'file' or 'sqlite', not {STORAGE_BACKEND!r}")
+
+# Active sessions (in memory, journaled to disk; or in the database)
+session_store = SessionStore(
+    SESSIONS_FILE,
+    SESSIONS_JOURNAL_FILE,
+    compact_threshold=SESSION_JOURNAL_COMPACT_THRESHOLD,
+    sweep_interval=SESSION_SWEEP_INTERVAL
+)
+if storage_db is not None:
+    session_store = SQLiteSessionStore(storage_db, sweep_interval=SESSION_SWEEP_INTERVAL, legacy_store=session_store)
+with startup.phase('sessions'):
+    session_store.load()
+session_store.start_sweeper(on_error=lambda e: log.error('sessions.sweep_failed', error=str(e)))
+
+# Login attempt log (buffered, rotated and indexed)
+audit_log = AuditLog(
+    LOGIN_LOG_FILE,
+    flush_interval=AUDIT_FLUSH_INTERVAL,
+    max_bytes=AUDIT_ROTATE_BYTES,
+    max_age=AUDIT_ROTATE_HOURS * 60 * 60,
+    max_segments=AUDIT_MAX_SEGMENTS
+)
+audit_log.start(on_error=lambda e: log.error('audit.flush_failed', error=str(e)))
+atexit.register(audit_log.flush)
+
+# Failed login counters (in memory, snapshotted to disk; or in the database)
+lockout_tracker = LockoutTracker(
+    LOCKOUTS_FILE,
+    max_attempts=MAX_LOGIN_ATTEMPTS,
+    lockout_duration=LOCKOUT_DURATION,
+    window=LOCKOUT_WINDOW,
+    snapshot_interval=LOCKOUT_SNAPSHOT_INTERVAL
+)
+if storage_db is not None:
+    lockout_tracker = SQLiteLockoutTracker(
+        storage_db,
+        max_attempts=MAX_LOGIN_ATTEMPTS,
+        lockout_duration=LOCKOUT_DURATION,
+        window=LOCKOUT_WINDOW,
+        sweep_interval=LOCKOUT_SNAPSHOT_INTERVAL,
+        legacy_tracker=lockout_tracker
+    )
+with startup.phase('lockouts'):
+    lockout_tracker.load()
+lockout_tracker.start(on_error=lambda e: log.error('lockouts.snapshot_failed', error=str(e)))
+atexit.register(lockout_tracker.snapshot)
+
+# Shared worker pool for upstream stats requests (caps total concurrency)
+_stats_executor = ThreadPoolExecutor(
+    max_workers=PROXY_STATS_CONCURRENCY,
+    thread_name_prefix='proxy-stats'
+)
+
+# Keep-alive HTTP sessions per upstream origin
+upstream_pool = UpstreamSessionPool(
+    max_origins=UPSTREAM_POOL_MAX_ORIGINS,
+    max_connections_per_host=UPSTREAM_MAX_CONNECTIONS_PER_HOST,
+    idle_timeout=UPSTREAM_IDLE_TIMEOUT
+)
+upstream_pool.start_reaper(on_error=lambda e: log.warning('upstream.evict_failed', error=str(e)))
+
+# Per-domain adaptive timeouts and circuit breakers (breakers shared by every worker with sqlite)
+site_health_options = dict(
+    min_timeout=UPSTREAM_MIN_TIMEOUT,
+    max_timeout=PROXY_STATS_TIMEOUT,
+    multiplier=UPSTREAM_TIMEOUT_MULTIPLIER,
+    failure_threshold=CIRCUIT_FAILURE_THRESHOLD,
+    cooldown=CIRCUIT_COOLDOWN,
+    max_cooldown=CIRCUIT_MAX_COOLDOWN,
+    max_domains=UPSTREAM_POOL_MAX_ORIGINS
+)
+if storage_db is not None:
+    site_health = SQLiteSiteHealth(storage_db, **site_health_options)
+else:
+    site_health = SiteHealth(**site_health_options)
 
 
 def log_login_attempt(ip, success, message=''):
-    """Log login attempts to file"""
-    timestamp = datetime.now().isoformat()
+    """Log login attempts (buffered, flushed in the background)"""
     status = 'SUCCESS' if success else 'FAILED'
-    
-    with open(LOGIN_LOG_FILE, 'a') as f:
-        f.write(f"{timestamp} | IP: {ip:15} | {status:7} | {message}\n")
+    audit_log.write(ip, status, message)
 
 
-def is_ip_locked(ip, lockouts):
+def is_ip_locked(ip):
     """Check if IP is currently locked out"""
-    if ip not in lockouts:
-        return False, None
-    
-    attempt = lockouts[ip]
-    if attempt.get('locked_until'):
-        if datetime.now() < attempt['locked_until']:
-            # Still locked
-            remaining = (attempt['locked_until'] - datetime.now()).total_seconds()
-            return True, int(remaining)
-        else:
-            # Lockout expired, reset
-            lockouts[ip] = {'count': 0, 'locked_until': None}
-            save_lockouts(lockouts)
-            return False, None
-    return False, None
+    return lockout_tracker.is_locked(ip)
 
 
-def record_failed_attempt(ip, lockouts):
+def record_failed_attempt(ip):
     """Record failed login attempt and check if should lock"""
-    if ip not in lockouts:
-        lockouts[ip] = {'count': 0, 'locked_until': None}
-    
-    lockouts[ip]['count'] += 1
+    locked, value = lockout_tracker.record_failure(ip)
     
-    if lockouts[ip]['count'] >= MAX_LOGIN_ATTEMPTS:
-        lockouts[ip]['locked_until'] = datetime.now() + timedelta(seconds=LOCKOUT_DURATION)
-        save_lockouts(lockouts)
+    if locked:
         log_login_attempt(ip, False, f"LOCKED OUT - {MAX_LOGIN_ATTEMPTS} failed attempts")
-        return True, LOCKOUT_DURATION
+        return True, value
     
-    save_lockouts(lockouts)
-    remaining = MAX_LOGIN_ATTEMPTS - lockouts[ip]['count']
-    log_login_attempt(ip, False, f"Invalid credentials - {remaining} attempts remaining")
-    return False, remaining
+    log_login_attempt(ip, False, f"Invalid credentials - {value} attempts remaining")
+    return False, value
 
 
-def reset_attempts(ip, lockouts):
+def reset_attempts(ip):
     """Reset failed attempts on successful login"""
-    if ip in lockouts:
-        lockouts[ip] = {'count': 0, 'locked_until': None}
-        save_lockouts(lockouts)
+    lockout_tracker.reset(ip)
 
 
 def validate_session(token: str) -> bool:
     """Check if session token is valid"""
-    sessions = load_sessions()
-    if token not in sessions:
-        return False
-    
-    session = sessions[token]
-    expiry = datetime.fromisoformat(session['expires'])
-    
-    if datetime.now() > expiry:
-        del sessions[token]
-        save_sessions(sessions)
-        return False
-    
-    return True
+    return get_session_username(token) is not None
 
 
 def get_session_username(token: str) -> str:
-    """Get username from session token"""
-    sessions = load_sessions()
-    return sessions.get(token, {}).get('username')
+    """Get username from session token (None if invalid or expired)"""
+    with timed('session_lookup'):
+        return session_store.get_username(token)
+
+
+# Split, fingerprinted and precompressed copy of index.html (built on first use or during warm-up)
+asset_bundle = AssetBundle(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'index.html'))
+
+
+def send_asset(asset):
+    """Response with the best precompressed variant the client accepts"""
+    encoding = request.accept_encodings.best_match(asset.encodings, default='identity')
+    if encoding not in asset.variants:
+        encoding = 'identity'
+    
+    response = make_response(asset.variants[encoding])
+    response.headers['Content-Type'] = asset.content_type
+    response.headers['Vary'] = 'Accept-Encoding'
+    if encoding != 'identity':
+        response.headers['Content-Encoding'] = encoding
+    response.set_etag(f"{asset.etag}-{encoding}")
+    return response
+
+
+# Negotiated compression for JSON/NDJSON API responses (static assets are precompressed)
+response_compressor = ResponseCompressor(min_bytes=COMPRESS_MIN_BYTES)
+
+
+@app.after_request
+def compress_response(response):
+    # after_request hooks run in reverse order: registered early, this sees the routes' final headers
+    if RESPONSE_COMPRESSION:
+        response_compressor.apply(response, request.accept_encodings)
+    return response
+
+
+# Request metrics, exposed at /metrics
+REQUESTS_TOTAL = Counter('dashboard_requests_total', 'HTTP requests handled', labels=('method', 'route', 'status'))
+REQUEST_SECONDS = Histogram(
+    'dashboard_request_seconds',
+    'Time until the response is returned (first byte for streamed responses)',
+    labels=('method', 'route')
+)
+REQUESTS_IN_FLIGHT = Gauge('dashboard_requests_in_flight', 'Requests currently being handled')
+# No per-domain label: every monitored site would be its own series. Per-domain detail is in /health.
+UPSTREAM_SECONDS = Histogram('dashboard_upstream_seconds', 'Upstream /api/v1/stats latency')
+UPSTREAM_ERRORS = Counter('dashboard_upstream_errors_total', 'Failed upstream stats requests', labels=('reason',))
+
+
+@app.before_request
+def start_request_metrics():
+    g.metrics_started = time.perf_counter()
+    REQUESTS_IN_FLIGHT.inc()
+
+
+@app.after_request
+def record_response_status(response):
+    g.metrics_status = response.status_code
+    return response
+
+
+@app.teardown_request
+def finish_request_metrics(exc):
+    started = g.pop('metrics_started', None)
+    if started is None:
+        return
+    REQUESTS_IN_FLIGHT.dec()
+    # Label by URL rule, not path, so per-website URLs share one series
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    status = 500 if exc is not None else g.pop('metrics_status', 500)
+    REQUEST_SECONDS.observe(time.perf_counter() - started, method=request.method, route=route)
+    REQUESTS_TOTAL.inc(method=request.method, route=route, status=status)
+
+
+# Opt-in request profiling, downloadable from /api/admin/profiles
+request_profiler = RequestProfiler(
+    enabled=PROFILE_ENABLED,
+    sample_rate=PROFILE_SAMPLE_RATE,
+    routes=PROFILE_ROUTES,
+    mode=PROFILE_MODE,
+    interval=PROFILE_INTERVAL
+)
+
+
+def has_profile_token(value: str) -> bool:
+    return bool(PROFILE_TOKEN) and secrets.compare_digest(value.encode(), PROFILE_TOKEN.encode())
+
+
+@app.before_request
+def start_profiling():
+    rule = request.url_rule.rule if request.url_rule else None
+    if rule is None:
+        return
+    forced = has_profile_token(request.headers.get('X-Profile', ''))
+    if request_profiler.should_profile(rule, forced):
+        g.profile = request_profiler.start(f"{request.method} {rule}")
+
+
+@app.teardown_request
+def stop_profiling(exc):
+    handle = g.pop('profile', None)
+    if handle is not None:
+        request_profiler.stop(handle)
 
 
 @app.route('/')
 def index():
     """Serve main page"""
+    if STATIC_PIPELINE:
+        response = send_asset(asset_bundle.ensure_built().shell)
+    else:
+        response = send_from_directory('.', 'index.html')
+    
     # Add security headers
-    response = send_from_directory('.', 'index.html')
     response.headers['X-Robots-Tag'] = 'noindex, nofollow, noarchive, nosnippet'
     response.headers['X-Content-Type-Options'] = 'nosniff'
     response.headers['X-Frame-Options'] = 'DENY'
@@ -211,14 +579,26 @@ def index():
     return response
 
 
+@app.route('/assets/<name>')
+def static_asset(name):
+    """Serve a content-hashed CSS/JS file with immutable caching"""
+    asset = asset_bundle.ensure_built().assets.get(name)
+    if asset is None:
+        abort(404)
+    
+    response = send_asset(asset).make_conditional(request)
+    response.headers['X-Content-Type-Options'] = 'nosniff'
+    response.headers['Cache-Control'] = f'public, max-age={STATIC_ASSET_MAX_AGE}, immutable'
+    return response
+
+
 @app.route('/api/login', methods=['POST'])
 def login():
     """Authenticate user and create session with rate limiting"""
     ip = request.remote_addr
-    lockouts = load_lockouts()
     
     # Check if IP is locked out
-    is_locked, remaining_time = is_ip_locked(ip, lockouts)
+    is_locked, remaining_time = is_ip_locked(ip)
     if is_locked:
         minutes = int(remaining_time / 60)
         seconds = int(remaining_time % 60)
@@ -236,28 +616,22 @@ def login():
     # Validate credentials
     if password == DEFAULT_PASSWORD and otp == DEFAULT_OTP:
         # Success - reset attempts and create session
-        reset_attempts(ip, lockouts)
+        reset_attempts(ip)
         log_login_attempt(ip, True, 'Login successful')
         
         token = secrets.token_urlsafe(32)
         username = f"{password}:{otp}"
         
-        sessions = load_sessions()
-        sessions[token] = {
-            'username': username,
-            'created': datetime.now().isoformat(),
-            'expires': (datetime.now() + timedelta(seconds=SESSION_DURATION)).isoformat()
-        }
-        save_sessions(sessions)
+        session = session_store.create(token, username, SESSION_DURATION)
         
         return jsonify({
             'success': True,
             'token': token,
-            'expires': sessions[token]['expires']
+            'expires': session['expires']
         })
     
     # Failed - record attempt
-    locked, remaining = record_failed_attempt(ip, lockouts)
+    locked, remaining = record_failed_attempt(ip)
     
     if locked:
         return jsonify({
@@ -280,86 +654,146 @@ def logout():
     token = request.headers.get('Authorization', '').replace('Bearer ', '')
     
     if token:
-        sessions = load_sessions()
-        if token in sessions:
-            del sessions[token]
-            save_sessions(sessions)
+        session = session_store.delete(token)
+        if session:
+            end_user_session(token, session)
     
     return jsonify({'success': True})
 
 
+def end_user_session(token: str, session: dict):
+    """Drop the keys, data and polled sites of a user whose last session ended (logout and expiry)"""
+    username = session.get('username')
+    # Every session of a user shares them: another tab still signed in keeps its SSE
+    # updates and cached data, and does not derive the key again
+    if session_store.has_sessions(username):
+        return
+    purge_cached_keys(username)
+    forget_user_data(username)
+    stats_poller.remove_user(username)
+
+
 @app.route('/api/data', methods=['GET'])
 def get_data():
-    """Retrieve encrypted user data"""
+    """Retrieve encrypted user data (supports If-None-Match)"""
     token = request.headers.get('Authorization', '').replace('Bearer ', '')
     
-    if not validate_session(token):
-        print(f"[GET /api/data] Invalid session token")
-        return jsonify({'error': 'Invalid or expired session'}), 401
-    
     username = get_session_username(token)
-    user_file = get_user_file(username)
+    if not username:
+        log.info('auth.invalid_session', route='GET /api/data')
+        return jsonify({'error': 'Invalid or expired session'}), 401
     
-    print(f"[GET /api/data] Username: {username}, File: {user_file}")
+    # Make sure this user's own pending saves are visible
+    save_coalescer.flush(username)
     
-    if not os.path.exists(user_file):
-        print(f"[GET /api/data] File not found, returning empty data")
+    store = get_user_store(username)
+    if not store.exists():
         return jsonify({'data': []})
     
-    # Read encrypted data
-    with open(user_file, 'rb') as f:
-        encrypted_data = f.read()
+    # The etag is a hash of the index, so revalidating needs no key derivation or decryption,
+    # even when this worker has nothing cached
+    etag = store.etag() if request.if_none_match else None
+    if not (etag and request.if_none_match.contains_weak(etag)):
+        try:
+            etag, data = load_user_data(username)
+        except Exception as e:
+            log.error('data.load_failed', route='GET /api/data', username=username, error=str(e))
+            return jsonify({'error': 'Decryption failed'}), 500
+    
+    if etag and request.if_none_match.contains_weak(etag):  # Compressed responses carry a weak ETag
+        with _data_cache_lock:
+            _data_cache_stats['not_modified'] += 1
+        response = make_response('', 304)
+    elif len(data) >= JSON_STREAM_MIN_ITEMS:
+        # Encode big lists incrementally instead of building the whole body first
+        response = Response(json_backend.iter_object({'data': data}, 'data'), mimetype='application/json')
+    else:
+        response = jsonify({'data': data})
+    
+    # Browser may keep a private copy but must revalidate every time
+    if etag:
+        response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+@app.route('/api/data', methods=['POST'])
+def save_data():
+    """Save encrypted user data (only changed websites are re-encrypted)"""
+    token = request.headers.get('Authorization', '').replace('Bearer ', '')
+    
+    username = get_session_username(token)
+    if not username:
+        log.info('auth.invalid_session', route='POST /api/data')
+        return jsonify({'error': 'Invalid or expired session'}), 401
     
-    print(f"[GET /api/data] Loaded {len(encrypted_data)} bytes from disk")
+    data = request.json.get('data', [])
     
-    # Derive key and decrypt
-    salt = encrypted_data[:16]
-    encrypted_content = encrypted_data[16:]
+    duplicate = find_duplicate_id(data)
+    if duplicate is not None:
+        return jsonify({'error': f'Duplicate website id {duplicate!r}'}), 400
     
-    key = derive_key(username, salt)
-    fernet = Fernet(key)
+    if log.enabled('debug'):
+        log.debug('data.save_started', route='POST /api/data', username=username,
+                  store=get_user_store(username).directory, websites=len(data))
     
     try:
-        decrypted = fernet.decrypt(encrypted_content)
-        data = json.loads(decrypted.decode())
-        print(f"[GET /api/data] Successfully decrypted {len(data)} websites")
-        return jsonify({'data': data})
+        result = save_coalescer.submit(username, data)
     except Exception as e:
-        print(f"[GET /api/data] Decryption failed: {e}")
-        return jsonify({'error': 'Decryption failed'}), 500
+        log.error('data.save_failed', route='POST /api/data', username=username, error=str(e))
+        return jsonify({'error': 'Save failed'}), 500
+    
+    log.info('data.saved', route='POST /api/data', username=username, websites=len(data), **result)
+    
+    return jsonify({'success': True})
 
 
-@app.route('/api/data', methods=['POST'])
-def save_data():
-    """Save encrypted user data"""
+@app.route('/api/data/<website_id>', methods=['POST', 'PATCH'])
+def update_website(website_id):
+    """Add (POST) or update (PATCH) a single website without touching the others"""
     token = request.headers.get('Authorization', '').replace('Bearer ', '')
     
-    if not validate_session(token):
-        print(f"[POST /api/data] Invalid session token")
+    username = get_session_username(token)
+    if not username:
         return jsonify({'error': 'Invalid or expired session'}), 401
     
-    username = get_session_username(token)
-    user_file = get_user_file(username)
+    fields = (request.json or {}).get('website')
+    if not isinstance(fields, dict):
+        return jsonify({'error': 'Missing website'}), 400
     
-    data = request.json.get('data', [])
+    adding = request.method == 'POST'
+    try:
+        save_coalescer.flush(username)  # Apply after any pending full save
+        store = get_user_store(username)
+        website = store.add(website_id, fields) if adding else store.update(website_id, fields)
+    except Exception as e:
+        log.error('data.update_failed', route=f'{request.method} /api/data', username=username, error=str(e))
+        return jsonify({'error': 'Update failed'}), 500
     
-    print(f"[POST /api/data] Username: {username}, File: {user_file}")
-    print(f"[POST /api/data] Saving {len(data)} websites")
+    if website is None:
+        if adding:
+            return jsonify({'error': 'Website already exists'}), 409
+        return jsonify({'error': 'Website not found'}), 404
     
-    # Generate salt and derive key
-    salt = secrets.token_bytes(16)
-    key = derive_key(username, salt)
-    fernet = Fernet(key)
+    stats_poller.update_site(username, website_id, website)
     
-    # Encrypt data
-    json_data = json.dumps(data).encode()
-    encrypted = fernet.encrypt(json_data)
+    return jsonify({'success': True, 'website': website})
+
+
+@app.route('/api/data/<website_id>', methods=['DELETE'])
+def delete_website(website_id):
+    """Delete a single website"""
+    token = request.headers.get('Authorization', '').replace('Bearer ', '')
+    
+    username = get_session_username(token)
+    if not username:
+        return jsonify({'error': 'Invalid or expired session'}), 401
     
-    # Save salt + encrypted data
-    with open(user_file, 'wb') as f:
-        f.write(salt + encrypted)
+    save_coalescer.flush(username)  # Apply after any pending full save
+    if not get_user_store(username).delete(website_id):
+        return jsonify({'error': 'Website not found'}), 404
     
-    print(f"[POST /api/data] Successfully saved {len(encrypted)} bytes to disk")
+    stats_poller.update_site(username, website_id, None)
     
     return jsonify({'success': True})
 
@@ -381,59 +815,550 @@ def favicon():
 
 @app.route('/health')
 def health_check():
-    """Health check endpoint for Railway"""
+    """Health check endpoint for Railway (per-domain upstream detail needs a session token)"""
+    token = request.headers.get('Authorization', '').replace('Bearer ', '')
+    
     return jsonify({
         'status': 'healthy',
         'timestamp': datetime.now().isoformat(),
-        'version': '2.1.0'
+        'version': '2.1.0',
+        'storage': STORAGE_BACKEND,
+        'key_cache': key_cache_stats(),
+        'upstream_pool': upstream_pool.stats(),
+        'site_health': site_health.stats(),
+        'upstream_domains': site_health.domains() if token and validate_session(token) else None,
+        'upstream_single_flight': upstream_flights.stats(),
+        'stats_cache': stats_cache.stats(),
+        'stats_poller': stats_poller.stats(),
+        'save_coalescer': save_coalescer.stats(),
+        'data_cache': data_cache_stats(),
+        'lockouts': lockout_tracker.stats(),
+        'logging': log.stats(),
+        'startup': startup.stats(),
+        'json_backend': json_backend.backend(),
+        'compression': response_compressor.stats() if RESPONSE_COMPRESSION else None,
+        'backups': snapshot_store.stats()
     }), 200
 
 
+@app.route('/ready')
+def readiness_check():
+    """Readiness probe: 503 until startup and warm-up have finished"""
+    stats = startup.stats()
+    response = jsonify({'status': 'ready' if stats['ready'] else 'starting', **stats})
+    response.headers['Cache-Control'] = 'no-store'
+    return response, 200 if stats['ready'] else 503
 
 
-@app.route('/api/proxy-stats', methods=['POST'])
-def proxy_stats():
-    """Proxy endpoint to fetch stats from external websites (bypass CORS)"""
+@app.route('/api/admin/profiles', methods=['GET', 'DELETE'])
+def profiles():
+    """Profiling summary, or ?format=collapsed|pstats[&route=GET /api/data] to download"""
     token = request.headers.get('Authorization', '').replace('Bearer ', '')
     
-    if not validate_session(token):
+    allowed = has_profile_token(token) if PROFILE_TOKEN else validate_session(token)
+    if not token or not allowed:
         return jsonify({'error': 'Invalid or expired session'}), 401
     
-    data = request.json
-    domain = data.get('domain')
-    api_key = data.get('apiKey')
+    if request.method == 'DELETE':
+        request_profiler.reset()
+        return jsonify({'success': True})
     
-    if not domain or not api_key:
-        return jsonify({'error': 'Missing domain or apiKey'}), 400
+    route = request.args.get('route')
+    output_format = request.args.get('format')
+    if not output_format:
+        return jsonify(request_profiler.summary())
+    
+    if output_format == 'collapsed':
+        response = Response(request_profiler.collapsed(route), mimetype='text/plain')
+        filename = 'profile.collapsed'
+    elif output_format == 'pstats':
+        dump = request_profiler.pstats_dump(route)
+        if dump is None:
+            return jsonify({'error': 'No cProfile data (set PROFILE_MODE=cprofile)'}), 404
+        response = Response(dump, mimetype='application/octet-stream')
+        filename = 'profile.pstats'
+    else:
+        return jsonify({'error': 'format must be collapsed or pstats'}), 400
+    
+    response.headers['Content-Disposition'] = f'attachment; filename={filename}'
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+
+def has_backup_access(token: str) -> bool:
+    if BACKUP_TOKEN:
+        return secrets.compare_digest(token.encode(), BACKUP_TOKEN.encode())
+    return validate_session(token)
+
+
+@app.route('/api/admin/backups', methods=['GET', 'POST'])
+def backups():
+    """List snapshots, or take one now (POST)"""
+    token = request.headers.get('Authorization', '').replace('Bearer ', '')
+    if not token or not has_backup_access(token):
+        return jsonify({'error': 'Invalid or expired session'}), 401
+    
+    if request.method == 'GET':
+        return jsonify({'snapshots': snapshot_store.list(), 'stats': snapshot_store.stats()})
     
     try:
-        # Fetch stats from external website
-        response = requests.get(
+        summary = take_snapshot(label=(request.json or {}).get('label') if request.is_json else None)
+    except Exception as e:
+        log.error('backup.failed', route='POST /api/admin/backups', error=str(e))
+        return jsonify({'error': 'Snapshot failed'}), 500
+    
+    log.info('backup.created', route='POST /api/admin/backups', snapshot=summary['id'],
+             files_read=summary['files_read'], bytes_written=summary['bytes_written'])
+    return jsonify(summary), 201
+
+
+@app.route('/api/admin/backups/diff')
+def backup_diff():
+    """Files added, removed and modified between ?from=<ref>&to=<ref> (default to=latest)"""
+    token = request.headers.get('Authorization', '').replace('Bearer ', '')
+    if not token or not has_backup_access(token):
+        return jsonify({'error': 'Invalid or expired session'}), 401
+    
+    if not request.args.get('from'):
+        return jsonify({'error': 'Missing from'}), 400
+    try:
+        return jsonify(snapshot_store.diff(request.args['from'], request.args.get('to', 'latest')))
+    except KeyError as e:
+        return jsonify({'error': e.args[0]}), 404
+
+
+# Every worker publishes its metrics so whichever one is scraped reports all of them
+metrics_share = None
+if storage_db is not None:
+    metrics_share = SQLiteMetricsShare(storage_db, SERVER_GENERATION, interval=METRICS_SHARE_INTERVAL)
+    metrics_share.start(on_error=lambda e: log.warning('metrics.share_failed', error=str(e)))
+    atexit.register(metrics_share.publish)
+
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus text-format metrics (METRICS_TOKEN or a session token)"""
+    token = request.headers.get('Authorization', '').replace('Bearer ', '')
+    
+    allowed = secrets.compare_digest(token.encode(), METRICS_TOKEN.encode()) if METRICS_TOKEN else validate_session(token)
+    if not token or not allowed:
+        return jsonify({'error': 'Invalid or expired session'}), 401
+    
+    others = metrics_share.others() if metrics_share is not None else ()
+    response = Response(metrics.render(others), mimetype='text/plain; version=0.0.4')
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+
+# Identical concurrent upstream fetches (cache misses, poller, tabs) share one call
+upstream_flights = SingleFlight()
+
+
+def fetch_site_stats(domain: str, api_key: str) -> dict:
+    """Fetch stats from an external website (never raises)"""
+    return upstream_flights.do((domain, fingerprint(api_key)), fetch_site_stats_uncoalesced, domain, api_key)
+
+
+def fetch_site_stats_uncoalesced(domain: str, api_key: str) -> dict:
+    """One upstream /api/v1/stats call, through the circuit breaker (never raises)"""
+    allowed, timeout, retry_in = site_health.acquire(domain)
+    if not allowed:
+        # Circuit open: fail fast instead of tying up a thread on a dead site
+        UPSTREAM_ERRORS.inc(reason='circuit_open')
+        return {
+            'error': site_health.last_error(domain) or 'Site unavailable',
+            'isOnline': False,
+            'circuitOpen': True,
+            'retryIn': round(retry_in, 1)
+        }
+    
+    import requests  # Deferred with the rest of the HTTP client stack (see upstream_pool)
+    
+    started = time.perf_counter()
+    failure = None
+    try:
+        response = upstream_pool.get(
             f"{domain}/api/v1/stats",
             headers={
                 'Authorization': f'Bearer {api_key}',
                 'Content-Type': 'application/json'
             },
-            timeout=10
+            timeout=(min(UPSTREAM_CONNECT_TIMEOUT, timeout), timeout)
         )
         
         if not response.ok:
-            return jsonify({
-                'error': f'HTTP {response.status_code}: {response.reason}',
-                'isOnline': False
-            }), 200
+            UPSTREAM_ERRORS.inc(reason=f'http_{response.status_code}')
+            error = f'HTTP {response.status_code}: {response.reason}'
+            if response.status_code >= 500:
+                failure = error
+            return {'error': error, 'isOnline': False}
         
-        return jsonify({
-            'data': response.json(),
+        return {
+            'data': json_backend.loads(response.content),
             'isOnline': True
-        })
+        }
     
     except requests.exceptions.Timeout:
-        return jsonify({'error': 'Request timeout', 'isOnline': False}), 200
+        UPSTREAM_ERRORS.inc(reason='timeout')
+        failure = 'Request timeout'
+        return {'error': failure, 'isOnline': False}
     except requests.exceptions.ConnectionError:
-        return jsonify({'error': 'Connection failed', 'isOnline': False}), 200
+        UPSTREAM_ERRORS.inc(reason='connection')
+        failure = 'Connection failed'
+        return {'error': failure, 'isOnline': False}
     except Exception as e:
-        return jsonify({'error': str(e), 'isOnline': False}), 200
+        # Anything else (a malformed body, a TLS or proxy error) is still a broken call,
+        # so it must count against the breaker rather than close it
+        UPSTREAM_ERRORS.inc(reason='other')
+        failure = str(e) or type(e).__name__
+        return {'error': failure, 'isOnline': False}
+    finally:
+        elapsed = time.perf_counter() - started
+        UPSTREAM_SECONDS.observe(elapsed)
+        if failure:
+            site_health.record_failure(domain, failure)
+        else:
+            site_health.record_success(domain, elapsed)
+
+
+# Upstream results shared by every client (and every worker with sqlite), refreshed on TTL
+stats_cache_options = dict(
+    ttl=STATS_CACHE_TTL,
+    stale_ttl=STATS_CACHE_STALE_TTL,
+    negative_ttl=STATS_CACHE_NEGATIVE_TTL,
+    max_entries=STATS_CACHE_MAX_ENTRIES
+)
+if storage_db is not None:
+    stats_cache = SQLiteStatsCache(
+        storage_db, fetch_site_stats, _stats_executor, fetch_timeout=PROXY_STATS_TIMEOUT, **stats_cache_options
+    )
+else:
+    stats_cache = StatsCache(fetch_site_stats, _stats_executor, **stats_cache_options)
+
+# Per-site metric history, sampled by the background poller
+stats_history = TimeSeriesStore(
+    HISTORY_DIR,
+    raw_points=HISTORY_RAW_POINTS,
+    retention=HISTORY_RETENTION
+)
+
+
+def record_polled_stats(domain: str, api_key: str, result: dict):
+    """Store a polled result in the shared cache and the history"""
+    stats_cache.put(domain, api_key, result)
+    try:
+        stats_history.record(domain, api_key, result)
+    except OSError as e:
+        log.warning('history.record_failed', domain=domain, error=str(e))
+
+
+# Polls every registered site once per interval and feeds the shared cache; with
+# several workers, the cache decides which worker polls a site and the rest follow
+stats_poller = StatsPoller(
+    fetch_site_stats,
+    _stats_executor,
+    on_result=record_polled_stats,
+    interval=STATS_POLL_INTERVAL,
+    jitter=STATS_POLL_JITTER,
+    on_error=lambda domain, e: log.error('poller.poll_failed', domain=domain, error=str(e)),
+    shared=stats_cache
+)
+stats_poller.start()
+
+# Expired sessions get the same cleanup as a logout. Wired only now, once the poller exists;
+# the sweep in session_store.load() ran before anything was cached.
+session_store.on_expire = end_user_session
+
+
+@app.route('/api/proxy-stats', methods=['POST'])
+def proxy_stats():
+    """Proxy endpoint to fetch stats from external websites (bypass CORS)"""
+    token = request.headers.get('Authorization', '').replace('Bearer ', '')
+    
+    if not validate_session(token):
+        return jsonify({'error': 'Invalid or expired session'}), 401
+    
+    data = request.json
+    domain = data.get('domain')
+    api_key = data.get('apiKey')
+    
+    if not domain or not api_key:
+        return jsonify({'error': 'Missing domain or apiKey'}), 400
+    
+    return jsonify(stats_cache.get(domain, api_key)), 200
+
+
+@app.route('/api/proxy-stats/batch', methods=['POST'])
+def proxy_stats_batch():
+    """Fetch stats for many websites concurrently, streamed back as NDJSON"""
+    token = request.headers.get('Authorization', '').replace('Bearer ', '')
+    
+    if not validate_session(token):
+        return jsonify({'error': 'Invalid or expired session'}), 401
+    
+    sites = (request.json or {}).get('sites')
+    
+    if not isinstance(sites, list):
+        return jsonify({'error': 'Missing sites list'}), 400
+    if len(sites) > PROXY_STATS_MAX_BATCH:
+        return jsonify({'error': f'Too many sites (max {PROXY_STATS_MAX_BATCH})'}), 400
+    
+    def generate():
+        # One line per site, in completion order; "index" maps back to the request
+        futures = {}
+        try:
+            for index, site in enumerate(sites):
+                site = site if isinstance(site, dict) else {}
+                domain = site.get('domain')
+                api_key = site.get('apiKey')
+                
+                if not domain or not api_key:
+                    yield json_backend.dumps({
+                        'index': index,
+                        'domain': domain,
+                        'error': 'Missing domain or apiKey',
+                        'isOnline': False
+                    }) + b'\n'
+                    continue
+                
+                future = _stats_executor.submit(stats_cache.get, domain, api_key)
+                futures[future] = (index, domain)
+            
+            for future in as_completed(futures):
+                index, domain = futures[future]
+                result = future.result()
+                result.update({'index': index, 'domain': domain})
+                yield json_backend.dumps(result) + b'\n'
+        finally:
+            # Client went away: don't spend upstream calls on nobody
+            for future in futures:
+                future.cancel()
+    
+    response = Response(generate(), mimetype='application/x-ndjson')
+    response.headers['Cache-Control'] = 'no-store'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@app.route('/api/history', methods=['POST'])
+def stats_history_query():
+    """Downsampled metric history for one or more websites"""
+    token = request.headers.get('Authorization', '').replace('Bearer ', '')
+    
+    if not validate_session(token):
+        return jsonify({'error': 'Invalid or expired session'}), 401
+    
+    data = request.json or {}
+    sites = data.get('sites')
+    metrics = data.get('metrics') or list(METRICS)
+    resolution = data.get('resolution')
+    
+    if not isinstance(sites, list) or not sites:
+        return jsonify({'error': 'Missing sites list'}), 400
+    if len(sites) > PROXY_STATS_MAX_BATCH:
+        return jsonify({'error': f'Too many sites (max {PROXY_STATS_MAX_BATCH})'}), 400
+    if any(metric not in METRICS for metric in metrics):
+        return jsonify({'error': f'Unknown metric (expected one of {", ".join(METRICS)})'}), 400
+    if resolution and resolution not in dict(RESOLUTIONS):
+        return jsonify({'error': 'Unknown resolution'}), 400
+    
+    try:
+        end = float(data.get('end') or time.time())
+        start = float(data.get('start') or end - 7 * 86400)
+        max_points = min(int(data.get('points') or 500), HISTORY_MAX_POINTS)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Invalid start, end or points'}), 400
+    
+    series = []
+    for site in sites:
+        site = site if isinstance(site, dict) else {}
+        domain = site.get('domain')
+        api_key = site.get('apiKey')
+        if not domain or not api_key:
+            continue
+        for metric in metrics:
+            result = stats_history.query(domain, api_key, metric, start, end, max_points, resolution)
+            result.update({'domain': domain, 'metric': metric})
+            series.append(result)
+    
+    return jsonify({'start': start, 'end': end, 'series': series})
+
+
+def parse_query_time(value):
+    """Parse an ISO timestamp query parameter as naive local time (None if absent)"""
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone().replace(tzinfo=None)
+    return parsed
+
+
+@app.route('/api/login-attempts')
+def login_attempts():
+    """Query the login audit log by IP, status and time range (newest first)"""
+    token = request.headers.get('Authorization', '').replace('Bearer ', '')
+    
+    if not validate_session(token):
+        return jsonify({'error': 'Invalid or expired session'}), 401
+    
+    status = request.args.get('status')
+    if status and status.upper() not in ('SUCCESS', 'FAILED'):
+        return jsonify({'error': 'status must be SUCCESS or FAILED'}), 400
+    
+    try:
+        start = parse_query_time(request.args.get('start'))
+        end = parse_query_time(request.args.get('end'))
+        limit = int(request.args.get('limit', 100))
+    except ValueError:
+        return jsonify({'error': 'Invalid start, end or limit'}), 400
+    if limit < 1:
+        return jsonify({'error': f'limit must be between 1 and {AUDIT_QUERY_MAX_LIMIT}'}), 400
+    limit = min(limit, AUDIT_QUERY_MAX_LIMIT)
+    
+    attempts, scanned, skipped = audit_log.query(
+        ip=request.args.get('ip'),
+        status=status.upper() if status else None,
+        start=start,
+        end=end,
+        limit=limit
+    )
+    
+    return jsonify({
+        'attempts': attempts,
+        'segments_scanned': scanned,
+        'segments_skipped': skipped
+    })
+
+
+@app.route('/api/stats/stream-ticket', methods=['POST'])
+def stats_stream_ticket():
+    """Issue a short-lived, single-use ticket for opening /api/stats/stream"""
+    token = request.headers.get('Authorization', '').replace('Bearer ', '')
+    
+    if not validate_session(token):
+        return jsonify({'error': 'Invalid or expired session'}), 401
+    
+    return jsonify({'ticket': session_store.issue_ticket(token, SSE_TICKET_TTL), 'expiresIn': SSE_TICKET_TTL})
+
+
+@app.route('/api/stats/stream')
+def stats_stream():
+    """Server-Sent Events stream of stats changes for the user's websites"""
+    # EventSource can't set headers, so it authenticates with a ?ticket= from /api/stats/stream-ticket;
+    # the session token itself never goes in the URL, where access logs and proxies would keep it
+    token = request.headers.get('Authorization', '').replace('Bearer ', '')
+    if not token and request.args.get('ticket'):
+        token = session_store.redeem_ticket(request.args['ticket']) or ''
+    
+    username = get_session_username(token)
+    if not username:
+        return jsonify({'error': 'Invalid or expired session'}), 401
+    
+    # With several workers this one may not have seen the user's websites yet
+    if not stats_poller.has_user(username):
+        save_coalescer.flush(username)
+        if get_user_store(username).exists():
+            stats_poller.set_sites(username, load_user_data(username)[1])
+    
+    # Browsers resend the last id they saw when reconnecting
+    try:
+        last_seq = int(request.headers.get('Last-Event-ID') or request.args.get('lastEventId') or 0)
+    except ValueError:
+        last_seq = 0
+    
+    def generate():
+        cursor = last_seq
+        deadline = time.monotonic() + SSE_MAX_STREAM_SECONDS
+        yield 'retry: 5000\n\n'
+        
+        while time.monotonic() < deadline:
+            events, cursor = stats_poller.changes_since(username, cursor)
+            for seq, payload in events:
+                yield f"id: {seq}\nevent: stats\ndata: {json_backend.dumps(payload).decode()}\n\n"
+            
+            if not stats_poller.wait_for_change(cursor, timeout=SSE_HEARTBEAT_INTERVAL):
+                if not validate_session(token):
+                    break
+                yield ': keep-alive\n\n'
+    
+    response = Response(generate(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-store'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def warm_state():
+    """Run the session and lockout lookups every login makes (SQLite page cache, statement paths)"""
+    session_store.get_username(secrets.token_urlsafe(32))
+    lockout_tracker.stats()
+
+
+def warm_user_data():
+    """Derive the configured user's key and decrypt their websites into the data cache"""
+    username = f"{DEFAULT_PASSWORD}:{DEFAULT_OTP}"
+    if get_user_store(username).exists():
+        load_user_data(username)  # Also registers the sites with the poller
+
+
+def warm_upstream():
+    """Build the HTTP client stack and pre-connect to WARMUP_ORIGINS and the user's sites"""
+    with _data_cache_lock:
+        cached = _data_cache.get(f"{DEFAULT_PASSWORD}:{DEFAULT_OTP}")
+    domains = [w['domain'] for w in (cached[2] if cached else []) if isinstance(w, dict) and w.get('domain')]
+    upstream_pool.warm(WARMUP_ORIGINS + domains, timeout=UPSTREAM_CONNECT_TIMEOUT, executor=_stats_executor)
+
+
+# Incremental snapshots of DATA_DIR
+snapshot_store = SnapshotStore(BACKUP_DIR)
+
+
+def snapshot_lock(directory):
+    """Record store directories are read under their write lock, so a snapshot never splits a save"""
+    return lock_for(directory) if directory.endswith('.d') else nullcontext()
+
+
+def flush_for_snapshot():
+    """Get buffered writes onto disk so the snapshot includes them"""
+    save_coalescer.flush_all()
+    audit_log.flush()
+    lockout_tracker.snapshot()
+
+
+def take_snapshot(label=None) -> dict:
+    flush_for_snapshot()
+    return snapshot_store.create(DATA_DIR, lock_for=snapshot_lock, label=label)
+
+
+if BACKUP_INTERVAL > 0:
+    snapshot_store.start_schedule(
+        DATA_DIR,
+        BACKUP_INTERVAL,
+        keep_last=BACKUP_KEEP_LAST,
+        keep_daily=BACKUP_KEEP_DAILY,
+        lock_for=snapshot_lock,
+        before=flush_for_snapshot,
+        on_error=lambda e: log.error('backup.failed', error=str(e))
+    )
+
+
+# Work that only makes the first requests faster; /ready reports 503 until it is done
+startup.add_task('crypto', container.preload)
+startup.add_task('state', warm_state)
+startup.add_task('user_data', warm_user_data)
+startup.add_task('upstream', warm_upstream)
+if STATIC_PIPELINE:
+    startup.add_task('static_assets', asset_bundle.ensure_built)
+startup.record('startup', time.perf_counter() - _started)
+
+if STARTUP_WARMUP:
+    startup.warm_up(
+        on_error=lambda name, e: log.warning('startup.warmup_failed', task=name, error=str(e)),
+        on_ready=lambda stats: log.info('startup.ready', **stats)
+    )
+else:
+    startup.mark_ready()  # Everything above happens lazily on first use instead
+    log.info('startup.ready', **startup.stats())
 
 
 if __name__ == '__main__':
@@ -462,6 +1387,9 @@ if __name__ == '__main__':
     
     print("=" * 60)
     
+    # Let SIGTERM (Railway stop/redeploy) run atexit hooks so pending saves are flushed
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    
     # Run with security settings
     port = int(os.getenv('PORT', 5001))
     host = '0.0.0.0' if os.getenv('RAILWAY_ENVIRONMENT') else '127.0.0.1'
@@ -0,0 +1,239 @@
+"""
+Session Store
+Keeps sessions in memory and persists changes to an append-only journal.
+
+The snapshot file (sessions.json) keeps the original {token: session} layout.
+Every login/logout appends one JSON line to the journal instead of rewriting
+the snapshot; the journal is folded back into the snapshot once it grows past
+a threshold or when the background sweeper removes expired sessions.
+
+Stream tickets (short-lived, single-use stand-ins for a session token, for
+clients such as EventSource that can only authenticate through the URL) are
+kept in memory only: they expire within seconds, so a restart losing them
+just makes the client ask for a new one.
+"""
+
+import json
+import os
+import secrets
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+
+class SessionStore:
+    """In-process session dict backed by a snapshot file plus a journal"""
+
+    def __init__(self, snapshot_file, journal_file, compact_threshold=1000,
+                 sweep_interval=300, on_expire=None):
+        self.snapshot_file = snapshot_file
+        self.journal_file = journal_file
+        self.compact_threshold = compact_threshold
+        self.sweep_interval = sweep_interval
+        self.on_expire = on_expire
+
+        self._sessions = {}
+        self._expires = {}  # token -> expiry as a unix timestamp
+        self._per_user = Counter()  # username -> stored sessions
+        self._tickets = {}  # ticket -> (session token, expiry as a unix timestamp)
+        self._lock = threading.RLock()
+        self._journal = None
+        self._journal_entries = 0
+        self._sweeper = None
+
+    def __len__(self):
+        return len(self._sessions)
+
+    # ------------------------------------------------------------------
+    # Persistence
+    # ------------------------------------------------------------------
+
+    def load(self):
+        """Load the snapshot and replay the journal on top of it"""
+        with self._lock:
+            self._sessions = {}
+            self._expires = {}
+            self._per_user = Counter()
+
+            if os.path.exists(self.snapshot_file):
+                try:
+                    with open(self.snapshot_file, 'r') as f:
+                        for token, session in json.load(f).items():
+                            self._put(token, session)
+                except (ValueError, OSError):
+                    pass
+
+            self._journal_entries = 0
+            if os.path.exists(self.journal_file):
+                with open(self.journal_file, 'r') as f:
+                    for line in f:
+                        try:
+                            entry = json.loads(line)
+                        except ValueError:
+                            continue  # Torn write from a crash; skip it
+                        self._apply(entry)
+                        self._journal_entries += 1
+
+            self.sweep(compact=False)
+            self.compact()
+
+    def compact(self):
+        """Write the live sessions to the snapshot and truncate the journal"""
+        with self._lock:
+            tmp_file = self.snapshot_file + '.tmp'
+            with open(tmp_file, 'w') as f:
+                json.dump(self._sessions, f)
+            os.replace(tmp_file, self.snapshot_file)
+
+            if self._journal:
+                self._journal.close()
+            self._journal = open(self.journal_file, 'w')
+            self._journal_entries = 0
+
+    def close(self):
+        """Compact and release the journal handle"""
+        with self._lock:
+            self.compact()
+            self._journal.close()
+            self._journal = None
+
+    def _append(self, entry):
+        if self._journal is None:
+            self._journal = open(self.journal_file, 'a')
+        self._journal.write(json.dumps(entry) + '\n')
+        self._journal.flush()
+        self._journal_entries += 1
+
+        if self._journal_entries >= self.compact_threshold:
+            self.compact()
+
+    def _apply(self, entry):
+        if entry.get('op') == 'set':
+            self._put(entry['token'], entry['session'])
+        elif entry.get('op') == 'del':
+            self._pop(entry['token'])
+
+    def _put(self, token, session):
+        self._pop(token)
+        self._sessions[token] = session
+        self._expires[token] = datetime.fromisoformat(session['expires']).timestamp()
+        self._per_user[session['username']] += 1
+
+    def _pop(self, token):
+        self._expires.pop(token, None)
+        session = self._sessions.pop(token, None)
+        if session is not None:
+            self._per_user[session['username']] -= 1
+            if not self._per_user[session['username']]:
+                del self._per_user[session['username']]
+        return session
+
+    # ------------------------------------------------------------------
+    # Session operations
+    # ------------------------------------------------------------------
+
+    def create(self, token, username, duration):
+        """Create a session valid for `duration` seconds"""
+        now = datetime.now()
+        session = {
+            'username': username,
+            'created': now.isoformat(),
+            'expires': (now + timedelta(seconds=duration)).isoformat()
+        }
+        with self._lock:
+            self._put(token, session)
+            self._append({'op': 'set', 'token': token, 'session': session})
+        return session
+
+    def get_username(self, token):
+        """Return the session's username, or None if missing or expired"""
+        expires = self._expires.get(token)
+        if expires is None:
+            return None
+
+        if time.time() > expires:
+            self._expire(token)
+            return None
+
+        session = self._sessions.get(token)
+        return session['username'] if session else None
+
+    def get(self, token):
+        """Return a copy of the session dict, or None"""
+        session = self._sessions.get(token)
+        return dict(session) if session else None
+
+    def has_sessions(self, username):
+        """Whether any session of this user is still stored (expired ones until they are removed)"""
+        with self._lock:
+            return self._per_user[username] > 0
+
+    def items(self):
+        """(token, session copy) pairs for every stored session"""
+        with self._lock:
+            return [(token, dict(session)) for token, session in self._sessions.items()]
+
+    def delete(self, token):
+        """Remove a session; returns the removed session or None"""
+        with self._lock:
+            session = self._pop(token)
+            if session is not None:
+                self._append({'op': 'del', 'token': token})
+        return session
+
+    def issue_ticket(self, token, ttl):
+        """A single-use ticket that redeems to `token` within `ttl` seconds"""
+        ticket = secrets.token_urlsafe(32)
+        with self._lock:
+            self._tickets[ticket] = (token, time.time() + ttl)
+        return ticket
+
+    def redeem_ticket(self, ticket):
+        """The session token a ticket was issued for, or None; a ticket works once"""
+        with self._lock:
+            token, expires = self._tickets.pop(ticket, (None, 0))
+        return token if time.time() <= expires else None
+
+    def _expire(self, token):
+        with self._lock:
+            session = self._pop(token)
+            if session is None:
+                return
+            self._append({'op': 'del', 'token': token})
+        if self.on_expire:
+            self.on_expire(token, session)
+
+    def sweep(self, compact=True):
+        """Remove all expired sessions; returns how many were removed"""
+        now = time.time()
+        expired = []
+        with self._lock:
+            for token in [t for t, exp in self._expires.items() if now > exp]:
+                expired.append((token, self._pop(token)))
+            for ticket in [t for t, (_, exp) in self._tickets.items() if now > exp]:
+                del self._tickets[ticket]
+            if expired and compact:
+                self.compact()
+
+        if self.on_expire:
+            for token, session in expired:
+                self.on_expire(token, session)
+        return len(expired)
+
+    def start_sweeper(self, on_error=None):
+        """Start the background thread that purges expired sessions (failures go to on_error(e))"""
+        if self._sweeper is not None:
+            return
+
+        def run():
+            while True:
+                time.sleep(self.sweep_interval)
+                try:
+                    self.sweep()
+                except Exception as e:
+                    if on_error is not None:
+                        on_error(e)
+
+        self._sweeper = threading.Thread(target=run, name='session-sweeper', daemon=True)
+        self._sweeper.start()
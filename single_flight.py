@@ -0,0 +1,68 @@
+"""
+Single Flight
+Collapses identical concurrent calls into one execution.
+
+The first caller for a key runs the function; callers that arrive with the
+same key while it is running wait for it and receive the same result (or
+exception) instead of making their own call. Nothing is cached: once the
+call finishes the next caller starts a new one. Results are shared between
+callers, so treat them as read-only.
+"""
+
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Per-key deduplication of in-flight calls"""
+
+    def __init__(self):
+        self._calls = {}  # key -> _Call
+        self._lock = threading.Lock()
+        self._stats = {'calls': 0, 'executed': 0, 'shared': 0}
+
+    def do(self, key, fn, *args, **kwargs):
+        """Run fn(*args, **kwargs), or join an identical call already running"""
+        with self._lock:
+            self._stats['calls'] += 1
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                self._stats['shared'] += 1
+                leader = False
+            else:
+                call = self._calls[key] = _Call()
+                self._stats['executed'] += 1
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def stats(self) -> dict:
+        """Calls made, executed and shared (the upstream calls saved)"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['in_flight'] = len(self._calls)
+        stats['saved_ratio'] = round(stats['shared'] / stats['calls'], 4) if stats['calls'] else 0.0
+        return stats
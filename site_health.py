@@ -0,0 +1,182 @@
+"""
+Site Health
+Per-domain adaptive timeouts and circuit breaking for upstream stats calls.
+
+Every upstream domain keeps its recent successful latencies. Its timeout is
+`multiplier` x the p95 of those latencies, clamped to [min_timeout,
+max_timeout] (max_timeout until enough samples exist), so one slow site does
+not set the pace for fast ones.
+
+The circuit breaker counts consecutive failures (timeouts, connection errors
+and 5xx responses; a 4xx means the site is up). After `failure_threshold` of
+them the circuit opens and calls fail immediately for `cooldown` seconds.
+Then a single half-open probe is let through: success closes the circuit,
+failure re-opens it with the cooldown doubled (up to `max_cooldown`).
+
+The state transitions (_acquire, _succeeded, _failed) work on one domain's
+state object, so the SQLite backend can keep breaker state in the database
+and share it between server processes (see sqlite_storage.py).
+"""
+
+import threading
+import time
+from collections import OrderedDict, deque
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class DomainState:
+    """Latency samples and breaker state of one domain"""
+
+    def __init__(self, window):
+        self.latencies = deque(maxlen=window)
+        self.timeout = None  # adaptive timeout once enough samples exist
+        self.state = CLOSED
+        self.failures = 0  # consecutive
+        self.opened_at = 0.0
+        self.cooldown = 0.0
+        self.probing = False
+        self.last_error = None
+
+
+class SiteHealth:
+    """Latency tracking, adaptive timeouts and circuit breakers per domain"""
+
+    def __init__(self, min_timeout=1.0, max_timeout=10.0, multiplier=3.0, min_samples=5,
+                 window=50, failure_threshold=3, cooldown=30.0, max_cooldown=300.0,
+                 max_domains=1024):
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.multiplier = multiplier
+        self.min_samples = min_samples
+        self.window = window
+        self.failure_threshold = failure_threshold
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.max_domains = max_domains
+
+        self._domains = OrderedDict()  # domain -> DomainState, least recently used first
+        self._lock = threading.Lock()
+        self._stats = {'rejected': 0, 'probes': 0, 'opened': 0, 'recovered': 0}
+
+    def _get(self, domain):
+        state = self._domains.get(domain)
+        if state is None:
+            state = self._domains[domain] = DomainState(self.window)
+            while len(self._domains) > self.max_domains:
+                self._domains.popitem(last=False)
+        self._domains.move_to_end(domain)
+        return state
+
+    # ------------------------------------------------------------------
+    # State transitions (callers hold self._lock)
+    # ------------------------------------------------------------------
+
+    def _acquire(self, state, now):
+        timeout = state.timeout or self.max_timeout
+
+        if state.state == CLOSED:
+            return True, timeout, None
+
+        retry_in = state.opened_at + state.cooldown - now
+        if state.state == OPEN and retry_in <= 0:
+            state.state = HALF_OPEN
+        if state.state == HALF_OPEN and not state.probing:
+            # One probe at a time; it gets the full timeout to show recovery
+            state.probing = True
+            self._stats['probes'] += 1
+            return True, self.max_timeout, None
+
+        self._stats['rejected'] += 1
+        return False, timeout, max(retry_in, 0.0)
+
+    def _add_latency(self, state, latency):
+        state.latencies.append(latency)
+        if len(state.latencies) >= self.min_samples:
+            ordered = sorted(state.latencies)
+            p95 = ordered[min(int(len(ordered) * 0.95), len(ordered) - 1)]
+            state.timeout = min(max(p95 * self.multiplier, self.min_timeout), self.max_timeout)
+
+    def _succeeded(self, state):
+        if state.state != CLOSED:
+            self._stats['recovered'] += 1
+        state.state = CLOSED
+        state.failures = 0
+        state.cooldown = 0.0
+        state.probing = False
+
+    def _failed(self, state, error, now):
+        state.failures += 1
+        state.last_error = error
+
+        if state.state == HALF_OPEN:
+            state.cooldown = min(state.cooldown * 2 or self.base_cooldown, self.max_cooldown)
+        elif state.state == CLOSED and state.failures >= self.failure_threshold:
+            state.cooldown = self.base_cooldown
+        else:
+            return
+
+        state.state = OPEN
+        state.opened_at = now
+        state.probing = False
+        self._stats['opened'] += 1
+
+    # ------------------------------------------------------------------
+    # Public API
+    # ------------------------------------------------------------------
+
+    def acquire(self, domain):
+        """Before a call: (allowed, timeout, seconds until retry when rejected)"""
+        now = time.monotonic()
+        with self._lock:
+            return self._acquire(self._get(domain), now)
+
+    def record_success(self, domain, latency):
+        """After a call that reached a working site"""
+        with self._lock:
+            state = self._get(domain)
+            self._add_latency(state, latency)
+            self._succeeded(state)
+
+    def record_failure(self, domain, error):
+        """After a timeout, connection error, 5xx or unexpected error"""
+        now = time.monotonic()
+        with self._lock:
+            self._failed(self._get(domain), error, now)
+
+    def last_error(self, domain):
+        with self._lock:
+            state = self._domains.get(domain)
+            return state.last_error if state else None
+
+    def _detail(self, state) -> dict:
+        ordered = sorted(state.latencies)
+
+        def percentile(p):
+            return round(ordered[min(int(len(ordered) * p), len(ordered) - 1)], 3) if ordered else None
+
+        return {
+            'state': state.state,
+            'failures': state.failures,
+            'last_error': state.last_error,
+            'timeout': round(state.timeout or self.max_timeout, 3),
+            'samples': len(ordered),
+            'p50': percentile(0.5),
+            'p95': percentile(0.95)
+        }
+
+    def domains(self) -> dict:
+        """Per-domain breaker state, last error, timeout and recent latency"""
+        with self._lock:
+            return {domain: self._detail(state) for domain, state in self._domains.items()}
+
+    def stats(self) -> dict:
+        """Breaker counters plus domains per state"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['domains'] = len(self._domains)
+            for name in (CLOSED, OPEN, HALF_OPEN):
+                stats[name] = sum(1 for state in self._domains.values() if state.state == name)
+        return stats
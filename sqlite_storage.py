@@ -0,0 +1,763 @@
+"""
+SQLite Storage
+Sessions, lockouts and encrypted records in one SQLite database (WAL mode).
+
+The file-backed stores keep their state in process memory and rewrite JSON
+files, which is only safe with a single server process. These classes have
+the same methods but keep every piece of state in the database, so several
+gunicorn workers can share DATA_DIR: writes run in BEGIN IMMEDIATE
+transactions (one writer at a time, across processes) and WAL lets readers
+proceed while a write is in progress.
+
+On first use each store imports whatever the file backend left behind
+(sessions.json + journal, lockouts.json, <hash>.d record directories), once.
+
+State that only makes upstream calls cheaper is shared too, so adding
+workers does not multiply upstream traffic: cached stats results together
+with a claim on who fetches each site next (SQLiteStatsCache, also used by
+the poller), circuit breakers (SQLiteSiteHealth) and each worker's metrics,
+which any worker adds up when scraped (SQLiteMetricsShare).
+"""
+
+import hashlib
+import json
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import metrics
+from metrics import timed
+from record_store import RecordStore
+from site_health import SiteHealth, CLOSED, OPEN, HALF_OPEN, DomainState
+from stats_cache import StatsCache, fingerprint
+
+PRUNE_EVERY = 100  # stats cache writes between removals of expired entries
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS sessions (
+    token TEXT PRIMARY KEY,
+    username TEXT NOT NULL,
+    created TEXT NOT NULL,
+    expires TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sessions_expires_at ON sessions (expires_at);
+CREATE INDEX IF NOT EXISTS sessions_username ON sessions (username);
+CREATE TABLE IF NOT EXISTS stream_tickets (
+    ticket TEXT PRIMARY KEY,
+    token TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS login_failures (
+    ip TEXT NOT NULL,
+    failed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS login_failures_ip ON login_failures (ip, failed_at);
+CREATE TABLE IF NOT EXISTS lockouts (
+    ip TEXT PRIMARY KEY,
+    locked_until REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS record_indexes (
+    owner TEXT PRIMARY KEY,
+    body TEXT NOT NULL,
+    version INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS records (
+    owner TEXT NOT NULL,
+    file TEXT NOT NULL,
+    token BLOB NOT NULL,
+    PRIMARY KEY (owner, file)
+);
+CREATE TABLE IF NOT EXISTS upstream_stats (
+    domain TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    result TEXT,
+    fetched_at REAL NOT NULL DEFAULT 0,
+    fetching_until REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (domain, fingerprint)
+);
+CREATE TABLE IF NOT EXISTS site_breakers (
+    domain TEXT PRIMARY KEY,
+    state TEXT NOT NULL,
+    failures INTEGER NOT NULL,
+    opened_at REAL NOT NULL,
+    cooldown REAL NOT NULL,
+    probe_until REAL NOT NULL,
+    last_error TEXT
+);
+CREATE TABLE IF NOT EXISTS metric_snapshots (
+    worker TEXT PRIMARY KEY,
+    generation TEXT NOT NULL,
+    updated REAL NOT NULL,
+    body TEXT NOT NULL
+);
+"""
+
+
+class SQLiteDatabase:
+    """One database file with a connection per thread"""
+
+    def __init__(self, path, busy_timeout=10.0):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self._local = threading.local()
+        self.connection().executescript(SCHEMA)
+
+    def connection(self) -> sqlite3.Connection:
+        """This thread's connection (opened on first use)"""
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            self._local.db = db
+            self._local.depth = 0
+        return db
+
+    @contextmanager
+    def _begin(self, statement, metric):
+        db = self.connection()
+        if self._local.depth:
+            self._local.depth += 1
+            try:
+                yield db
+            finally:
+                self._local.depth -= 1
+            return
+
+        with timed(metric):
+            db.execute(statement)
+        self._local.depth = 1
+        try:
+            yield db
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        else:
+            with timed('db_commit'):
+                db.execute('COMMIT')
+        finally:
+            self._local.depth = 0
+
+    def transaction(self):
+        """BEGIN IMMEDIATE ... COMMIT (nested calls join the outer transaction)"""
+        return self._begin('BEGIN IMMEDIATE', 'db_lock')
+
+    def read(self):
+        """BEGIN ... COMMIT for reads only: one consistent view without the write lock
+
+        Under WAL a deferred read transaction neither waits for nor blocks
+        writers in any process. Inside transaction() it joins the outer one.
+        """
+        return self._begin('BEGIN', 'db_read')
+
+    def execute(self, sql, params=()):
+        """Run one statement outside an explicit transaction"""
+        return self.connection().execute(sql, params)
+
+    def claim(self, name) -> bool:
+        """True exactly once per database for a one-time task such as an import
+
+        Call inside a transaction so the task and the claim commit together.
+        """
+        cursor = self.connection().execute(
+            'INSERT OR IGNORE INTO meta (key, value) VALUES (?, ?)',
+            (name, datetime.now().isoformat())
+        )
+        return cursor.rowcount == 1
+
+
+def _start_thread(name, interval, work, on_error):
+    def run():
+        while True:
+            time.sleep(interval)
+            try:
+                work()
+            except Exception as e:
+                if on_error is not None:
+                    on_error(e)
+
+    thread = threading.Thread(target=run, name=name, daemon=True)
+    thread.start()
+    return thread
+
+
+class SQLiteSessionStore:
+    """SessionStore with the same methods, backed by the sessions table"""
+
+    def __init__(self, db, sweep_interval=300, on_expire=None, legacy_store=None):
+        self.db = db
+        self.sweep_interval = sweep_interval
+        self.on_expire = on_expire
+        self.legacy_store = legacy_store  # file SessionStore to import from once
+        self._sweeper = None
+
+    def __len__(self):
+        return self.db.execute('SELECT COUNT(*) FROM sessions').fetchone()[0]
+
+    def load(self):
+        """Import file-backed sessions on first run, then drop expired ones"""
+        if self.legacy_store is not None:
+            with self.db.transaction() as db:
+                if self.db.claim('import:sessions'):
+                    self.legacy_store.load()
+                    for token, session in self.legacy_store.items():
+                        self._insert(db, token, session)
+        self.sweep()
+
+    def compact(self):
+        """Nothing to compact; kept for interface compatibility"""
+
+    def close(self):
+        """Nothing to release; kept for interface compatibility"""
+
+    @staticmethod
+    def _insert(db, token, session):
+        db.execute(
+            'INSERT OR REPLACE INTO sessions (token, username, created, expires, expires_at) '
+            'VALUES (?, ?, ?, ?, ?)',
+            (token, session['username'], session['created'], session['expires'],
+             datetime.fromisoformat(session['expires']).timestamp())
+        )
+
+    def create(self, token, username, duration):
+        """Create a session valid for `duration` seconds"""
+        now = datetime.now()
+        session = {
+            'username': username,
+            'created': now.isoformat(),
+            'expires': (now + timedelta(seconds=duration)).isoformat()
+        }
+        with self.db.transaction() as db:
+            self._insert(db, token, session)
+        return session
+
+    def get_username(self, token):
+        """Return the session's username, or None if missing or expired"""
+        row = self.db.execute(
+            'SELECT username FROM sessions WHERE token = ? AND expires_at >= ?',
+            (token, time.time())
+        ).fetchone()
+        return row[0] if row else None
+
+    def get(self, token):
+        """Return the session dict, or None"""
+        row = self.db.execute(
+            'SELECT username, created, expires FROM sessions WHERE token = ?', (token,)
+        ).fetchone()
+        return {'username': row[0], 'created': row[1], 'expires': row[2]} if row else None
+
+    def has_sessions(self, username):
+        """Whether any unexpired session of this user is stored"""
+        return self.db.execute(
+            'SELECT 1 FROM sessions WHERE username = ? AND expires_at >= ? LIMIT 1', (username, time.time())
+        ).fetchone() is not None
+
+    def items(self):
+        """(token, session) pairs for every stored session"""
+        rows = self.db.execute('SELECT token, username, created, expires FROM sessions').fetchall()
+        return [(row[0], {'username': row[1], 'created': row[2], 'expires': row[3]}) for row in rows]
+
+    def delete(self, token):
+        """Remove a session; returns the removed session or None"""
+        with self.db.transaction() as db:
+            session = self.get(token)
+            if session is not None:
+                db.execute('DELETE FROM sessions WHERE token = ?', (token,))
+        return session
+
+    def issue_ticket(self, token, ttl):
+        """A single-use ticket that redeems to `token` within `ttl` seconds"""
+        ticket = secrets.token_urlsafe(32)
+        with self.db.transaction() as db:
+            db.execute(
+                'INSERT INTO stream_tickets (ticket, token, expires_at) VALUES (?, ?, ?)',
+                (ticket, token, time.time() + ttl)
+            )
+        return ticket
+
+    def redeem_ticket(self, ticket):
+        """The session token a ticket was issued for, or None; a ticket works once"""
+        with self.db.transaction() as db:
+            row = db.execute(
+                'SELECT token, expires_at FROM stream_tickets WHERE ticket = ?', (ticket,)
+            ).fetchone()
+            if row is None:
+                return None
+            db.execute('DELETE FROM stream_tickets WHERE ticket = ?', (ticket,))
+        return row[0] if time.time() <= row[1] else None
+
+    def sweep(self, compact=True):
+        """Remove all expired sessions; returns how many were removed"""
+        now = time.time()
+        with self.db.transaction() as db:
+            db.execute('DELETE FROM stream_tickets WHERE expires_at < ?', (now,))
+            expired = db.execute(
+                'SELECT token, username, created, expires FROM sessions WHERE expires_at < ?', (now,)
+            ).fetchall()
+            db.execute('DELETE FROM sessions WHERE expires_at < ?', (now,))
+
+        if self.on_expire:
+            for token, username, created, expires in expired:
+                self.on_expire(token, {'username': username, 'created': created, 'expires': expires})
+        return len(expired)
+
+    def start_sweeper(self, on_error=None):
+        """Start the background thread that purges expired sessions (failures go to on_error(e))"""
+        if self._sweeper is None:
+            self._sweeper = _start_thread('session-sweeper', self.sweep_interval, self.sweep, on_error)
+
+
+class SQLiteLockoutTracker:
+    """LockoutTracker with the same methods, backed by the lockout tables"""
+
+    def __init__(self, db, max_attempts=5, lockout_duration=900, window=900,
+                 sweep_interval=30, legacy_tracker=None):
+        self.db = db
+        self.max_attempts = max_attempts
+        self.lockout_duration = lockout_duration
+        self.window = window
+        self.sweep_interval = sweep_interval
+        self.legacy_tracker = legacy_tracker  # file LockoutTracker to import from once
+        self._thread = None
+
+    def is_locked(self, ip):
+        """Return (locked, seconds remaining)"""
+        now = time.time()
+        row = self.db.execute('SELECT locked_until FROM lockouts WHERE ip = ?', (ip,)).fetchone()
+        if row is None:
+            return False, None
+        if now < row[0]:
+            return True, int(row[0] - now)
+        # Lockout expired; start the IP over with a clean slate
+        self.reset(ip)
+        return False, None
+
+    def record_failure(self, ip):
+        """Record a failed attempt; returns (locked, lockout seconds or attempts remaining)"""
+        now = time.time()
+        with self.db.transaction() as db:
+            db.execute('DELETE FROM login_failures WHERE ip = ? AND failed_at <= ?', (ip, now - self.window))
+            db.execute('INSERT INTO login_failures (ip, failed_at) VALUES (?, ?)', (ip, now))
+            failures = db.execute('SELECT COUNT(*) FROM login_failures WHERE ip = ?', (ip,)).fetchone()[0]
+
+            if failures >= self.max_attempts:
+                db.execute(
+                    'INSERT OR REPLACE INTO lockouts (ip, locked_until) VALUES (?, ?)',
+                    (ip, now + self.lockout_duration)
+                )
+                return True, self.lockout_duration
+            return False, self.max_attempts - failures
+
+    def reset(self, ip):
+        """Forget an IP's failures (after a successful login)"""
+        with self.db.transaction() as db:
+            db.execute('DELETE FROM login_failures WHERE ip = ?', (ip,))
+            db.execute('DELETE FROM lockouts WHERE ip = ?', (ip,))
+
+    def sweep(self):
+        """Drop expired lockouts and failures outside the window"""
+        now = time.time()
+        with self.db.transaction() as db:
+            expired = [row[0] for row in db.execute('SELECT ip FROM lockouts WHERE locked_until <= ?', (now,))]
+            db.executemany('DELETE FROM login_failures WHERE ip = ?', [(ip,) for ip in expired])
+            db.execute('DELETE FROM lockouts WHERE locked_until <= ?', (now,))
+            removed = db.execute(
+                'DELETE FROM login_failures WHERE failed_at <= ?', (now - self.window,)
+            ).rowcount
+        return len(expired) + removed
+
+    def load(self):
+        """Import the file tracker's lockouts.json on first run"""
+        if self.legacy_tracker is None:
+            return
+        with self.db.transaction() as db:
+            if not self.db.claim('import:lockouts'):
+                return
+            self.legacy_tracker.load()
+            for ip, failures, locked_until in self.legacy_tracker.entries():
+                db.executemany(
+                    'INSERT INTO login_failures (ip, failed_at) VALUES (?, ?)',
+                    [(ip, failed_at) for failed_at in failures]
+                )
+                if locked_until:
+                    db.execute(
+                        'INSERT OR REPLACE INTO lockouts (ip, locked_until) VALUES (?, ?)',
+                        (ip, locked_until)
+                    )
+
+    def snapshot(self, force=False):
+        """Every change is already durable; kept for interface compatibility"""
+        return False
+
+    def start(self, on_error=None):
+        """Start the background expiry thread (failures go to on_error(e))"""
+        if self._thread is None:
+            self._thread = _start_thread('lockout-sweeper', self.sweep_interval, self.sweep, on_error)
+
+    def stats(self) -> dict:
+        """Tracker size and settings"""
+        now = time.time()
+        tracked = self.db.execute(
+            'SELECT COUNT(*) FROM (SELECT ip FROM login_failures UNION SELECT ip FROM lockouts)'
+        ).fetchone()[0]
+        locked = self.db.execute('SELECT COUNT(*) FROM lockouts WHERE locked_until > ?', (now,)).fetchone()[0]
+        return {
+            'tracked_ips': tracked,
+            'locked_ips': locked,
+            'max_attempts': self.max_attempts,
+            'window': self.window
+        }
+
+
+class SQLiteRecordStore(RecordStore):
+    """RecordStore whose index and record tokens live in the database
+
+    `fallback` is the user's file-backed RecordStore; its data (including a
+    legacy .enc file) is imported the first time this store is used. Loads
+    read in a deferred transaction, so they never take the write lock.
+    """
+
+    def __init__(self, db, owner, get_key, fallback=None, kdf=None):
+        super().__init__(owner, get_key, kdf=kdf)
+        self.db = db
+        self.owner = owner
+        self.fallback = fallback
+
+    # ------------------------------------------------------------------
+    # Storage primitives
+    # ------------------------------------------------------------------
+
+    def _transaction(self):
+        return self.db.transaction()
+
+    def _read_transaction(self):
+        return self.db.read()
+
+    def _read_index(self):
+        row = self.db.execute('SELECT body FROM record_indexes WHERE owner = ?', (self.owner,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _write_index(self, index):
+        # Bumping the version lets every worker's data cache see the change
+        self.db.execute(
+            'INSERT INTO record_indexes (owner, body, version) VALUES (?, ?, 1) '
+            'ON CONFLICT (owner) DO UPDATE SET body = excluded.body, version = version + 1',
+            (self.owner, json.dumps(index))
+        )
+
+    def _index_etag(self):
+        row = self.db.execute('SELECT body FROM record_indexes WHERE owner = ?', (self.owner,)).fetchone()
+        if row is None:
+            raise FileNotFoundError(f'No record index for {self.owner}')
+        return hashlib.sha256(row[0].encode()).hexdigest()[:32]
+
+    def _read_token(self, entry) -> bytes:
+        row = self.db.execute(
+            'SELECT token FROM records WHERE owner = ? AND file = ?', (self.owner, entry['file'])
+        ).fetchone()
+        if row is None:
+            raise FileNotFoundError(f"Record {entry['file']} missing for {self.owner}")
+        return row[0]
+
+    def _write_token(self, entry, token: bytes):
+        self.db.execute(
+            'INSERT OR REPLACE INTO records (owner, file, token) VALUES (?, ?, ?)',
+            (self.owner, entry['file'], token)
+        )
+
+    def _has_token(self, entry) -> bool:
+        return self.db.execute(
+            'SELECT 1 FROM records WHERE owner = ? AND file = ?', (self.owner, entry['file'])
+        ).fetchone() is not None
+
+    def _remove_token(self, entry):
+        self.db.execute('DELETE FROM records WHERE owner = ? AND file = ?', (self.owner, entry['file']))
+
+    def _load_index(self):
+        index = self._read_index()
+        if index is None and self.fallback is not None and self.fallback.exists():
+            # Runs inside the caller's write transaction, so only one worker imports
+            websites = self.fallback.load()
+            index = self._new_index()
+            self._replace(index, websites)
+            if os.path.isdir(self.fallback.directory):
+                os.replace(self.fallback.directory, self.fallback.directory + '.migrated')
+        return index
+
+    # ------------------------------------------------------------------
+    # Public API
+    # ------------------------------------------------------------------
+
+    def exists(self) -> bool:
+        """Whether this user has any stored data (database or not yet imported files)"""
+        row = self.db.execute('SELECT 1 FROM record_indexes WHERE owner = ?', (self.owner,)).fetchone()
+        return row is not None or bool(self.fallback and self.fallback.exists())
+
+    def version(self):
+        """Change counter of the user's index, or None"""
+        row = self.db.execute('SELECT version FROM record_indexes WHERE owner = ?', (self.owner,)).fetchone()
+        return row[0] if row else None
+
+
+class SQLiteStatsCache(StatsCache):
+    """StatsCache whose entries live in the database, shared by every worker
+
+    Before fetching a site (a miss, a stale refresh or a poll) a worker claims
+    it by setting fetching_until; while the claim holds, other workers wait
+    for or reuse that result instead of calling upstream as well. A claim
+    lapses after `fetch_timeout`, in case its worker dies mid-fetch.
+    """
+
+    def __init__(self, db, fetch, executor, fetch_timeout=10.0, **kwargs):
+        super().__init__(fetch, executor, **kwargs)
+        self.db = db
+        self.fetch_timeout = fetch_timeout
+        self._writes = 0
+
+    # ------------------------------------------------------------------
+    # Storage primitives
+    # ------------------------------------------------------------------
+
+    def _lookup(self, key):
+        row = self.db.execute(
+            'SELECT result, fetched_at FROM upstream_stats '
+            'WHERE domain = ? AND fingerprint = ? AND result IS NOT NULL', key
+        ).fetchone()
+        return {'result': json.loads(row[0]), 'fetched_at': row[1]} if row else None
+
+    def _store(self, key, result):
+        with self.db.transaction() as db:
+            db.execute(
+                'INSERT INTO upstream_stats (domain, fingerprint, result, fetched_at, fetching_until) '
+                'VALUES (?, ?, ?, ?, 0) ON CONFLICT (domain, fingerprint) DO UPDATE SET '
+                'result = excluded.result, fetched_at = excluded.fetched_at, fetching_until = 0',
+                (*key, json.dumps(result), time.time())
+            )
+            with self._lock:
+                self._writes += 1
+                prune = self._writes % PRUNE_EVERY == 0
+            if prune:
+                self._prune(db)
+
+    def _prune(self, db):
+        now = time.time()
+        expired = db.execute(
+            'DELETE FROM upstream_stats WHERE fetched_at < ? AND fetching_until < ?',
+            (now - max(self.ttl, self.negative_ttl) - self.stale_ttl, now)
+        ).rowcount
+        excess = db.execute(
+            'DELETE FROM upstream_stats WHERE rowid IN '
+            '(SELECT rowid FROM upstream_stats ORDER BY fetched_at DESC LIMIT -1 OFFSET ?)',
+            (self.max_entries,)
+        ).rowcount
+        with self._lock:
+            self._stats['evictions'] += expired + excess
+
+    def _claim(self, key, recent=0.0) -> bool:
+        """Claim the next fetch of key, unless one is running or happened within `recent` seconds"""
+        now = time.time()
+        with self.db.transaction() as db:
+            row = db.execute(
+                'SELECT fetched_at, fetching_until FROM upstream_stats WHERE domain = ? AND fingerprint = ?', key
+            ).fetchone()
+            if row is not None and (row[1] > now or row[0] > now - recent):
+                return False
+            db.execute(
+                'INSERT INTO upstream_stats (domain, fingerprint, fetching_until) VALUES (?, ?, ?) '
+                'ON CONFLICT (domain, fingerprint) DO UPDATE SET fetching_until = excluded.fetching_until',
+                (*key, now + self.fetch_timeout)
+            )
+            return True
+
+    def _claim_refresh(self, key) -> bool:
+        return self._claim(key)
+
+    def _end_refresh(self, key):
+        with self.db.transaction() as db:
+            db.execute(
+                'UPDATE upstream_stats SET fetching_until = 0 WHERE domain = ? AND fingerprint = ?', key
+            )
+
+    def _fetch_once(self, key, domain, api_key):
+        started = time.time()
+        if not self._claim(key):
+            # Another worker is fetching this site right now: wait for its result
+            deadline = time.monotonic() + self.fetch_timeout
+            while time.monotonic() < deadline:
+                time.sleep(0.05)
+                entry = self._lookup(key)
+                if entry is not None and entry['fetched_at'] >= started:
+                    return entry['result']
+        return super()._fetch_once(key, domain, api_key)
+
+    def _delete(self, key):
+        with self.db.transaction() as db:
+            db.execute('DELETE FROM upstream_stats WHERE domain = ? AND fingerprint = ?', key)
+
+    def _size(self) -> int:
+        return self.db.execute('SELECT COUNT(*) FROM upstream_stats WHERE result IS NOT NULL').fetchone()[0]
+
+    # ------------------------------------------------------------------
+    # Public API
+    # ------------------------------------------------------------------
+
+    def claim_poll(self, domain: str, api_key: str, recent: float) -> bool:
+        """Whether this worker should poll the site now (see StatsCache.claim_poll)"""
+        return self._claim((domain, fingerprint(api_key)), recent)
+
+
+class SQLiteSiteHealth(SiteHealth):
+    """SiteHealth whose circuit breakers live in the database, shared by every worker
+
+    Latency windows and adaptive timeouts stay per worker. A domain only has
+    a row while it has failures or its circuit is not closed, so a call to a
+    healthy site costs one indexed read. A half-open probe is held until
+    probe_until, so a worker dying mid-probe cannot block the site for good.
+    """
+
+    def __init__(self, db, **kwargs):
+        super().__init__(**kwargs)
+        self.db = db
+
+    @staticmethod
+    def _row(db, domain):
+        return db.execute(
+            'SELECT state, failures, opened_at, cooldown, probe_until, last_error '
+            'FROM site_breakers WHERE domain = ?', (domain,)
+        ).fetchone()
+
+    def _load(self, state, row, now):
+        if row is None:
+            state.state, state.failures, state.opened_at, state.cooldown = CLOSED, 0, 0.0, 0.0
+            state.probing, state.last_error = False, None
+        else:
+            state.state, state.failures, state.opened_at, state.cooldown = row[:4]
+            state.probing = row[4] > now
+            state.last_error = row[5]
+
+    def _save(self, db, domain, state, now):
+        if state.state == CLOSED and state.failures == 0:
+            db.execute('DELETE FROM site_breakers WHERE domain = ?', (domain,))
+            return
+        db.execute(
+            'INSERT OR REPLACE INTO site_breakers '
+            '(domain, state, failures, opened_at, cooldown, probe_until, last_error) VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (domain, state.state, state.failures, state.opened_at, state.cooldown,
+             now + self.max_timeout if state.probing else 0.0, state.last_error)
+        )
+
+    def _update(self, domain, transition):
+        """Apply transition(state, now) to the domain's shared state in one transaction"""
+        now = time.time()
+        with self.db.transaction() as db:
+            with self._lock:
+                state = self._get(domain)
+                self._load(state, self._row(db, domain), now)
+                result = transition(state, now)
+                self._save(db, domain, state, now)
+        return result
+
+    def acquire(self, domain):
+        """Before a call: (allowed, timeout, seconds until retry when rejected)"""
+        if self._row(self.db, domain) is None:
+            with self._lock:
+                return True, self._get(domain).timeout or self.max_timeout, None
+        return self._update(domain, self._acquire)
+
+    def record_success(self, domain, latency):
+        """After a call that reached a working site"""
+        with self._lock:
+            self._add_latency(self._get(domain), latency)
+        if self._row(self.db, domain) is not None:
+            self._update(domain, lambda state, now: self._succeeded(state))
+
+    def record_failure(self, domain, error):
+        """After a timeout, connection error or 5xx"""
+        self._update(domain, lambda state, now: self._failed(state, error, now))
+
+    def last_error(self, domain):
+        row = self._row(self.db, domain)
+        return row[5] if row else None
+
+    def domains(self) -> dict:
+        """Per-domain detail: this worker's latencies with the shared breaker state"""
+        domains = super().domains()
+        rows = {row[0]: row[1:] for row in self.db.execute(
+            'SELECT domain, state, failures, last_error FROM site_breakers'
+        ).fetchall()}
+        for domain in rows.keys() - domains.keys():
+            domains[domain] = self._detail(DomainState(self.window))
+        for domain, detail in domains.items():
+            # No row means closed with no failures, whatever this worker last loaded
+            state, failures, last_error = rows.get(domain, (CLOSED, 0, None))
+            detail.update({'state': state, 'failures': failures, 'last_error': last_error})
+        return domains
+
+    def stats(self) -> dict:
+        """This worker's breaker counters plus shared domains per state"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['domains'] = len(self._domains)
+        counts = dict(self.db.execute('SELECT state, COUNT(*) FROM site_breakers GROUP BY state').fetchall())
+        stats[OPEN] = counts.get(OPEN, 0)
+        stats[HALF_OPEN] = counts.get(HALF_OPEN, 0)
+        stats[CLOSED] = max(stats['domains'] - stats[OPEN] - stats[HALF_OPEN], 0)
+        return stats
+
+
+class SQLiteMetricsShare:
+    """Publishes this worker's metrics so a scrape of any worker covers all of them
+
+    Every `interval` seconds the worker stores metrics.snapshot() under its
+    pid. others() returns the snapshots of the other workers of the same
+    server generation (one gunicorn master run). Workers that stopped
+    publishing keep their counters and histograms, so totals never go
+    backwards, but their gauges are dropped.
+    """
+
+    def __init__(self, db, generation, interval=5.0):
+        self.db = db
+        self.generation = generation
+        self.interval = interval
+        self.worker = str(os.getpid())
+        self._thread = None
+
+    def publish(self):
+        body = json.dumps(metrics.snapshot())
+        with self.db.transaction() as db:
+            db.execute(
+                'INSERT OR REPLACE INTO metric_snapshots (worker, generation, updated, body) VALUES (?, ?, ?, ?)',
+                (self.worker, self.generation, time.time(), body)
+            )
+
+    def others(self) -> list:
+        """Snapshots of this generation's other workers"""
+        now = time.time()
+        rows = self.db.execute(
+            'SELECT updated, body FROM metric_snapshots WHERE generation = ? AND worker != ?',
+            (self.generation, self.worker)
+        ).fetchall()
+        snapshots = []
+        for updated, body in rows:
+            snapshot = json.loads(body)
+            if now - updated > self.interval * 3:
+                snapshot = {name: metric for name, metric in snapshot.items() if metric['kind'] != 'gauge'}
+            snapshots.append(snapshot)
+        return snapshots
+
+    def start(self, on_error=None):
+        """Drop earlier generations' snapshots and start publishing (failures go to on_error(e))"""
+        with self.db.transaction() as db:
+            db.execute('DELETE FROM metric_snapshots WHERE generation != ?', (self.generation,))
+        self.publish()
+        if self._thread is None:
+            self._thread = _start_thread('metrics-share', self.interval, self.publish, on_error)
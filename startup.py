@@ -0,0 +1,128 @@
+"""
+Startup
+Cold-start timings, an optional warm-up phase and readiness.
+
+The server records how long each startup phase took (imports, loading
+sessions and lockouts, ...). Work that only makes the first requests faster
+(importing the crypto backend, building TLS contexts and connection pools,
+compressing static assets) is registered as warm-up tasks instead of being
+done at import time. warm_up() runs them in a background thread; once they
+have all finished (successfully or not) the process reports ready, so a
+readiness probe can hold traffic back until the first request will be fast.
+Without a warm-up the process is ready as soon as startup finishes and the
+same work happens lazily on first use.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class Startup:
+    """Startup phase timings, warm-up tasks and the ready flag"""
+
+    def __init__(self, started=None):
+        self.started = started if started is not None else time.perf_counter()
+        self._lock = threading.Lock()
+        self._phases = OrderedDict()  # name -> seconds
+        self._tasks = OrderedDict()  # name -> {'fn', 'status', 'seconds', 'error'}
+        self._ready = threading.Event()
+        self._ready_after = None  # seconds from `started` until ready
+        self._thread = None
+
+    # ------------------------------------------------------------------
+    # Startup phases
+    # ------------------------------------------------------------------
+
+    def record(self, name, seconds):
+        with self._lock:
+            self._phases[name] = round(seconds, 4)
+
+    @contextmanager
+    def phase(self, name):
+        """Time one blocking startup step"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    # ------------------------------------------------------------------
+    # Warm-up
+    # ------------------------------------------------------------------
+
+    def add_task(self, name, fn):
+        """Register fn() to run during warm-up"""
+        with self._lock:
+            self._tasks[name] = {'fn': fn, 'status': PENDING, 'seconds': None, 'error': None}
+
+    def _run_tasks(self, on_error=None, on_ready=None):
+        for name, task in list(self._tasks.items()):
+            with self._lock:
+                task['status'] = RUNNING
+            started = time.perf_counter()
+            try:
+                task['fn']()
+                status, error = DONE, None
+            except Exception as e:
+                # A failed warm-up only means that work happens on first use instead
+                status, error = FAILED, str(e)
+                if on_error is not None:
+                    on_error(name, e)
+            with self._lock:
+                task['status'] = status
+                task['error'] = error
+                task['seconds'] = round(time.perf_counter() - started, 4)
+        self.mark_ready()
+        if on_ready is not None:
+            on_ready(self.stats())
+
+    def warm_up(self, background=True, on_error=None, on_ready=None):
+        """Run the warm-up tasks, then mark the process ready; returns self
+
+        on_error(name, exception) is called for a failed task and
+        on_ready(stats) once every task has finished.
+        """
+        if not background:
+            self._run_tasks(on_error, on_ready)
+            return self
+        with self._lock:
+            if self._thread is not None:
+                return self
+            self._thread = threading.Thread(
+                target=self._run_tasks, args=(on_error, on_ready), name='startup-warmup', daemon=True
+            )
+        self._thread.start()
+        return self
+
+    def mark_ready(self):
+        with self._lock:
+            if self._ready_after is None:
+                self._ready_after = round(time.perf_counter() - self.started, 4)
+        self._ready.set()
+
+    def is_ready(self) -> bool:
+        return self._ready.is_set()
+
+    def wait_ready(self, timeout=None) -> bool:
+        return self._ready.wait(timeout)
+
+    def stats(self) -> dict:
+        """Ready flag, phase timings and warm-up task states"""
+        with self._lock:
+            return {
+                'ready': self._ready.is_set(),
+                'ready_after': self._ready_after,
+                'uptime': round(time.perf_counter() - self.started, 1),
+                'phases': dict(self._phases),
+                'warmup': {
+                    name: {key: task[key] for key in ('status', 'seconds', 'error') if task[key] is not None}
+                    for name, task in self._tasks.items()
+                }
+            }
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Static Asset Pipeline
+Splits index.html into a small HTML shell plus content-hashed CSS/JS files.
+
+index.html stays the single source file. At startup the inline <style> and
+<script> blocks are moved into app.<hash>.css / app.<hash>.js (served with
+immutable long-lived caching, since any change produces a new name), and each
+file is precompressed once with gzip and, when the optional `brotli` package
+is installed, brotli. Only the shell, which references the hashed names, is
+served no-store.
+
+Run directly to write the built files to a directory for inspection:
+    python3 static_assets.py [output_dir]
+"""
+
+import gzip
+import hashlib
+import os
+import re
+import sys
+import threading
+
+try:
+    import brotli
+except ImportError:  # Optional: fall back to gzip only
+    brotli = None
+
+STYLE_RE = re.compile(r'<style>(.*?)</style>', re.S)
+SCRIPT_RE = re.compile(r'<script>(.*?)</script>', re.S)  # Inline scripts only
+
+
+class Asset:
+    """One file with its precompressed variants"""
+
+    def __init__(self, name, content_type, body: bytes):
+        self.name = name
+        self.content_type = content_type
+        self.etag = hashlib.sha256(body).hexdigest()[:16]
+        self.variants = {'identity': body}
+        self.variants['gzip'] = gzip.compress(body, compresslevel=9, mtime=0)
+        if brotli is not None:
+            self.variants['br'] = brotli.compress(body, quality=11)
+
+    @property
+    def encodings(self):
+        """Encodings in server preference order (smallest first)"""
+        return sorted(self.variants, key=lambda encoding: len(self.variants[encoding]))
+
+
+class AssetBundle:
+    """The HTML shell plus its hashed assets, built from one HTML file"""
+
+    def __init__(self, html_path, url_prefix='/assets/'):
+        self.html_path = html_path
+        self.url_prefix = url_prefix
+        self.shell = None
+        self.assets = {}
+        self._lock = threading.Lock()
+
+    def _add(self, stem, extension, content_type, text):
+        body = text.encode()
+        digest = hashlib.sha256(body).hexdigest()[:12]
+        asset = Asset(f'{stem}.{digest}.{extension}', content_type, body)
+        self.assets[asset.name] = asset
+        return self.url_prefix + asset.name
+
+    def build(self):
+        """Split, fingerprint and precompress; returns self"""
+        with open(self.html_path, 'r', encoding='utf-8') as f:
+            html = f.read()
+
+        self.assets = {}
+        css = '\n'.join(STYLE_RE.findall(html))
+        js = '\n'.join(SCRIPT_RE.findall(html))
+
+        if css:
+            href = self._add('app', 'css', 'text/css; charset=utf-8', css)
+            html = STYLE_RE.sub('', html)
+            html = html.replace('</head>', f'    <link rel="stylesheet" href="{href}">\n</head>', 1)
+        if js:
+            src = self._add('app', 'js', 'application/javascript; charset=utf-8', js)
+            html = SCRIPT_RE.sub('', html)
+            html = html.replace('</body>', f'    <script src="{src}"></script>\n</body>', 1)
+
+        self.shell = Asset('index.html', 'text/html; charset=utf-8', html.encode())
+        return self
+
+    def ensure_built(self):
+        """Build on first use (once, even with concurrent callers); returns self"""
+        if self.shell is None:
+            with self._lock:
+                if self.shell is None:
+                    self.build()
+        return self
+
+    def write(self, output_dir):
+        """Write the shell, assets and compressed variants to a directory"""
+        os.makedirs(output_dir, exist_ok=True)
+        suffixes = {'identity': '', 'gzip': '.gz', 'br': '.br'}
+        for asset in [self.shell] + list(self.assets.values()):
+            for encoding, body in asset.variants.items():
+                with open(os.path.join(output_dir, asset.name + suffixes[encoding]), 'wb') as f:
+                    f.write(body)
+
+
+if __name__ == '__main__':
+    output_dir = sys.argv[1] if len(sys.argv) > 1 else 'build'
+    bundle = AssetBundle(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'index.html')).build()
+    bundle.write(output_dir)
+
+    for asset in [bundle.shell] + list(bundle.assets.values()):
+        sizes = ', '.join(f'{encoding}={len(body)}' for encoding, body in asset.variants.items())
+        print(f"{asset.name}: {sizes}")
+    print(f"Wrote {output_dir}/")
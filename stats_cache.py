@@ -0,0 +1,181 @@
+"""
+Stats Cache
+Shared server-side cache of upstream /api/v1/stats responses.
+
+Entries are keyed by (domain, API key fingerprint) so every open dashboard
+shares the same upstream result. A fresh entry is served as-is; an entry past
+its TTL but inside the stale window is served immediately while a background
+refresh runs; anything older is fetched synchronously. Failed fetches are
+cached for a shorter negative TTL so dead sites are not hammered either.
+
+Entry storage goes through a few primitives (_lookup, _store, _claim_refresh,
+_end_refresh, _fetch_once) so the SQLite backend can share entries, and the
+right to fetch, between server processes (see sqlite_storage.py).
+"""
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+
+def fingerprint(api_key: str) -> str:
+    """Short, non-reversible fingerprint of an API key for cache keys"""
+    return hashlib.sha256(api_key.encode()).hexdigest()[:16]
+
+
+class StatsCache:
+    """TTL cache with stale-while-revalidate and negative caching"""
+
+    def __init__(self, fetch, executor, ttl=60, stale_ttl=600, negative_ttl=30,
+                 max_entries=2048):
+        self.fetch = fetch  # fetch(domain, api_key) -> result dict with 'isOnline'
+        self.executor = executor
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+
+        self._entries = OrderedDict()  # key -> {'result', 'fetched_at', 'refreshing'}
+        self._lock = threading.Lock()
+        self._stats = {
+            'hits': 0, 'misses': 0, 'stale_hits': 0, 'negative_hits': 0,
+            'refreshes': 0, 'evictions': 0
+        }
+
+    # ------------------------------------------------------------------
+    # Storage primitives (overridden by other backends)
+    # ------------------------------------------------------------------
+
+    def _lookup(self, key):
+        """The entry for key ({'result', 'fetched_at'}), or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def _store(self, key, result):
+        with self._lock:
+            self._entries[key] = {
+                'result': result,
+                'fetched_at': time.time(),
+                'refreshing': False
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+
+    def _claim_refresh(self, key) -> bool:
+        """Claim the background refresh of a stale entry (False if one is running)"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry['refreshing']:
+                return False
+            entry['refreshing'] = True
+            return True
+
+    def _end_refresh(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry:
+                entry['refreshing'] = False
+
+    def _fetch_once(self, key, domain, api_key):
+        """Fetch and store a missing entry"""
+        result = self.fetch(domain, api_key)
+        self._store(key, result)
+        return result
+
+    def _delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def _size(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    # ------------------------------------------------------------------
+    # Internals
+    # ------------------------------------------------------------------
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def _refresh(self, key, domain, api_key):
+        try:
+            self._store(key, self.fetch(domain, api_key))
+        finally:
+            self._end_refresh(key)
+
+    @staticmethod
+    def _annotate(result, fetched_at, status):
+        result = dict(result)
+        result['cacheStatus'] = status
+        result['cacheAge'] = round(max(time.time() - fetched_at, 0.0), 1)
+        return result
+
+    # ------------------------------------------------------------------
+    # Public API
+    # ------------------------------------------------------------------
+
+    def get(self, domain: str, api_key: str) -> dict:
+        """Return stats for a site, from cache when possible"""
+        key = (domain, fingerprint(api_key))
+        entry = self._lookup(key)
+
+        if entry is not None:
+            result = entry['result']
+            age = time.time() - entry['fetched_at']
+            fresh_for = self.ttl if result.get('isOnline') else self.negative_ttl
+
+            if age < fresh_for:
+                self._count('hits' if result.get('isOnline') else 'negative_hits')
+                return self._annotate(result, entry['fetched_at'], 'hit')
+
+            if age < fresh_for + self.stale_ttl:
+                self._count('stale_hits')
+                if self._claim_refresh(key):
+                    self._count('refreshes')
+                    self.executor.submit(self._refresh, key, domain, api_key)
+                return self._annotate(result, entry['fetched_at'], 'stale')
+
+        self._count('misses')
+        result = self._fetch_once(key, domain, api_key)
+        return self._annotate(result, time.time(), 'miss')
+
+    def put(self, domain: str, api_key: str, result: dict):
+        """Store a result fetched elsewhere (e.g. by the background poller)"""
+        self._store((domain, fingerprint(api_key)), result)
+
+    def claim_poll(self, domain: str, api_key: str, recent: float) -> bool:
+        """Whether the caller should poll this site now
+
+        Always True for a cache private to one process; shared backends
+        return False while another process is fetching the site or has
+        fetched it within `recent` seconds.
+        """
+        return True
+
+    def latest(self, domain: str, api_key: str):
+        """(result, fetched_at) of the newest stored result, or None"""
+        entry = self._lookup((domain, fingerprint(api_key)))
+        return (entry['result'], entry['fetched_at']) if entry is not None else None
+
+    def invalidate(self, domain: str, api_key: str):
+        """Drop the cached entry for a site"""
+        self._delete((domain, fingerprint(api_key)))
+
+    def stats(self) -> dict:
+        """Snapshot of cache counters"""
+        with self._lock:
+            stats = dict(self._stats)
+        stats.update({
+            'size': self._size(),
+            'ttl': self.ttl,
+            'stale_ttl': self.stale_ttl,
+            'negative_ttl': self.negative_ttl
+        })
+        return stats
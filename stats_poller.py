@@ -0,0 +1,259 @@
+"""
+Stats Poller
+Server-side scheduler that polls each configured website on its own interval.
+
+Sites are registered per user whenever their website list is loaded or saved.
+Each distinct (domain, API key) is polled once per interval (with jitter, so
+sites don't all fire together) no matter how many users or dashboards share
+it. Every poll whose result differs from the previous one gets a new,
+globally increasing sequence number; SSE clients ask for everything after the
+last sequence number they saw and block in wait_for_change() for more.
+
+With several server processes each runs its own poller for the users it has
+seen. Given a `shared` store (a StatsCache backed by the shared database),
+a process polls a site only after claiming it there; the others pick up the
+stored result shortly after it is due instead of calling upstream
+themselves, so each site is still polled once per interval overall.
+"""
+
+import json
+import random
+import threading
+import time
+
+from stats_cache import fingerprint
+
+FOLLOW_RETRY = 2.0  # seconds before looking again when another process's first poll is in flight
+
+
+def _comparable(result):
+    """The part of a result that counts as a change"""
+    return json.dumps(
+        {k: result.get(k) for k in ('data', 'error', 'isOnline')},
+        sort_keys=True
+    )
+
+
+class StatsPoller:
+    """Polls registered sites in the background and tracks changes"""
+
+    def __init__(self, fetch, executor, on_result=None, interval=300, jitter=0.1, on_error=None,
+                 shared=None):
+        self.fetch = fetch  # fetch(domain, api_key) -> result dict
+        self.executor = executor
+        self.on_result = on_result  # on_result(domain, api_key, result)
+        self.on_error = on_error  # on_error(domain, exception) when a poll fails unexpectedly
+        self.shared = shared  # claim_poll(domain, api_key, recent) / latest(domain, api_key)
+        self.interval = interval
+        self.jitter = jitter
+
+        self._sites = {}  # (domain, fingerprint) -> site state
+        self._users = {}  # username -> {(domain, fingerprint): [website ids]}
+        self._seq = 0
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stats = {'polls': 0, 'followed': 0, 'changes': 0, 'errors': 0}
+
+    def _next_due(self, now):
+        spread = self.interval * self.jitter
+        return now + self.interval + random.uniform(-spread, spread)
+
+    # ------------------------------------------------------------------
+    # Registration
+    # ------------------------------------------------------------------
+
+    def set_sites(self, username: str, websites: list):
+        """Replace the set of sites polled on behalf of a user"""
+        user_sites = {}
+        api_keys = {}
+        for website in websites:
+            if not isinstance(website, dict):
+                continue
+            domain = website.get('domain')
+            api_key = website.get('apiKey')
+            if not domain or not api_key:
+                continue
+            key = (domain, fingerprint(api_key))
+            user_sites.setdefault(key, []).append(website.get('id'))
+            api_keys[key] = api_key
+
+        with self._cond:
+            for key, api_key in api_keys.items():
+                self._register(key, api_key)
+            self._users[username] = user_sites
+            self._prune()
+            self._cond.notify_all()
+
+    def update_site(self, username: str, website_id, website: dict = None):
+        """Re-register one website for a user (None removes it)"""
+        with self._cond:
+            if username not in self._users:
+                return  # Registered in full on the user's next load
+            user_sites = self._users[username]
+
+            for key in list(user_sites):
+                ids = [i for i in user_sites[key] if i != website_id]
+                if ids:
+                    user_sites[key] = ids
+                else:
+                    del user_sites[key]
+
+            if website and website.get('domain') and website.get('apiKey'):
+                key = (website['domain'], fingerprint(website['apiKey']))
+                self._register(key, website['apiKey'])
+                user_sites.setdefault(key, []).append(website_id)
+
+            self._prune()
+            self._cond.notify_all()
+
+    def _register(self, key, api_key):
+        if key not in self._sites:
+            self._sites[key] = {
+                'domain': key[0],
+                'api_key': api_key,
+                'result': None,
+                'comparable': None,
+                'seq': 0,
+                'next_due': time.monotonic(),  # Poll new sites right away
+                'polling': False
+            }
+
+    def has_user(self, username: str) -> bool:
+        """Whether a user's websites are registered"""
+        with self._cond:
+            return username in self._users
+
+    def remove_user(self, username: str):
+        """Stop polling sites that only this user had registered"""
+        with self._cond:
+            self._users.pop(username, None)
+            self._prune()
+
+    def _prune(self):
+        wanted = set()
+        for user_sites in self._users.values():
+            wanted.update(user_sites)
+        for key in [k for k in self._sites if k not in wanted]:
+            del self._sites[key]
+
+    # ------------------------------------------------------------------
+    # Scheduling
+    # ------------------------------------------------------------------
+
+    def start(self):
+        """Start the scheduler thread"""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name='stats-poller', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                now = time.monotonic()
+                due = [key for key, site in self._sites.items()
+                       if not site['polling'] and site['next_due'] <= now]
+                for key in due:
+                    self._sites[key]['polling'] = True
+
+                if not due:
+                    upcoming = [site['next_due'] for site in self._sites.values() if not site['polling']]
+                    timeout = min(upcoming) - now if upcoming else self.interval
+                    self._cond.wait(timeout=max(min(timeout, self.interval), 0.05))
+                    continue
+
+            for key in due:
+                site = self._sites.get(key)
+                if site is not None:
+                    self.executor.submit(self._poll, key, site['domain'], site['api_key'])
+
+    def _poll(self, key, domain, api_key):
+        result = None
+        next_due = None
+        try:
+            # Shorter than the earliest next poll, so the process that polled can claim it again
+            recent = self.interval * (1 - self.jitter) * 0.9
+            if self.shared is not None and not self.shared.claim_poll(domain, api_key, recent):
+                result, next_due = self._follow(domain, api_key)
+                return
+            try:
+                result = self.fetch(domain, api_key)
+            except Exception as e:
+                result = {'error': str(e), 'isOnline': False}
+            if self.on_result:
+                self.on_result(domain, api_key, result)
+        except Exception as e:
+            with self._cond:
+                self._stats['errors'] += 1
+            if self.on_error is not None:
+                self.on_error(domain, e)
+        finally:
+            # Always reschedule: a site left marked as polling would never be polled again
+            self._finish(key, result, next_due)
+
+    def _follow(self, domain, api_key):
+        """Another process polls this site: its latest result, and when to look again"""
+        with self._cond:
+            self._stats['followed'] += 1
+        latest = self.shared.latest(domain, api_key)
+        if latest is None:
+            return None, time.monotonic() + min(FOLLOW_RETRY, self.interval)
+        result, fetched_at = latest
+        # Its next poll happens within interval (+ jitter) of the last one
+        wait = fetched_at + self.interval * (1 + self.jitter) + 1 - time.time()
+        return result, time.monotonic() + min(max(wait, 1.0), self.interval)
+
+    def _finish(self, key, result, next_due=None):
+        comparable = _comparable(result) if result is not None else None
+        with self._cond:
+            if next_due is None:
+                self._stats['polls'] += 1
+            site = self._sites.get(key)
+            if site is None:
+                return  # Unregistered while in flight
+
+            site['polling'] = False
+            site['next_due'] = next_due if next_due is not None else self._next_due(time.monotonic())
+            if comparable is not None and comparable != site['comparable']:
+                self._seq += 1
+                self._stats['changes'] += 1
+                site.update(result=result, comparable=comparable, seq=self._seq)
+            self._cond.notify_all()
+
+    # ------------------------------------------------------------------
+    # Subscribers
+    # ------------------------------------------------------------------
+
+    def changes_since(self, username: str, last_seq: int):
+        """Return ([(seq, payload)], current seq) for this user's sites changed after last_seq"""
+        events = []
+        with self._cond:
+            for key, ids in self._users.get(username, {}).items():
+                site = self._sites.get(key)
+                if site is None or site['result'] is None or site['seq'] <= last_seq:
+                    continue
+                payload = dict(site['result'])
+                payload.update({'domain': site['domain'], 'ids': ids})
+                events.append((site['seq'], payload))
+            current = self._seq
+        events.sort(key=lambda event: event[0])
+        return events, current
+
+    def wait_for_change(self, last_seq: int, timeout: float) -> bool:
+        """Block until something changes after last_seq; False on timeout"""
+        with self._cond:
+            return self._cond.wait_for(lambda: self._seq > last_seq, timeout=timeout)
+
+    def stats(self) -> dict:
+        """Scheduler counters"""
+        with self._cond:
+            return {
+                'sites': len(self._sites),
+                'users': len(self._users),
+                'polls': self._stats['polls'],
+                'followed': self._stats['followed'],
+                'changes': self._stats['changes'],
+                'errors': self._stats['errors'],
+                'seq': self._seq,
+                'interval': self.interval
+            }
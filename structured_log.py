@@ -0,0 +1,169 @@
+"""
+Structured Log
+Leveled JSON logging that keeps request threads off the console.
+
+Every event is written as one JSON object per line:
+
+    {"ts": "...", "level": "info", "event": "data.saved", "route": "POST /api/data", ...}
+
+A call below the configured level returns before anything is built, and
+info/debug events tagged with a route can be sampled (keep 1% of
+GET /api/data lines, say); warnings and errors are never sampled. Accepted
+events go onto a bounded queue and a single background thread formats and
+writes them in batches, so a request never waits on stdout. Fields that can
+carry secrets are redacted by that thread: usernames (derived from
+password:otp) become a keyed fingerprint that is stable for the life of the
+process, and passwords, OTPs, tokens and API keys are dropped.
+"""
+
+import hashlib
+import hmac
+import json
+import queue
+import random
+import secrets
+import sys
+import threading
+import time
+from datetime import datetime
+
+LEVELS = {'debug': 10, 'info': 20, 'warning': 30, 'error': 40}
+
+USER_FIELDS = {'username', 'user'}
+SECRET_FIELDS = {'password', 'otp', 'token', 'authorization', 'api_key', 'apiKey'}
+
+
+def parse_sample_rates(value: str) -> dict:
+    """Parse 'GET /api/data=0.01,POST /api/data=0.1' into {route: rate}"""
+    rates = {}
+    for item in (value or '').split(','):
+        route, sep, rate = item.rpartition('=')
+        if sep and route.strip():
+            rates[route.strip()] = min(max(float(rate), 0.0), 1.0)
+    return rates
+
+
+class StructuredLogger:
+    """Leveled, sampled, redacting JSON logger with a background writer"""
+
+    def __init__(self, level='info', sample_rates=None, stream=None, max_queue=10000):
+        self.level = LEVELS[level.lower()]
+        self.level_name = level.lower()
+        self.sample_rates = sample_rates or {}
+        self.stream = stream or sys.stdout
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._redaction_key = secrets.token_bytes(16)
+        self._lock = threading.Lock()
+        self._stats = {'written': 0, 'dropped': 0}
+        self._thread = None
+
+    def enabled(self, level) -> bool:
+        """Whether events at this level are logged (use to skip expensive fields)"""
+        return LEVELS[level] >= self.level
+
+    # ------------------------------------------------------------------
+    # Logging
+    # ------------------------------------------------------------------
+
+    def log(self, level, event, route=None, **fields):
+        """Queue one event; cheap no-op when filtered by level or sampling"""
+        severity = LEVELS[level]
+        if severity < self.level:
+            return
+
+        if route is not None:
+            fields['route'] = route
+            rate = self.sample_rates.get(route, 1.0)
+            if severity < LEVELS['warning'] and rate < 1.0:
+                if random.random() >= rate:
+                    return
+                fields['sample_rate'] = rate
+
+        try:
+            self._queue.put_nowait((time.time(), level, event, fields))
+        except queue.Full:
+            with self._lock:
+                self._stats['dropped'] += 1
+
+    def debug(self, event, **fields):
+        self.log('debug', event, **fields)
+
+    def info(self, event, **fields):
+        self.log('info', event, **fields)
+
+    def warning(self, event, **fields):
+        self.log('warning', event, **fields)
+
+    def error(self, event, **fields):
+        self.log('error', event, **fields)
+
+    # ------------------------------------------------------------------
+    # Writing
+    # ------------------------------------------------------------------
+
+    def fingerprint(self, value: str) -> str:
+        """Keyed, non-reversible stand-in for a secret-derived identifier"""
+        return hmac.new(self._redaction_key, str(value).encode(), hashlib.sha256).hexdigest()[:12]
+
+    def _format(self, timestamp, level, event, fields) -> str:
+        record = {
+            'ts': datetime.fromtimestamp(timestamp).isoformat(timespec='milliseconds'),
+            'level': level,
+            'event': event
+        }
+        for name, value in fields.items():
+            if name in USER_FIELDS:
+                record[name] = self.fingerprint(value) if value is not None else None
+            elif name not in SECRET_FIELDS:
+                record[name] = value
+        return json.dumps(record, default=str) + '\n'
+
+    def _write(self, items):
+        lines = [self._format(*item) for item in items]
+        try:
+            self.stream.write(''.join(lines))
+            self.stream.flush()
+        except (OSError, ValueError):
+            return
+        with self._lock:
+            self._stats['written'] += len(lines)
+
+    def start(self):
+        """Start the background writer thread"""
+        if self._thread is not None:
+            return self
+
+        def run():
+            while True:
+                items = [self._queue.get()]
+                while len(items) < 500:
+                    try:
+                        items.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+                stop = None in items
+                self._write([item for item in items if item is not None])
+                if stop:
+                    return
+
+        self._thread = threading.Thread(target=run, name='structured-log', daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self, timeout=2.0):
+        """Write everything still queued (used on shutdown)"""
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join(timeout)
+        self._thread = None
+
+    def stats(self) -> dict:
+        """Writer counters and settings"""
+        with self._lock:
+            stats = dict(self._stats)
+        stats['queued'] = self._queue.qsize()
+        stats['level'] = self.level_name
+        stats['sample_rates'] = self.sample_rates
+        return stats
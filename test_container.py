@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Tests for the encrypted container format: record tokens, file containers and
+reading data written in the legacy Fernet formats.
+"""
+
+import json
+import os
+
+import pytest
+
+import container
+
+FAST_KDF = {'algorithm': 'pbkdf2-sha256', 'iterations': 1000}
+
+
+@pytest.fixture(scope='module')
+def key():
+    return container.derive_key('secret', b'0' * 16, FAST_KDF)
+
+
+def test_token_round_trip_compresses(key):
+    plaintext = json.dumps([{'id': i, 'domain': 'https://example.com'} for i in range(50)]).encode()
+    token = container.encrypt(key, plaintext)
+    assert token.startswith(container.TOKEN_MAGIC)
+    assert token[4] == container.CODECS['zlib']
+    assert len(token) < len(plaintext)
+    assert container.decrypt(key, token) == plaintext
+
+
+def test_incompressible_payload_is_stored(key):
+    plaintext = os.urandom(64)
+    token = container.encrypt(key, plaintext)
+    assert token[4] == container.CODECS['none']
+    assert container.decrypt(key, token) == plaintext
+
+
+def test_tampered_header_is_rejected(key):
+    from cryptography.exceptions import InvalidTag
+    token = bytearray(container.encrypt(key, b'{"id": 1}' * 20))
+    token[4] = container.CODECS['none'] if token[4] == container.CODECS['zlib'] else container.CODECS['zlib']
+    with pytest.raises(InvalidTag):
+        container.decrypt(key, bytes(token))
+
+
+def test_legacy_fernet_token_still_decrypts(key):
+    from cryptography.fernet import Fernet
+    token = Fernet(key).encrypt(b'[{"id": 1}]')
+    assert container.is_legacy_token(token)
+    assert container.decrypt(key, token) == b'[{"id": 1}]'
+
+
+def test_file_container_round_trip():
+    salt = os.urandom(16)
+    derived = []
+
+    def get_key(salt, kdf):
+        derived.append(kdf)
+        return container.derive_key('secret', salt, kdf)
+
+    blob = container.pack_file(get_key(salt, FAST_KDF), salt, FAST_KDF, b'[1, 2, 3]')
+    assert blob.startswith(container.FILE_MAGIC)
+    assert container.read_file_header(blob)[:2] == (salt, FAST_KDF)
+    assert container.unpack_file(blob, get_key) == b'[1, 2, 3]'
+    assert derived == [FAST_KDF, FAST_KDF]
+
+
+def test_legacy_enc_file_reads_with_legacy_kdf():
+    from cryptography.fernet import Fernet
+    salt = os.urandom(16)
+    legacy_key = container.derive_key('secret', salt, container.LEGACY_KDF)
+    blob = salt + Fernet(legacy_key).encrypt(b'[{"id": "old"}]')
+
+    seen = []
+
+    def get_key(salt, kdf):
+        seen.append(kdf)
+        return container.derive_key('secret', salt, kdf)
+
+    assert container.unpack_file(blob, get_key) == b'[{"id": "old"}]'
+    assert seen == [container.LEGACY_KDF]
+
+
+def test_kdf_settings():
+    assert container.kdf_from_settings('scrypt', scrypt_n=1024) == {'algorithm': 'scrypt', 'n': 1024, 'r': 8, 'p': 1}
+    with pytest.raises(ValueError):
+        container.kdf_from_settings('md5')
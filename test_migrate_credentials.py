@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Tests for migrate_credentials.py batch mode: file and database users, and
+resuming an interrupted run from its journal.
+"""
+
+import json
+import os
+
+import pytest
+
+import container
+import migrate_credentials as migrate
+from record_store import RecordStore
+from sqlite_storage import SQLiteDatabase, SQLiteRecordStore
+
+FAST_KDF = {'algorithm': 'pbkdf2-sha256', 'iterations': 1000}
+WEBSITES = [{'id': 1, 'name': 'one'}, {'id': 2, 'name': 'two'}]
+
+
+@pytest.fixture(autouse=True)
+def fast_kdf(monkeypatch):
+    monkeypatch.setattr(migrate, 'KDF', FAST_KDF)
+
+
+def key_for(username):
+    return lambda salt, kdf: container.derive_key(username, salt, kdf)
+
+
+def write_enc(data_dir, username, websites):
+    salt = os.urandom(16)
+    key = container.derive_key(username, salt, FAST_KDF)
+    path, _ = migrate.user_paths(str(data_dir), username)
+    with open(path, 'wb') as f:
+        f.write(container.pack_file(key, salt, FAST_KDF, json.dumps(websites).encode()))
+
+
+def mappings(*pairs):
+    return [(f'{old}:0000', f'{new}:1111') for old, new in pairs]
+
+
+def test_file_users_are_migrated(tmp_path):
+    write_enc(tmp_path, 'alice:0000', WEBSITES)
+    jobs, problems = migrate.plan_jobs(str(tmp_path), mappings(('alice', 'alice2'), ('nobody', 'x')))
+    assert [reason for _, reason in problems] == ['no data for the old credentials']
+
+    summary = migrate.run_batch(jobs, str(tmp_path / 'journal'), workers=1)
+    assert summary['done'] == 1 and summary['failed'] == 0
+
+    new_file, _ = migrate.user_paths(str(tmp_path), 'alice2:1111')
+    store = RecordStore(str(tmp_path / 'new.d'), key_for('alice2:1111'), legacy_file=new_file)
+    assert store.load() == WEBSITES
+
+
+def test_interrupted_run_resumes_from_journal(tmp_path):
+    for name in ('alice', 'bob', 'carol'):
+        write_enc(tmp_path, f'{name}:0000', WEBSITES)
+    journal = str(tmp_path / 'journal')
+    pairs = mappings(('alice', 'alice2'), ('bob', 'bob2'), ('carol', 'carol2'))
+
+    # First run got through alice only, then died mid-write of the next journal line
+    jobs, _ = migrate.plan_jobs(str(tmp_path), pairs)
+    migrate.migrate_one(jobs[0], journal)
+    with open(journal, 'a') as f:
+        f.write('{"id": "torn')
+
+    completed = migrate.read_journal(journal)
+    jobs, problems = migrate.plan_jobs(str(tmp_path), pairs, completed=completed)
+    assert problems == []  # alice2's file exists, but the journal says that job is done
+    summary = migrate.run_batch(jobs, journal, workers=2)
+    assert (summary['skipped'], summary['done'], summary['failed']) == (1, 2, 0)
+    assert migrate.read_journal(journal) == {job['id'] for job in jobs}
+
+
+def test_wrong_credentials_fail_without_output(tmp_path):
+    write_enc(tmp_path, 'alice:0000', WEBSITES)
+    jobs, _ = migrate.plan_jobs(str(tmp_path), mappings(('alice', 'alice2')))
+    jobs[0]['old'] = 'alice:9999'  # Same file, wrong key
+    summary = migrate.run_batch(jobs, str(tmp_path / 'journal'), workers=1)
+    assert summary['failed'] == 1
+    assert list(summary['errors'].values()) == ['wrong old credentials or corrupt data']
+    assert not os.path.exists(migrate.user_paths(str(tmp_path), 'alice2:1111')[0])
+
+
+def test_database_users_are_migrated_within_the_database(tmp_path):
+    db = SQLiteDatabase(str(tmp_path / migrate.DB_NAME))
+    old = SQLiteRecordStore(db, migrate.user_owner('alice:0000'), key_for('alice:0000'), kdf=FAST_KDF)
+    old.replace_all(WEBSITES)
+
+    jobs, problems = migrate.plan_jobs(str(tmp_path), mappings(('alice', 'alice2')))
+    assert problems == []
+    assert jobs[0]['db']
+    summary = migrate.run_batch(jobs, str(tmp_path / 'journal'), workers=1)
+    assert summary['done'] == 1, summary
+
+    new = SQLiteRecordStore(db, migrate.user_owner('alice2:1111'), key_for('alice2:1111'))
+    assert new.load() == WEBSITES
+    assert old.load() == WEBSITES  # Old data is left in place
+    assert not os.path.exists(migrate.user_paths(str(tmp_path), 'alice2:1111')[0])
+
+    # Running it again finds the new user's data already there
+    jobs, problems = migrate.plan_jobs(str(tmp_path), mappings(('alice', 'alice2')))
+    assert jobs == [] and 'already have data' in problems[0][1]
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Tests for the per-website record store: round-trips, KDF re-keying and
+recovery from a crash part-way through a write.
+"""
+
+import os
+
+import pytest
+
+import container
+from record_store import RecordStore
+
+FAST_KDF = {'algorithm': 'pbkdf2-sha256', 'iterations': 1000}
+OTHER_KDF = {'algorithm': 'pbkdf2-sha256', 'iterations': 2000}
+
+WEBSITES = [{'id': i, 'name': f'site {i}', 'domain': f'https://s{i}.example'} for i in range(5)]
+
+
+def get_key(salt, kdf):
+    return container.derive_key('secret', salt, kdf)
+
+
+def make_store(tmp_path, kdf=FAST_KDF):
+    return RecordStore(str(tmp_path / 'user.d'), get_key, kdf=kdf)
+
+
+def test_round_trip(tmp_path):
+    store = make_store(tmp_path)
+    result = store.replace_all(WEBSITES)
+    assert result == {'written': 5, 'unchanged': 0, 'deleted': 0}
+    assert make_store(tmp_path).load() == WEBSITES
+
+
+def test_unchanged_records_are_not_rewritten(tmp_path):
+    store = make_store(tmp_path)
+    store.replace_all(WEBSITES)
+    changed = [dict(w) for w in WEBSITES]
+    changed[2]['name'] = 'renamed'
+    result = store.replace_all(changed[:4])
+    assert result == {'written': 1, 'unchanged': 3, 'deleted': 1}
+    assert store.load() == changed[:4]
+
+
+def test_rekey_on_kdf_change(tmp_path):
+    make_store(tmp_path).replace_all(WEBSITES)
+
+    store = make_store(tmp_path, kdf=OTHER_KDF)
+    store.update(1, {'name': 'renamed'})
+
+    index = store._read_index()
+    assert index['kdf'] == OTHER_KDF
+    expected = [dict(w) for w in WEBSITES]
+    expected[1]['name'] = 'renamed'
+    assert make_store(tmp_path, kdf=OTHER_KDF).load() == expected
+    # The old record files are gone once the new index is in place
+    files = {name[:-4] for name in os.listdir(store.directory) if name.endswith('.rec')}
+    assert files == {entry['file'] for entry in index['records']}
+
+
+def test_crash_during_rekey_keeps_old_data_readable(tmp_path, monkeypatch):
+    make_store(tmp_path).replace_all(WEBSITES)
+
+    store = make_store(tmp_path, kdf=OTHER_KDF)
+
+    def crash(index):
+        raise OSError('simulated crash before the index is written')
+
+    monkeypatch.setattr(store, '_write_index', crash)
+    with pytest.raises(OSError):
+        store.replace_all(WEBSITES)
+
+    # The old index and its records are untouched
+    assert make_store(tmp_path).load() == WEBSITES
+    # And the next write completes the re-key
+    store = make_store(tmp_path, kdf=OTHER_KDF)
+    store.replace_all(WEBSITES)
+    assert store.load() == WEBSITES
+    assert store._read_index()['kdf'] == OTHER_KDF
+
+
+def test_crash_before_index_keeps_removed_records(tmp_path, monkeypatch):
+    store = make_store(tmp_path)
+    store.replace_all(WEBSITES)
+
+    monkeypatch.setattr(store, '_write_index', lambda index: (_ for _ in ()).throw(OSError('crash')))
+    with pytest.raises(OSError):
+        store.replace_all(WEBSITES[:2])
+
+    assert make_store(tmp_path).load() == WEBSITES
+
+
+def test_ids_that_print_alike_get_separate_records(tmp_path):
+    store = make_store(tmp_path)
+    websites = [{'id': 1, 'name': 'int'}, {'id': '1', 'name': 'str'}]
+    store.replace_all(websites)
+    assert make_store(tmp_path).load() == websites
+
+
+def test_duplicate_ids_are_rejected(tmp_path):
+    store = make_store(tmp_path)
+    store.replace_all(WEBSITES)
+    with pytest.raises(ValueError):
+        store.replace_all(WEBSITES + [{'id': 3, 'name': 'again'}])
+    assert store.load() == WEBSITES
+
+
+def test_update_and_add_single_records(tmp_path):
+    store = make_store(tmp_path)
+    store.replace_all(WEBSITES)
+
+    assert store.update(99, {'name': 'missing'}) is None
+    assert store.add(1, {'name': 'taken'}) is None
+    assert store.add(99, {'name': 'new'}) == {'id': 99, 'name': 'new'}
+    assert store.update(99, {'domain': 'https://new.example'}) == {
+        'id': 99, 'name': 'new', 'domain': 'https://new.example'
+    }
+    assert make_store(tmp_path).load() == WEBSITES + [{'id': 99, 'name': 'new', 'domain': 'https://new.example'}]
+
+
+def test_legacy_enc_is_imported(tmp_path):
+    salt = os.urandom(16)
+    key = container.derive_key('secret', salt, container.LEGACY_KDF)
+    from cryptography.fernet import Fernet
+    legacy = tmp_path / 'user.enc'
+    legacy.write_bytes(salt + Fernet(key).encrypt(b'[{"id": 1, "name": "old"}]'))
+
+    store = RecordStore(str(tmp_path / 'user.d'), get_key, legacy_file=str(legacy), kdf=FAST_KDF)
+    assert store.load() == [{'id': 1, 'name': 'old'}]
+    assert (tmp_path / 'user.enc.backup').exists()
+    assert not legacy.exists()
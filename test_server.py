@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""
+Tests for the server's /api/data endpoints (run against a throwaway DATA_DIR).
+"""
+
+import os
+import tempfile
+import time
+
+os.environ['RAILWAY_VOLUME_MOUNT_PATH'] = tempfile.mkdtemp(prefix='dashboard-test-')
+os.environ.setdefault('STARTUP_WARMUP', '0')
+os.environ.setdefault('LOG_LEVEL', 'error')
+
+import pytest
+
+import server
+from record_store import RecordStore
+
+WEBSITES = [{'id': i, 'name': f'site {i}'} for i in range(3)]
+
+
+@pytest.fixture
+def client():
+    return server.app.test_client()
+
+
+USERNAME = f'{server.DEFAULT_PASSWORD}:{server.DEFAULT_OTP}'
+
+
+def login(client):
+    response = client.post('/api/login', json={'password': server.DEFAULT_PASSWORD, 'otp': server.DEFAULT_OTP})
+    assert response.status_code == 200
+    return {'Authorization': f"Bearer {response.json['token']}"}
+
+
+def sign_out_everyone():
+    for token, _ in server.session_store.items():
+        server.session_store.delete(token)
+
+
+def has_cached_key(username):
+    return any(k[0] == username for k in server._key_cache)
+
+
+@pytest.fixture
+def auth(client):
+    headers = login(client)
+    assert client.post('/api/data', json={'data': WEBSITES}, headers=headers).status_code == 200
+    return headers
+
+
+def test_get_data_sets_etag(client, auth):
+    response = client.get('/api/data', headers=auth)
+    assert response.status_code == 200
+    assert response.json['data'] == WEBSITES
+    assert response.headers['ETag']
+    assert response.headers['Cache-Control'] == 'private, no-cache'
+
+
+def test_matching_etag_returns_304(client, auth):
+    etag = client.get('/api/data', headers=auth).headers['ETag']
+    response = client.get('/api/data', headers={**auth, 'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.data == b''
+    assert response.headers['ETag'] == etag
+
+
+def test_stale_etag_returns_data(client, auth):
+    etag = client.get('/api/data', headers=auth).headers['ETag']
+    changed = [dict(w) for w in WEBSITES]
+    changed[0]['name'] = 'renamed'
+    client.post('/api/data', json={'data': changed}, headers=auth)
+
+    response = client.get('/api/data', headers={**auth, 'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.json['data'] == changed
+    assert response.headers['ETag'] != etag
+
+
+def test_304_on_cold_cache_does_not_decrypt(client, auth, monkeypatch):
+    etag = client.get('/api/data', headers=auth).headers['ETag']
+
+    # As after a restart or in another worker: nothing cached
+    server._data_cache.clear()
+    server._key_cache.clear()
+
+    def fail(*args, **kwargs):
+        raise AssertionError('revalidation should not derive keys or decrypt')
+
+    monkeypatch.setattr(RecordStore, 'snapshot', fail)
+    monkeypatch.setattr(server, 'derive_key', fail)
+    response = client.get('/api/data', headers={**auth, 'If-None-Match': etag})
+    assert response.status_code == 304
+
+
+def test_compressed_response_keeps_304_working(client, auth):
+    many = [{'id': i, 'name': f'site {i}', 'domain': f'https://s{i}.example'} for i in range(100)]
+    client.post('/api/data', json={'data': many}, headers=auth)
+
+    response = client.get('/api/data', headers={**auth, 'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.headers['ETag'].startswith('W/')
+    response = client.get('/api/data', headers={**auth, 'Accept-Encoding': 'gzip',
+                                                'If-None-Match': response.headers['ETag']})
+    assert response.status_code == 304
+
+
+def test_unexpected_upstream_error_counts_as_failure(monkeypatch):
+    domain = 'https://broken.example'
+
+    def fail(*args, **kwargs):
+        raise ValueError('malformed response')
+
+    monkeypatch.setattr(server.upstream_pool, 'get', fail)
+    for _ in range(server.site_health.failure_threshold):
+        result = server.fetch_site_stats_uncoalesced(domain, 'key')
+        assert result == {'error': 'malformed response', 'isOnline': False}
+
+    assert server.site_health.last_error(domain) == 'malformed response'
+    allowed, _, _ = server.site_health.acquire(domain)
+    assert not allowed
+
+
+def test_stream_requires_a_ticket_not_the_token(client, auth):
+    token = auth['Authorization'].split(' ', 1)[1]
+    assert client.get(f'/api/stats/stream?token={token}').status_code == 401
+
+    assert client.post('/api/stats/stream-ticket').status_code == 401
+    ticket = client.post('/api/stats/stream-ticket', headers=auth).json['ticket']
+    response = client.get(f'/api/stats/stream?ticket={ticket}')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/event-stream'
+    response.close()
+
+    # Single use
+    assert client.get(f'/api/stats/stream?ticket={ticket}').status_code == 401
+
+
+def test_single_website_add_update_and_missing(client, auth):
+    website = {'name': 'new', 'domain': 'https://new.example'}
+    response = client.patch('/api/data/new-id', json={'website': website}, headers=auth)
+    assert response.status_code == 404
+
+    response = client.post('/api/data/new-id', json={'website': website}, headers=auth)
+    assert response.status_code == 200
+    assert response.json['website'] == {**website, 'id': 'new-id'}
+    assert client.post('/api/data/new-id', json={'website': website}, headers=auth).status_code == 409
+
+    response = client.patch('/api/data/new-id', json={'website': {'name': 'renamed'}}, headers=auth)
+    assert response.json['website']['name'] == 'renamed'
+    assert client.get('/api/data', headers=auth).json['data'][-1]['name'] == 'renamed'
+
+
+def test_save_rejects_duplicate_ids(client, auth):
+    response = client.post('/api/data', json={'data': WEBSITES + WEBSITES[:1]}, headers=auth)
+    assert response.status_code == 400
+    assert client.get('/api/data', headers=auth).json['data'] == WEBSITES
+
+
+def test_expired_session_keeps_state_for_the_users_other_session(client):
+    sign_out_everyone()
+    live = login(client)
+    client.post('/api/data', json={'data': WEBSITES}, headers=live)
+    client.get('/api/data', headers=live)
+    server.session_store.create('stale-tab', USERNAME, -1)  # Already past its expiry
+
+    assert server.session_store.sweep() == 1
+    assert USERNAME in server._data_cache
+    assert has_cached_key(USERNAME)
+    assert server.stats_poller.has_user(USERNAME)
+
+
+def test_last_expired_session_drops_cached_keys_and_data(client, auth):
+    client.get('/api/data', headers=auth)
+    assert USERNAME in server._data_cache
+    assert has_cached_key(USERNAME)
+
+    later = time.time() + server.SESSION_DURATION + 1
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setattr(time, 'time', lambda: later)
+        assert server.session_store.sweep() >= 1
+
+    assert USERNAME not in server._data_cache
+    assert not has_cached_key(USERNAME)
+    assert not server.stats_poller.has_user(USERNAME)
+
+
+def test_upstream_metrics_have_no_domain_label_and_health_has_detail(client, auth, monkeypatch):
+    def fail(*args, **kwargs):
+        raise ValueError('bad body')
+
+    monkeypatch.setattr(server.upstream_pool, 'get', fail)
+    server.fetch_site_stats_uncoalesced('https://metrics.example', 'key')
+
+    body = client.get('/metrics', headers=auth).get_data(as_text=True)
+    upstream = [line for line in body.splitlines() if line.startswith('dashboard_upstream')]
+    assert upstream and not any('metrics.example' in line for line in upstream)
+
+    assert client.get('/health').json['upstream_domains'] is None
+    detail = client.get('/health', headers=auth).json['upstream_domains']['https://metrics.example']
+    assert detail['failures'] == 1
+    assert detail['last_error'] == 'bad body'
+
+
+def test_login_attempts_limit_is_validated(client, auth):
+    for limit in ('0', '-5', 'ten'):
+        response = client.get(f'/api/login-attempts?limit={limit}', headers=auth)
+        assert response.status_code == 400
+    response = client.get('/api/login-attempts?limit=1', headers=auth)
+    assert response.status_code == 200
+    assert len(response.json['attempts']) == 1
+    response = client.get(f'/api/login-attempts?limit={server.AUDIT_QUERY_MAX_LIMIT * 10}', headers=auth)
+    assert response.status_code == 200
+
+
+def test_logout_keeps_the_key_while_another_tab_is_signed_in(client):
+    sign_out_everyone()
+    first, second = login(client), login(client)
+    client.post('/api/data', json={'data': WEBSITES}, headers=first)
+    client.get('/api/data', headers=first)
+    assert has_cached_key(USERNAME)
+
+    client.post('/api/logout', headers=first)
+    assert has_cached_key(USERNAME)
+    assert client.get('/api/data', headers=second).status_code == 200
+
+    client.post('/api/logout', headers=second)
+    assert not has_cached_key(USERNAME)
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Tests for single-use stream tickets in both session store backends.
+"""
+
+import threading
+import time
+
+import pytest
+
+from session_store import SessionStore
+from sqlite_storage import SQLiteDatabase, SQLiteSessionStore
+
+
+@pytest.fixture(params=['file', 'sqlite'])
+def store(request, tmp_path):
+    if request.param == 'sqlite':
+        store = SQLiteSessionStore(SQLiteDatabase(str(tmp_path / 'dashboard.db')))
+    else:
+        store = SessionStore(str(tmp_path / 'sessions.json'), str(tmp_path / 'sessions.journal'))
+    store.load()
+    store.create('token', 'user', 60)
+    return store
+
+
+def test_ticket_redeems_once(store):
+    ticket = store.issue_ticket('token', 30)
+    assert ticket != 'token'
+    assert store.redeem_ticket(ticket) == 'token'
+    assert store.redeem_ticket(ticket) is None
+
+
+def test_unknown_and_expired_tickets(store, monkeypatch):
+    assert store.redeem_ticket('nope') is None
+    ticket = store.issue_ticket('token', 30)
+    later = time.time() + 31
+    monkeypatch.setattr(time, 'time', lambda: later)
+    assert store.redeem_ticket(ticket) is None
+
+
+def test_sweep_drops_expired_tickets(store, monkeypatch):
+    store.issue_ticket('token', 30)
+    later = time.time() + 31
+    monkeypatch.setattr(time, 'time', lambda: later)
+    store.sweep()
+    if isinstance(store, SQLiteSessionStore):
+        assert store.db.execute('SELECT COUNT(*) FROM stream_tickets').fetchone()[0] == 0
+    else:
+        assert store._tickets == {}
+
+
+def test_sweeper_failures_go_to_on_error(store, monkeypatch):
+    errors = []
+    failed = threading.Event()
+
+    def fail(*args, **kwargs):
+        raise OSError('disk full')
+
+    def on_error(e):
+        errors.append(e)
+        failed.set()
+
+    monkeypatch.setattr(store, 'sweep', fail)
+    store.sweep_interval = 0.01
+    store.start_sweeper(on_error=on_error)
+    assert failed.wait(2)
+    assert str(errors[0]) == 'disk full'
+
+
+def test_has_sessions_counts_each_users_sessions(store):
+    store.create('second', 'user', 60)
+    store.create('other', 'someone else', 60)
+    store.delete('token')
+    assert store.has_sessions('user')
+    store.delete('second')
+    assert not store.has_sessions('user')
+    assert store.has_sessions('someone else')
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Tests for the state gunicorn workers share through SQLite: cached upstream
+stats and fetch claims, circuit breakers, metrics totals and record stores.
+Each "worker" is a separate object on the same database file.
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import container
+import metrics
+from site_health import CLOSED, OPEN
+from sqlite_storage import (
+    SQLiteDatabase, SQLiteStatsCache, SQLiteSiteHealth, SQLiteMetricsShare, SQLiteRecordStore, SQLiteSessionStore
+)
+
+
+def make_cache(path, calls):
+    def fetch(domain, api_key):
+        calls.append(domain)
+        return {'data': {'n': len(calls)}, 'isOnline': True}
+    return SQLiteStatsCache(SQLiteDatabase(path), fetch, ThreadPoolExecutor(max_workers=2), ttl=60)
+
+
+def test_workers_share_cached_stats(tmp_path):
+    path = str(tmp_path / 'dashboard.db')
+    calls = []
+    first, second = make_cache(path, calls), make_cache(path, calls)
+
+    assert first.get('https://a.example', 'key')['cacheStatus'] == 'miss'
+    result = second.get('https://a.example', 'key')
+    assert result['cacheStatus'] == 'hit'
+    assert result['data'] == {'n': 1}
+    assert calls == ['https://a.example']
+
+
+def test_only_one_worker_claims_a_poll(tmp_path):
+    path = str(tmp_path / 'dashboard.db')
+    calls = []
+    first, second = make_cache(path, calls), make_cache(path, calls)
+
+    assert first.claim_poll('https://a.example', 'key', recent=100)
+    assert not second.claim_poll('https://a.example', 'key', recent=100)  # First is fetching
+
+    first.put('https://a.example', 'key', {'isOnline': True})
+    assert not second.claim_poll('https://a.example', 'key', recent=100)  # Fetched just now
+    assert second.latest('https://a.example', 'key')[0] == {'isOnline': True}
+    assert second.claim_poll('https://a.example', 'key', recent=0)
+
+
+def test_circuit_opened_by_one_worker_rejects_in_another(tmp_path):
+    path = str(tmp_path / 'dashboard.db')
+    first = SQLiteSiteHealth(SQLiteDatabase(path), failure_threshold=2, cooldown=30)
+    second = SQLiteSiteHealth(SQLiteDatabase(path), failure_threshold=2, cooldown=30)
+
+    first.record_failure('https://a.example', 'Request timeout')
+    second.record_failure('https://a.example', 'Request timeout')
+
+    allowed, _, retry_in = first.acquire('https://a.example')
+    assert not allowed and retry_in > 0
+    assert second.last_error('https://a.example') == 'Request timeout'
+    assert second.stats()[OPEN] == 1
+
+    second.record_success('https://a.example', 0.1)
+    assert first.acquire('https://a.example')[0]
+    # first still holds the open state it last loaded; domains() reports the shared one
+    assert first.domains()['https://a.example']['state'] == CLOSED
+    assert second.domains()['https://a.example']['samples'] == 1
+
+
+def test_metrics_add_up_other_workers(tmp_path):
+    db = SQLiteDatabase(str(tmp_path / 'dashboard.db'))
+    counter = metrics.Counter('test_shared_total', 'Test counter', labels=('route',))
+    counter.inc(2, route='/a')
+
+    share = SQLiteMetricsShare(db, 'generation-1')
+    share.publish()
+    share.worker = 'other'  # Read it back as another worker would
+    rendered = metrics.render(share.others())
+    assert 'test_shared_total{route="/a"} 4' in rendered
+
+
+def test_record_snapshot_does_not_block_other_writers(tmp_path):
+    path = str(tmp_path / 'dashboard.db')
+    kdf = {'algorithm': 'pbkdf2-sha256', 'iterations': 1000}
+    reading, release = threading.Event(), threading.Event()
+
+    def slow_key(salt, kdf):
+        reading.set()  # Stands in for a slow PBKDF2/scrypt derivation
+        assert release.wait(5)
+        return container.derive_key('secret', salt, kdf)
+
+    def get_key(salt, kdf):
+        return container.derive_key('secret', salt, kdf)
+
+    websites = [{'id': i, 'name': f'site {i}'} for i in range(3)]
+    SQLiteRecordStore(SQLiteDatabase(path), 'user', get_key, kdf=kdf).replace_all(websites)
+
+    reader = SQLiteRecordStore(SQLiteDatabase(path), 'user', slow_key, kdf=kdf)
+    result = []
+    thread = threading.Thread(target=lambda: result.append(reader.snapshot()))
+    thread.start()
+    try:
+        assert reading.wait(5)
+        # Another worker's write must not wait for the reader (busy timeout 0.2s)
+        sessions = SQLiteSessionStore(SQLiteDatabase(path, busy_timeout=0.2))
+        sessions.create('token', 'someone', 60)
+        assert sessions.get_username('token') == 'someone'
+    finally:
+        release.set()
+        thread.join()
+    assert result[0][2] == websites
+
+
+def test_writes_proceed_while_a_read_transaction_is_open(tmp_path):
+    path = str(tmp_path / 'dashboard.db')
+    reader = SQLiteDatabase(path)
+    with reader.read() as db:
+        assert db.execute('SELECT COUNT(*) FROM sessions').fetchone()[0] == 0
+        sessions = SQLiteSessionStore(SQLiteDatabase(path, busy_timeout=0.2))
+        sessions.create('token', 'someone', 60)
+        # The read transaction keeps its snapshot
+        assert db.execute('SELECT COUNT(*) FROM sessions').fetchone()[0] == 0
+    assert reader.execute('SELECT COUNT(*) FROM sessions').fetchone()[0] == 1
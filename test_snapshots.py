@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Tests for snapshot create/restore of a data directory.
+"""
+
+import os
+import sqlite3
+
+import pytest
+
+from snapshots import RestoreRefused, SnapshotStore, hold_server_lock
+
+
+def make_data(path):
+    (path / 'user.d').mkdir(parents=True)
+    (path / 'user.d' / 'index.json').write_text('{"records": []}')
+    (path / 'audit.log').write_bytes(os.urandom(600 * 1024))
+    db = sqlite3.connect(str(path / 'dashboard.db'))
+    db.execute('PRAGMA journal_mode=WAL')
+    db.execute('CREATE TABLE t (v TEXT)')
+    db.execute("INSERT INTO t VALUES ('before')")
+    db.commit()
+    return db
+
+
+def rows(path):
+    db = sqlite3.connect(str(path))
+    try:
+        return [row[0] for row in db.execute('SELECT v FROM t')]
+    finally:
+        db.close()
+
+
+def test_create_and_restore_round_trip(tmp_path):
+    data = tmp_path / 'data'
+    make_data(data).close()
+    store = SnapshotStore(str(tmp_path / 'backups'))
+    store.create(str(data))
+
+    target = tmp_path / 'restored'
+    result = store.restore('latest', str(target))
+    assert result['files'] == 3
+    assert result['extra'] == []
+    assert (target / 'user.d' / 'index.json').read_text() == '{"records": []}'
+    assert (target / 'audit.log').read_bytes() == (data / 'audit.log').read_bytes()
+    assert rows(target / 'dashboard.db') == ['before']
+
+
+def test_second_snapshot_reuses_unchanged_files(tmp_path):
+    data = tmp_path / 'data'
+    make_data(data).close()
+    store = SnapshotStore(str(tmp_path / 'backups'))
+    store.create(str(data))
+    with open(data / 'audit.log', 'ab') as f:
+        f.write(b'one more line\n')
+
+    summary = store.create(str(data))
+    assert summary['files_reused'] == 2
+    assert summary['files_read'] == 1
+    assert store.diff(store.ids()[0], 'latest')['modified'] == ['audit.log']
+
+
+def test_restore_removes_stale_wal_and_reports_extra_files(tmp_path):
+    data = tmp_path / 'data'
+    db = make_data(data)
+    store = SnapshotStore(str(tmp_path / 'backups'))
+    store.create(str(data))
+
+    # Changes after the snapshot, still only in the WAL
+    db.execute('PRAGMA wal_autocheckpoint=0')
+    db.execute("INSERT INTO t VALUES ('after')")
+    db.commit()
+    (data / 'user.d' / 'new.rec').write_text('not in the snapshot')
+    assert os.path.exists(data / 'dashboard.db-wal')
+
+    result = store.restore('latest', str(data))
+    db.close()
+    assert 'dashboard.db-wal' in result['journals_removed']
+    assert result['extra'] == [os.path.join('user.d', 'new.rec')]
+    assert (data / 'user.d' / 'new.rec').exists()
+    assert rows(data / 'dashboard.db') == ['before']
+
+    result = store.restore('latest', str(data), delete_extra=True)
+    assert not (data / 'user.d' / 'new.rec').exists()
+
+
+def test_path_restore_only_reports_extra_files_under_the_path(tmp_path):
+    data = tmp_path / 'data'
+    make_data(data).close()
+    store = SnapshotStore(str(tmp_path / 'backups'))
+    store.create(str(data))
+    (data / 'other.txt').write_text('outside the restored path')
+    (data / 'user.d' / 'new.rec').write_text('inside')
+
+    result = store.restore('latest', str(data), paths=['user.d'], delete_extra=True)
+    assert result['files'] == 1
+    assert result['extra'] == [os.path.join('user.d', 'new.rec')]
+    assert (data / 'other.txt').exists()
+
+
+def test_restore_refused_while_server_holds_the_directory(tmp_path):
+    data = tmp_path / 'data'
+    make_data(data).close()
+    store = SnapshotStore(str(tmp_path / 'backups'))
+    store.create(str(data))
+
+    server_lock = hold_server_lock(str(data))
+    try:
+        with pytest.raises(RestoreRefused):
+            store.restore('latest', str(data))
+    finally:
+        server_lock.close()
+    store.restore('latest', str(data))
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Tests for the background stats poller's scheduling and failure handling.
+"""
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from stats_poller import StatsPoller
+
+SITES = [{'id': 1, 'domain': 'https://a.example', 'apiKey': 'key-a'}]
+
+
+def wait_until(predicate, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_failing_callback_does_not_stop_polling():
+    calls = []
+    errors = []
+
+    def on_result(domain, api_key, result):
+        calls.append(domain)
+        raise RuntimeError('history disk full')
+
+    poller = StatsPoller(
+        lambda domain, api_key: {'data': {'n': len(calls)}, 'isOnline': True},
+        ThreadPoolExecutor(max_workers=2),
+        on_result=on_result,
+        interval=0.05,
+        jitter=0,
+        on_error=lambda domain, e: errors.append((domain, str(e)))
+    )
+    poller.set_sites('alice', SITES)
+    poller.start()
+
+    assert wait_until(lambda: len(calls) >= 3)
+    assert errors[0] == ('https://a.example', 'history disk full')
+    assert poller.stats()['errors'] >= 3
+    # The result itself still reaches subscribers
+    events, _ = poller.changes_since('alice', 0)
+    assert events and events[0][1]['isOnline']
+
+
+def test_changes_since_reports_only_changed_sites():
+    value = {'n': 1}
+    poller = StatsPoller(
+        lambda domain, api_key: {'data': dict(value), 'isOnline': True},
+        ThreadPoolExecutor(max_workers=2),
+        interval=0.05,
+        jitter=0
+    )
+    poller.set_sites('alice', SITES)
+    poller.start()
+
+    assert wait_until(lambda: poller.changes_since('alice', 0)[0])
+    _, cursor = poller.changes_since('alice', 0)
+    time.sleep(0.2)
+    assert poller.changes_since('alice', cursor)[0] == []  # Polled again, nothing changed
+
+    value['n'] = 2
+    assert poller.wait_for_change(cursor, timeout=2)
+    events, _ = poller.changes_since('alice', cursor)
+    assert events[0][1]['data'] == {'n': 2}
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Tests for the per-origin upstream session pool.
+"""
+
+import threading
+
+from upstream_pool import UpstreamSessionPool
+
+
+class StubbedPool(UpstreamSessionPool):
+    """Sessions answer without touching the network; requests to a 'slow' URL wait for `release`"""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.release = threading.Event()
+        self.started = threading.Event()
+        self.closed = []
+
+    def _new_session(self):
+        session = super()._new_session()
+
+        def request(method, url, **kwargs):
+            if 'slow' in url:
+                self.started.set()
+                assert self.release.wait(5)
+            assert session not in self.closed, 'request ran on a closed session'
+            return url
+
+        def close():
+            self.closed.append(session)
+
+        session.request = request
+        session.close = close
+        return session
+
+
+def start_slow_request(pool, url):
+    thread = threading.Thread(target=pool.get, args=(url,))
+    thread.start()
+    assert pool.started.wait(5)
+    return thread
+
+
+def test_session_evicted_mid_request_closes_after_it_finishes():
+    pool = StubbedPool(max_origins=1)
+    thread = start_slow_request(pool, 'https://a.example/slow')
+    session = pool._sessions['https://a.example'].session
+
+    pool.get('https://b.example/stats')  # Pushes a.example out of the LRU
+    assert session not in pool.closed
+    assert pool.stats()['deferred_closes'] == 1
+
+    pool.release.set()
+    thread.join(5)
+    assert session in pool.closed
+
+
+def test_idle_eviction_skips_sessions_in_use():
+    pool = StubbedPool(idle_timeout=0)
+    thread = start_slow_request(pool, 'https://a.example/slow')
+    assert pool.evict_idle() == 0
+
+    pool.release.set()
+    thread.join(5)
+    assert pool.evict_idle() == 1
+    assert pool.stats()['origins'] == 0
+
+
+def test_requests_past_the_per_host_limit_are_counted_not_blocked():
+    pool = StubbedPool(max_connections_per_host=1)
+    thread = start_slow_request(pool, 'https://a.example/slow')
+
+    assert pool.get('https://a.example/stats') == 'https://a.example/stats'
+    assert pool.stats()['overflow'] == 1
+
+    pool.release.set()
+    thread.join(5)
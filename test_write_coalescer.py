@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+Tests for the per-key write coalescer.
+"""
+
+import threading
+import time
+
+from write_coalescer import WriteCoalescer
+
+
+def test_burst_is_written_once_with_the_latest_value():
+    writes = []
+    coalescer = WriteCoalescer(lambda key, value: writes.append((key, value)) or len(writes), delay=0.05)
+
+    threads = [threading.Thread(target=coalescer.submit, args=('user', i)) for i in range(5)]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.001)
+    for thread in threads:
+        thread.join()
+
+    assert writes == [('user', 4)]
+    assert coalescer.stats()['coalesced'] == 4
+
+
+def test_write_locks_do_not_outlive_their_writes():
+    coalescer = WriteCoalescer(lambda key, value: value, delay=0)
+    for i in range(100):
+        assert coalescer.submit(f'user-{i}', i) == i
+    coalescer.flush('nothing-pending')
+    assert coalescer.stats()['write_locks'] == 0
+
+
+def test_concurrent_flushes_of_one_key_stay_ordered():
+    started, release = threading.Event(), threading.Event()
+    writes = []
+
+    def write(key, value):
+        if value == 'first':
+            started.set()
+            release.wait(2)
+        writes.append(value)
+
+    coalescer = WriteCoalescer(write, delay=0)
+    first = threading.Thread(target=coalescer.submit, args=('user', 'first'))
+    first.start()
+    assert started.wait(2)
+    second = threading.Thread(target=coalescer.submit, args=('user', 'second'))
+    second.start()
+    time.sleep(0.05)
+    assert writes == []  # Second waits behind the first's write lock
+    release.set()
+    first.join()
+    second.join()
+
+    assert writes == ['first', 'second']
+    assert coalescer.stats()['write_locks'] == 0
@@ -0,0 +1,246 @@
+"""
+Time-Series Store
+Compact on-disk history of per-site stats for charting.
+
+Every (site, metric) pair gets fixed-width binary files under the store root:
+
+    <site_id>/<metric>.raw      ring buffer of the most recent raw points
+    <site_id>/<metric>.minute   rollup buckets (min/max/sum/count)
+    <site_id>/<metric>.hour
+    <site_id>/<metric>.day
+
+Rollup files are ring buffers addressed directly by bucket time
+(slot = bucket_start // bucket_size % capacity), and each slot stores its own
+bucket_start so stale slots from a previous lap are recognised and skipped.
+Capacity is retention / bucket_size, so disk use is fixed per metric and a
+range query reads only the slots it covers (at most two contiguous reads)
+instead of loading the whole history. Writers take an exclusive flock on
+the file, so several server processes can record into the same store.
+"""
+
+import hashlib
+import os
+import struct
+import threading
+import time
+
+from stats_cache import fingerprint
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows; single-process use only
+    fcntl = None
+
+# Numeric fields recorded from an upstream stats payload
+METRICS = (
+    'publishedArticles',
+    'unpublishedArticles',
+    'unusedIdeas',
+    'hoursSinceLastPublished',
+    'unreadMessages',
+    'isOnline'
+)
+
+RESOLUTIONS = (('minute', 60), ('hour', 3600), ('day', 86400))
+
+RAW_HEADER = struct.Struct('<Q')     # total points ever written
+RAW_POINT = struct.Struct('<dd')     # timestamp, value
+BUCKET = struct.Struct('<qdddI')     # bucket start, min, max, sum, count
+
+
+def site_id(domain: str, api_key: str) -> str:
+    """Stable directory name for a site (never contains the API key)"""
+    return hashlib.sha256(f"{domain}|{fingerprint(api_key)}".encode()).hexdigest()[:16]
+
+
+def extract_metrics(result: dict) -> dict:
+    """Pull the recorded metrics out of a proxy result"""
+    values = {'isOnline': 1.0 if result.get('isOnline') else 0.0}
+    data = result.get('data')
+    if isinstance(data, dict):
+        stats = data.get('stats') if isinstance(data.get('stats'), dict) else data
+        for metric in METRICS:
+            value = stats.get(metric)
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                values[metric] = float(value)
+    return values
+
+
+def _open(path):
+    """Open for read-modify-write, holding an exclusive lock until closed"""
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    # O_CREAT without O_TRUNC: never clobber a file another process just created
+    f = os.fdopen(os.open(path, os.O_RDWR | os.O_CREAT, 0o644), 'r+b')
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+    return f
+
+
+class TimeSeriesStore:
+    """Ring-buffer raw points plus minute/hour/day rollups per site and metric"""
+
+    def __init__(self, root, raw_points=2016, retention=None):
+        self.root = root
+        self.raw_points = raw_points
+        # Seconds of history kept at each resolution
+        self.retention = retention or {
+            'minute': 7 * 86400,
+            'hour': 90 * 86400,
+            'day': 5 * 365 * 86400
+        }
+        self.capacity = {
+            name: max(1, self.retention[name] // size) for name, size in RESOLUTIONS
+        }
+        self._lock = threading.Lock()
+
+    def _path(self, site, metric, resolution):
+        return os.path.join(self.root, site, f'{metric}.{resolution}')
+
+    # ------------------------------------------------------------------
+    # Writes
+    # ------------------------------------------------------------------
+
+    def record(self, domain: str, api_key: str, result: dict, timestamp: float = None):
+        """Record one stats result at `timestamp` (default: now)"""
+        timestamp = time.time() if timestamp is None else timestamp
+        site = site_id(domain, api_key)
+
+        with self._lock:
+            for metric, value in extract_metrics(result).items():
+                self._append_raw(self._path(site, metric, 'raw'), timestamp, value)
+                for name, size in RESOLUTIONS:
+                    self._merge_bucket(
+                        self._path(site, metric, name), size, self.capacity[name], timestamp, value
+                    )
+
+    def _append_raw(self, path, timestamp, value):
+        with _open(path) as f:
+            header = f.read(RAW_HEADER.size)
+            written = RAW_HEADER.unpack(header)[0] if len(header) == RAW_HEADER.size else 0
+            slot = written % self.raw_points
+            f.seek(RAW_HEADER.size + slot * RAW_POINT.size)
+            f.write(RAW_POINT.pack(timestamp, value))
+            f.seek(0)
+            f.write(RAW_HEADER.pack(written + 1))
+
+    def _merge_bucket(self, path, size, capacity, timestamp, value):
+        start = int(timestamp // size) * size
+        offset = (start // size) % capacity * BUCKET.size
+
+        with _open(path) as f:
+            f.seek(offset)
+            record = f.read(BUCKET.size)
+            if len(record) == BUCKET.size:
+                bucket_start, low, high, total, count = BUCKET.unpack(record)
+            else:
+                bucket_start = None
+
+            if bucket_start == start and count:
+                record = BUCKET.pack(start, min(low, value), max(high, value), total + value, count + 1)
+            else:
+                record = BUCKET.pack(start, value, value, value, 1)
+
+            f.seek(offset)
+            f.write(record)
+
+    # ------------------------------------------------------------------
+    # Reads
+    # ------------------------------------------------------------------
+
+    def raw(self, domain: str, api_key: str, metric: str, limit: int = None) -> list:
+        """Most recent raw points as [[timestamp, value], ...], oldest first"""
+        path = self._path(site_id(domain, api_key), metric, 'raw')
+        if not os.path.exists(path):
+            return []
+
+        with self._lock, open(path, 'rb') as f:
+            header = f.read(RAW_HEADER.size)
+            if len(header) < RAW_HEADER.size:
+                return []
+            written = RAW_HEADER.unpack(header)[0]
+            body = f.read(self.raw_points * RAW_POINT.size)
+
+        count = min(written, self.raw_points)
+        points = [list(p) for p in RAW_POINT.iter_unpack(body[:count * RAW_POINT.size])]
+        if written > self.raw_points:
+            head = written % self.raw_points
+            points = points[head:] + points[:head]
+        return points[-limit:] if limit else points
+
+    def _read_buckets(self, path, size, capacity, start, end):
+        """Valid (start, min, max, sum, count) buckets in [start, end]"""
+        first = int(start // size) * size
+        last = int(end // size) * size
+        # Anything older than one lap of the ring has already been overwritten
+        first = max(first, last - (capacity - 1) * size)
+        if last < first or not os.path.exists(path):
+            return []
+
+        count = (last - first) // size + 1
+        first_slot = (first // size) % capacity
+        tail = min(count, capacity - first_slot)
+
+        with self._lock, open(path, 'rb') as f:
+            f.seek(first_slot * BUCKET.size)
+            data = f.read(tail * BUCKET.size)
+            data += b'\0' * (tail * BUCKET.size - len(data))
+            if count > tail:
+                f.seek(0)
+                wrapped = f.read((count - tail) * BUCKET.size)
+                data += wrapped + b'\0' * ((count - tail) * BUCKET.size - len(wrapped))
+
+        buckets = []
+        expected = first
+        for bucket in BUCKET.iter_unpack(data):
+            if bucket[0] == expected and bucket[4]:
+                buckets.append(bucket)
+            expected += size
+        return buckets
+
+    def pick_resolution(self, start: float, end: float, max_points: int):
+        """Finest resolution that covers the range within max_points"""
+        now = time.time()
+        for name, size in RESOLUTIONS:
+            in_retention = start >= now - self.retention[name]
+            if in_retention and (end - start) / size <= max_points:
+                return name, size
+        return RESOLUTIONS[-1]
+
+    def query(self, domain: str, api_key: str, metric: str, start: float, end: float,
+              max_points: int = 500, resolution: str = None) -> dict:
+        """Downsampled series as {'resolution', 'step', 'points': [[t, avg, min, max], ...]}"""
+        if resolution:
+            size = dict(RESOLUTIONS)[resolution]
+        else:
+            resolution, size = self.pick_resolution(start, end, max_points)
+
+        path = self._path(site_id(domain, api_key), metric, resolution)
+        buckets = self._read_buckets(path, size, self.capacity[resolution], start, end)
+
+        # Merge neighbouring buckets until the series fits in max_points
+        span = int(end // size) - int(start // size) + 1
+        group = max(1, -(-span // max(max_points, 1)))
+        step = size * group
+
+        points = []
+        current = None
+        for bucket_start, low, high, total, count in buckets:
+            group_start = int(bucket_start // step) * step
+            if current is None or current[0] != group_start:
+                if current:
+                    points.append(current)
+                current = [group_start, low, high, total, count]
+            else:
+                current[1] = min(current[1], low)
+                current[2] = max(current[2], high)
+                current[3] += total
+                current[4] += count
+        if current:
+            points.append(current)
+
+        return {
+            'resolution': resolution,
+            'step': step,
+            'points': [[t, round(total / count, 4), low, high] for t, low, high, total, count in points]
+        }
@@ -0,0 +1,234 @@
+"""
+Upstream Session Pool
+Persistent keep-alive HTTP sessions for the stats proxy, one per upstream origin.
+
+Each origin (scheme://host:port) gets its own requests.Session whose adapter
+keeps up to `max_connections_per_host` sockets open, so repeated stats polls
+of the same site reuse TCP/TLS connections instead of handshaking every time.
+A request beyond that limit never waits for a free socket: it gets a
+throwaway connection and is counted as an overflow. Origins are kept in LRU
+order; the least recently used origin is evicted when `max_origins` is
+exceeded, and origins idle for `idle_timeout` seconds are evicted by
+evict_idle(). An evicted session is closed once its in-flight requests have
+finished, never underneath them.
+
+`requests` is imported when the first session is created; warm() does that
+(and can open connections to known origins) ahead of the first stats call.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import wait
+from urllib.parse import urlsplit
+
+
+def get_origin(url: str) -> str:
+    """Normalize a URL to its origin (scheme://host:port)"""
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}".lower()
+
+
+def _connection_pools(session):
+    """Yield the urllib3 connection pools behind a session's adapters"""
+    # The same adapter is mounted for http:// and https://; visit it once
+    adapters = {id(adapter): adapter for adapter in session.adapters.values()}
+    for adapter in adapters.values():
+        pools = adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is not None:
+                yield pool
+
+
+def _pool_counters(session):
+    """Return (handshakes, requests, open connections) for a session"""
+    handshakes = requests_made = open_connections = 0
+    for pool in _connection_pools(session):
+        handshakes += pool.num_connections
+        requests_made += pool.num_requests
+        if pool.pool is None:
+            continue
+        idle = list(pool.pool.queue)
+        in_use = pool.pool.maxsize - len(idle)
+        open_connections += in_use + sum(
+            1 for conn in idle if conn is not None and getattr(conn, 'sock', None) is not None
+        )
+    return handshakes, requests_made, open_connections
+
+
+class _Origin:
+    def __init__(self, session, now):
+        self.session = session
+        self.last_used = now
+        self.in_flight = 0
+        self.evicted = False  # Close when in_flight drops to zero
+
+
+class UpstreamSessionPool:
+    """LRU pool of keep-alive requests.Session objects keyed by origin"""
+
+    def __init__(self, max_origins=256, max_connections_per_host=4, idle_timeout=300):
+        self.max_origins = max_origins
+        self.max_connections_per_host = max_connections_per_host
+        self.idle_timeout = idle_timeout
+
+        self._sessions = OrderedDict()  # origin -> _Origin, least recently used first
+        self._lock = threading.Lock()
+        self._stats = {'handshakes': 0, 'requests': 0, 'evictions': 0, 'overflow': 0, 'deferred_closes': 0}
+
+    def _new_session(self):
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=self.max_connections_per_host,
+            pool_block=False  # Past the limit, open a throwaway connection rather than wait unboundedly
+        )
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def _close(self, entry):
+        # Keep counters of closed sessions so totals stay monotonic
+        handshakes, requests_made, _ = _pool_counters(entry.session)
+        self._stats['handshakes'] += handshakes
+        self._stats['requests'] += requests_made
+        entry.session.close()
+
+    def _evict(self, entry):
+        """Close a session removed from the pool, or leave that to its last request (caller holds the lock)"""
+        self._stats['evictions'] += 1
+        if entry.in_flight:
+            entry.evicted = True
+            self._stats['deferred_closes'] += 1
+        else:
+            self._close(entry)
+
+    def _checkout(self, url: str):
+        """The origin's entry, counted as in use until _checkin"""
+        origin = get_origin(url)
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._sessions.get(origin)
+            if entry is None:
+                entry = _Origin(self._new_session(), now)
+                self._sessions[origin] = entry
+                while len(self._sessions) > self.max_origins:
+                    _, old = self._sessions.popitem(last=False)
+                    self._evict(old)
+            else:
+                entry.last_used = now
+                self._sessions.move_to_end(origin)
+            if entry.in_flight >= self.max_connections_per_host:
+                self._stats['overflow'] += 1
+            entry.in_flight += 1
+            return entry
+
+    def _checkin(self, entry):
+        with self._lock:
+            entry.in_flight -= 1
+            entry.last_used = time.monotonic()
+            if entry.evicted and not entry.in_flight:
+                self._close(entry)
+
+    def request(self, method: str, url: str, **kwargs):
+        """Send a request through its origin's keep-alive session"""
+        entry = self._checkout(url)
+        try:
+            return entry.session.request(method, url, **kwargs)
+        finally:
+            self._checkin(entry)
+
+    def warm(self, origins=(), timeout=5, executor=None):
+        """Import requests and open a keep-alive connection to each origin; returns count opened
+
+        With an executor the origins are contacted in parallel and this
+        returns after at most `timeout` seconds (name resolution is not bound
+        by the request timeout); slower connections finish in the background.
+        """
+        self._new_session().close()
+
+        def connect(origin):
+            try:
+                # Any response (even 404) leaves a pooled connection behind
+                self.request('HEAD', origin, timeout=timeout)
+                return True
+            except Exception:
+                return False  # Unreachable now; the first stats call will find out too
+
+        origins = list(dict.fromkeys(get_origin(origin) for origin in origins))
+        if executor is None:
+            return sum(map(connect, origins))
+        done, _ = wait([executor.submit(connect, origin) for origin in origins], timeout=timeout)
+        return sum(future.result() for future in done)
+
+    def get(self, url: str, **kwargs):
+        """GET a URL through its origin's keep-alive session"""
+        return self.request('GET', url, **kwargs)
+
+    def evict_idle(self) -> int:
+        """Close sessions unused for idle_timeout seconds; returns count"""
+        cutoff = time.monotonic() - self.idle_timeout
+        with self._lock:
+            idle = [
+                origin for origin, entry in self._sessions.items()
+                if entry.last_used < cutoff and not entry.in_flight
+            ]
+            for origin in idle:
+                self._evict(self._sessions.pop(origin))
+        return len(idle)
+
+    def close_all(self):
+        """Close every pooled session (those in use once their requests finish)"""
+        with self._lock:
+            while self._sessions:
+                _, entry = self._sessions.popitem(last=False)
+                self._evict(entry)
+
+    def stats(self) -> dict:
+        """Pool statistics: origins, open connections, handshakes, reuse ratio"""
+        with self._lock:
+            handshakes = self._stats['handshakes']
+            requests_made = self._stats['requests']
+            open_connections = 0
+            for entry in self._sessions.values():
+                h, r, o = _pool_counters(entry.session)
+                handshakes += h
+                requests_made += r
+                open_connections += o
+            evictions = self._stats['evictions']
+            overflow = self._stats['overflow']
+            deferred_closes = self._stats['deferred_closes']
+            origins = len(self._sessions)
+
+        reused = max(requests_made - handshakes, 0)
+        return {
+            'origins': origins,
+            'max_origins': self.max_origins,
+            'max_connections_per_host': self.max_connections_per_host,
+            'open_connections': open_connections,
+            'handshakes': handshakes,
+            'requests': requests_made,
+            'reused_requests': reused,
+            'reuse_ratio': round(reused / requests_made, 4) if requests_made else 0.0,
+            'evictions': evictions,
+            'deferred_closes': deferred_closes,
+            'overflow': overflow
+        }
+
+    def start_reaper(self, interval=60, on_error=None):
+        """Start the background thread that closes idle sessions (failures go to on_error(e))"""
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.evict_idle()
+                except Exception as e:
+                    if on_error is not None:
+                        on_error(e)
+
+        threading.Thread(target=run, name='upstream-reaper', daemon=True).start()
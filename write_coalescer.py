@@ -0,0 +1,113 @@
+"""
+Write Coalescer
+Collapses bursts of full saves for the same key into a single write.
+
+The first save for a key schedules a flush `delay` seconds later; saves that
+arrive before then just replace the pending value. When the flush runs, the
+latest value is written once and every caller waiting on that batch gets the
+same result, so success still means "on disk". Readers call flush(key) first
+to see their own writes, and flush_all() runs on shutdown.
+"""
+
+import threading
+
+
+class _Batch:
+    """Pending value for one key plus the callers waiting on it"""
+
+    def __init__(self, value):
+        self.value = value
+        self.submitted = 1
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.timer = None
+
+
+class WriteCoalescer:
+    """Debounces write(key, value) calls per key with a bounded delay"""
+
+    def __init__(self, write, delay=0.2, timeout=30):
+        self.write = write  # write(key, value) -> result
+        self.delay = delay
+        self.timeout = timeout
+
+        self._pending = {}  # key -> _Batch
+        self._lock = threading.Lock()
+        self._write_locks = {}  # key -> [Lock, flushes using it]; keeps writes for one key ordered
+        self._stats = {'submitted': 0, 'writes': 0, 'errors': 0}
+
+    def submit(self, key, value):
+        """Queue a value for key and wait until it (or a newer one) is written"""
+        with self._lock:
+            self._stats['submitted'] += 1
+            batch = self._pending.get(key)
+            if batch is None:
+                batch = _Batch(value)
+                self._pending[key] = batch
+                batch.timer = threading.Timer(self.delay, self.flush, args=(key,))
+                batch.timer.daemon = True
+                batch.timer.start()
+            else:
+                batch.value = value
+                batch.submitted += 1
+
+        if self.delay <= 0:
+            self.flush(key)
+
+        if not batch.done.wait(self.timeout):
+            raise TimeoutError(f'Write for {key!r} did not complete within {self.timeout}s')
+        if batch.error is not None:
+            raise batch.error
+        return batch.result
+
+    def flush(self, key):
+        """Write the pending value for key now (no-op if nothing is pending)"""
+        with self._lock:
+            write_lock = self._write_locks.setdefault(key, [threading.Lock(), 0])
+            write_lock[1] += 1
+
+        try:
+            # Holding the key's write lock while popping keeps flushes in order
+            with write_lock[0]:
+                with self._lock:
+                    batch = self._pending.pop(key, None)
+                if batch is None:
+                    return
+
+                if batch.timer:
+                    batch.timer.cancel()
+
+                try:
+                    batch.result = self.write(key, batch.value)
+                    with self._lock:
+                        self._stats['writes'] += 1
+                except Exception as e:
+                    batch.error = e
+                    with self._lock:
+                        self._stats['errors'] += 1
+                finally:
+                    batch.done.set()
+        finally:
+            # The last flush out drops the lock, so there is one per key being written, not per key ever seen
+            with self._lock:
+                write_lock[1] -= 1
+                if write_lock[1] == 0:
+                    del self._write_locks[key]
+
+    def flush_all(self):
+        """Write everything that is pending (used on shutdown)"""
+        with self._lock:
+            keys = list(self._pending)
+        for key in keys:
+            self.flush(key)
+
+    def stats(self) -> dict:
+        """Counters: saves submitted, writes performed, saves coalesced away"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['pending'] = len(self._pending)
+            stats['write_locks'] = len(self._write_locks)
+        stats['coalesced'] = max(stats['submitted'] - stats['writes'] - stats['errors'] - stats['pending'], 0)
+        stats['delay'] = self.delay
+        return stats